@@ -30,6 +30,35 @@ import sqlalchemy
 import structlog
 import werkzeug
 
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class TokenAuth(HTTPTokenAuth):
+    """Token authentication which loads the user row when the current user is first asked for.
+
+    The token is verified with the cached identity of the user, which is enough for the role
+    checks. Endpoints get the user row from current_user().
+    """
+
+    def current_user(self):
+        from dds_web.security.auth import UserIdentity
+
+        user = super().current_user()
+        if isinstance(user, UserIdentity):
+            user = user.load()
+            flask.g.flask_httpauth_user = user
+        return user
+
+    def current_identity(self):
+        """Get the identity of the authenticated user without loading the user row.
+
+        Returns the cached identity, or the user row if it has already been loaded.
+        """
+        return flask.g.get("flask_httpauth_user")
+
+
 ####################################################################################################
 # GLOBAL VARIABLES ############################################################## GLOBAL VARIABLES #
 ####################################################################################################
@@ -46,7 +75,7 @@ ma = Marshmallow()
 # Authentication
 oauth = auth_flask_client.OAuth()
 basic_auth = HTTPBasicAuth()
-auth = HTTPTokenAuth()
+auth = TokenAuth()
 
 # Login - web routes
 login_manager = flask_login.LoginManager()
@@ -305,6 +334,10 @@ def create_app(testing=False, database_uri=None):
             monitor_usage,
             update_unit_sto4,
             update_unit_quota,
+            project_statistics,
+            send_emails,
+            daily_storage,
+            fill_key_pairs,
         )
 
         # Add flask commands - general
@@ -314,6 +347,7 @@ def create_app(testing=False, database_uri=None):
         app.cli.add_command(update_unit_quota)
         app.cli.add_command(update_uploaded_file_with_log)
         app.cli.add_command(lost_files_s3_db)
+        app.cli.add_command(project_statistics)
 
         # Add flask commands - cronjobs
         app.cli.add_command(set_available_to_expired)
@@ -323,6 +357,9 @@ def create_app(testing=False, database_uri=None):
         app.cli.add_command(send_usage)
         app.cli.add_command(collect_stats)
         app.cli.add_command(monitor_usage)
+        app.cli.add_command(send_emails)
+        app.cli.add_command(daily_storage)
+        app.cli.add_command(fill_key_pairs)
 
         # Make version available inside jinja templates:
         @app.template_filter("dds_version")
@@ -380,10 +417,14 @@ def create_app(testing=False, database_uri=None):
             ENCRYPTION_KEY_BIT_LENGTH = 256
             ENCRYPTION_KEY_CHAR_LENGTH = int(ENCRYPTION_KEY_BIT_LENGTH / 8)
 
-            if len(app.config.get("SECRET_KEY")) != ENCRYPTION_KEY_CHAR_LENGTH:
-                from dds_web.errors import KeyLengthError
+            for secret_key in [
+                app.config.get("SECRET_KEY"),
+                *app.config.get("PREVIOUS_SECRET_KEYS", []),
+            ]:
+                if len(secret_key) != ENCRYPTION_KEY_CHAR_LENGTH:
+                    from dds_web.errors import KeyLengthError
 
-                raise KeyLengthError(ENCRYPTION_KEY_CHAR_LENGTH)
+                    raise KeyLengthError(ENCRYPTION_KEY_CHAR_LENGTH)
 
             return app
     except sqlalchemy.exc.OperationalError as err:
@@ -6,6 +6,8 @@
 
 # Standard library
 import functools
+import hashlib
+import http
 
 # Installed
 import boto3
@@ -205,3 +207,52 @@ def logging_bind_request(func):
                 raise
 
     return wrapper_logging_bind_request
+
+
+def conditional_get(change_stamp):
+    """Answer GET requests with 304 Not Modified when the client already has the response.
+
+    change_stamp is called before the response is built and must return a value that changes
+    whenever the response would, or None to skip the check. The ETag is calculated from the
+    change stamp, the request and the user, and is returned with the response.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def check_if_modified(*args, **kwargs):
+            # Only for the requests themselves, not when the method is called by another method
+            if flask.request.method != "GET":
+                return func(*args, **kwargs)
+
+            stamp = change_stamp()
+            if stamp is None:
+                return func(*args, **kwargs)
+
+            etag = hashlib.sha256(
+                repr(
+                    (
+                        flask.request.path,
+                        sorted(flask.request.args.items(multi=True)),
+                        flask.request.get_data(),
+                        get_username_or_request_ip(),
+                        stamp,
+                    )
+                ).encode()
+            ).hexdigest()
+
+            if flask.request.if_none_match.contains_weak(etag):
+                response = flask.Response(status=http.HTTPStatus.NOT_MODIFIED)
+                response.set_etag(etag)
+                return response
+
+            @flask.after_this_request
+            def add_etag(response):
+                if response.status_code == http.HTTPStatus.OK:
+                    response.set_etag(etag)
+                return response
+
+            return func(*args, **kwargs)
+
+        return check_if_modified
+
+    return decorator
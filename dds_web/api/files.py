@@ -26,6 +26,7 @@ from dds_web.api.dds_decorators import (
     logging_bind_request,
     json_required,
     handle_validation_errors,
+    conditional_get,
 )
 from dds_web.errors import (
     AccessDeniedError,
@@ -287,6 +288,7 @@ class ListFiles(flask_restful.Resource):
 
     @auth.login_required(role=["Unit Admin", "Unit Personnel", "Project Owner", "Researcher"])
     @logging_bind_request
+    @conditional_get(change_stamp=dds_web.utils.project_change_stamp)
     @handle_validation_errors
     def get(self):
         """Get a list of files within the specified folder."""
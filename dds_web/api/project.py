@@ -27,6 +27,7 @@ from dds_web.api.dds_decorators import (
     json_required,
     handle_validation_errors,
     handle_db_error,
+    conditional_get,
 )
 from dds_web.errors import (
     AccessDeniedError,
@@ -44,7 +45,11 @@ from dds_web.errors import (
 )
 from dds_web.api.user import AddUser
 from dds_web.api.schemas import project_schemas, user_schemas
-from dds_web.security.project_user_keys import obtain_project_private_key, share_project_private_key
+from dds_web.security.project_user_keys import (
+    obtain_project_private_key,
+    share_project_private_key,
+    user_private_key,
+)
 from dds_web.security.auth import get_user_roles_common
 from dds_web.api.files import check_eligibility_for_deletion
 
@@ -57,6 +62,7 @@ class ProjectStatus(flask_restful.Resource):
 
     @auth.login_required
     @logging_bind_request
+    @conditional_get(change_stamp=dds_web.utils.project_change_stamp)
     @handle_validation_errors
     def get(self):
         """Get current project status and optionally entire status history"""
@@ -176,6 +182,14 @@ class ProjectStatus(flask_restful.Resource):
             try:
                 project.project_statuses.append(new_status_row)
                 project.busy = False  # TODO: Use set_busy instead?
+
+                # Mail users once project is made available - saved with the status change
+                if new_status == "Available" and send_email:
+                    for user in project.researchusers:
+                        AddUser.compose_and_send_email_to_user(
+                            userobj=user.researchuser, mail_type="project_release", project=project
+                        )
+
                 db.session.commit()
                 flask.current_app.logger.info(
                     f"Busy status set. Project: '{project.public_id}', Busy: False"
@@ -195,13 +209,6 @@ class ProjectStatus(flask_restful.Resource):
                     ),
                 ) from err
 
-            # Mail users once project is made available
-            if new_status == "Available" and send_email:
-                for user in project.researchusers:
-                    AddUser.compose_and_send_email_to_user(
-                        userobj=user.researchuser, mail_type="project_release", project=project
-                    )
-
             return_message = f"{project.public_id} updated to status {new_status}" + (
                 " (aborted)" if new_status == "Archived" and is_aborted else ""
             )
@@ -561,6 +568,241 @@ class ProjectStatus(flask_restful.Resource):
             db.session.delete(user)
 
 
+class ProjectStatusBatch(flask_restful.Resource):
+    """Update the status of several projects at once."""
+
+    # Deleting and archiving remove the project data and are done one project at a time
+    batch_statuses = ["Available", "In Progress", "Expired"]
+    max_projects = 100
+
+    @auth.login_required(role=["Unit Admin", "Unit Personnel"])
+    @logging_bind_request
+    @json_required
+    @handle_validation_errors
+    def post(self):
+        """Change the status of the specified projects.
+
+        All transitions are validated before any status is changed and the projects which cannot
+        be changed are reported instead of failing the request. Projects which already have the
+        new status are reported as unchanged, so the request can be retried.
+        """
+        json_input = flask.request.get_json(silent=True)  # Already checked by json_required
+        new_status = json_input.get("new_status")
+        if not new_status:
+            raise DDSArgumentError(message="No status transition provided. Specify the new status.")
+        if new_status not in self.batch_statuses:
+            raise DDSArgumentError(
+                message=(
+                    f"The status cannot be changed to '{new_status}' for several projects at once. "
+                    f"Possible statuses: {', '.join(self.batch_statuses)}."
+                )
+            )
+
+        project_ids = json_input.get("projects")
+        if (
+            not project_ids
+            or not isinstance(project_ids, list)
+            or not all(isinstance(x, str) for x in project_ids)
+        ):
+            raise DDSArgumentError(message="Specify the projects as a list of project IDs.")
+        project_ids = list(dict.fromkeys(project_ids))
+        if len(project_ids) > self.max_projects:
+            raise DDSArgumentError(
+                message=(
+                    f"The status can be changed for at most {self.max_projects} projects at once."
+                )
+            )
+
+        send_email = json_input.get("send_email", True)
+        deadline_in = json_input.get("deadline")
+        if deadline_in is not None and type(deadline_in) is not int:
+            raise DDSArgumentError(
+                message="The deadline attribute passed should be of type Int (i.e a number)."
+            )
+
+        # Find the projects which can be changed
+        results = {}
+        current_user = auth.current_user()
+        projects = {
+            project.public_id: project
+            for project in models.Project.query.filter(
+                models.Project.public_id.in_(project_ids)
+            ).all()
+        }
+        candidates = []
+        for project_id in project_ids:
+            project = projects.get(project_id)
+            if not project:
+                results[project_id] = ("failed", "The specified project does not exist.")
+            elif project.unit_id != current_user.unit_id:
+                results[project_id] = ("failed", "Project access denied.")
+            elif project.current_status == new_status:
+                results[project_id] = ("unchanged", f"The project is already {new_status}.")
+            else:
+                candidates.append(project.id)
+
+        claimed = self.set_busy_projects(project_ids=candidates)
+        for project_id in project_ids:
+            if project_id not in results and projects[project_id].id not in claimed:
+                results[project_id] = (
+                    "failed",
+                    "The status for the project is already in the process of being changed.",
+                )
+
+        try:
+            self.change_statuses(
+                project_ids=claimed,
+                new_status=new_status,
+                deadline_in=deadline_in,
+                send_email=send_email,
+                results=results,
+            )
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            flask.current_app.logger.exception(err)
+            db.session.rollback()
+            self.unset_busy_projects(project_ids=claimed)
+            raise DatabaseError(
+                message=str(err),
+                alt_message=(
+                    "Status was not updated"
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else ": Server Error."
+                    )
+                ),
+            ) from err
+        except:
+            db.session.rollback()
+            self.unset_busy_projects(project_ids=claimed)
+            raise
+
+        updated = sum(result == "updated" for result, _ in results.values())
+        return {
+            "message": (
+                f"{updated} of {len(project_ids)} projects updated to status {new_status}."
+                + (
+                    f" E-mail notifications have{' not ' if not send_email else ' '}been sent."
+                    if new_status == "Available" and updated
+                    else ""
+                )
+            ),
+            "projects": [
+                {
+                    "project": project_id,
+                    "result": results[project_id][0],
+                    "message": results[project_id][1],
+                }
+                for project_id in project_ids
+            ],
+        }
+
+    @staticmethod
+    def set_busy_projects(project_ids):
+        """Set the projects which are not busy as busy with one update and return their ids."""
+        if not project_ids:
+            return set()
+
+        try:
+            claimed = {
+                row.id
+                for row in db.session.query(models.Project.id)
+                .filter(models.Project.id.in_(project_ids), models.Project.busy.is_(False))
+                .with_for_update()
+                .all()
+            }
+            if claimed:
+                models.Project.query.filter(models.Project.id.in_(claimed)).update(
+                    {"busy": True}, synchronize_session=False
+                )
+            db.session.commit()
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            flask.current_app.logger.exception(err)
+            db.session.rollback()
+            raise DatabaseError(message=str(err), alt_message="Status was not updated.") from err
+
+        flask.current_app.logger.info(f"Busy status set for {len(claimed)} projects.")
+        return claimed
+
+    @staticmethod
+    def unset_busy_projects(project_ids):
+        """Set the projects as not busy with one update, after the status change failed."""
+        if not project_ids:
+            return
+
+        try:
+            models.Project.query.filter(models.Project.id.in_(project_ids)).update(
+                {"busy": False}, synchronize_session=False
+            )
+            db.session.commit()
+        except sqlalchemy.exc.SQLAlchemyError as err:
+            flask.current_app.logger.exception(err)
+            db.session.rollback()
+
+    def change_statuses(self, project_ids, new_status, deadline_in, send_email, results):
+        """Validate the transitions, add the new statuses and queue the emails in one commit."""
+        if not project_ids:
+            return
+
+        # Load the projects with their statuses and users, to not query them one by one
+        projects = (
+            models.Project.query.filter(models.Project.id.in_(project_ids))
+            .options(
+                sqlalchemy.orm.selectinload(models.Project.project_statuses),
+                sqlalchemy.orm.selectinload(models.Project.researchusers).joinedload(
+                    models.ProjectUsers.researchuser
+                ),
+                sqlalchemy.orm.joinedload(models.Project.responsible_unit),
+            )
+            .all()
+        )
+
+        # Validate all transitions before changing any of the projects
+        curr_date = dds_web.utils.current_time()
+        status_change = ProjectStatus()
+        new_status_rows = []
+        for project in projects:
+            try:
+                if new_status == "Available":
+                    new_status_row = status_change.release_project(
+                        project=project,
+                        current_time=curr_date,
+                        deadline_in=deadline_in or project.responsible_unit.days_in_available,
+                    )
+                elif new_status == "In Progress":
+                    new_status_row = status_change.retract_project(
+                        project=project, current_time=curr_date
+                    )
+                else:
+                    new_status_row = status_change.expire_project(
+                        project=project,
+                        current_time=curr_date,
+                        deadline_in=deadline_in or project.responsible_unit.days_in_expired,
+                    )
+            except DDSArgumentError as err:
+                results[project.public_id] = ("failed", err.description)
+                continue
+            new_status_rows.append((project, new_status_row))
+
+        for project, new_status_row in new_status_rows:
+            project.project_statuses.append(new_status_row)
+            results[project.public_id] = ("updated", f"Updated to status {new_status}.")
+
+            # Mail users once project is made available - saved with the status change
+            if new_status == "Available" and send_email:
+                for user in project.researchusers:
+                    AddUser.compose_and_send_email_to_user(
+                        userobj=user.researchuser, mail_type="project_release", project=project
+                    )
+
+        # The projects which could not be changed are also set as not busy
+        models.Project.query.filter(models.Project.id.in_(project_ids)).update(
+            {"busy": False}, synchronize_session=False
+        )
+        db.session.commit()
+        flask.current_app.logger.info(f"Busy status set. Projects: {len(project_ids)}, Busy: False")
+
+
 class GetPublic(flask_restful.Resource):
     """Gets the public key beloning to the current project."""
 
@@ -613,23 +855,24 @@ class UserProjects(flask_restful.Resource):
 
     @auth.login_required
     @logging_bind_request
+    @conditional_get(change_stamp=lambda: UserProjects.listing_change_stamp())
+    @handle_validation_errors
     def get(self):
         """Get info regarding all projects which user is involved in."""
         return self.format_project_dict(current_user=auth.current_user())
 
-    def format_project_dict(self, current_user):
+    def format_project_dict(self, current_user, default_limit=None):
         """Given a logged in user, fetch projects and return as dict.
 
+        The projects can be filtered, sorted and paginated, see ProjectListingSchema. When a page
+        is requested, the public ID to continue after is returned in "next_page" and the totals
+        still cover all matching projects.
+
         Also used by web/user.py projects_info()
         """
         # TODO: Return different things depending on if unit or not
         all_projects = list()
 
-        # Total number of GB hours and cost saved in the db for the specific unit
-        total_bhours_db = 0.0
-        total_cost_db = 0.0
-        total_size = 0
-
         # Get json input from request
         request_json = flask.request.get_json(silent=True)
         usage_arg = request_json.get("usage") if request_json else False
@@ -639,27 +882,80 @@ class UserProjects(flask_restful.Resource):
             "Unit Personnel",
         ]
 
+        # Get filtering, sorting and pagination options - from query string or json
+        listing_args = project_schemas.ProjectListingSchema().load(
+            {**(request_json or {}), **flask.request.args.to_dict()}
+        )
+        limit = listing_args.get("limit", default_limit)
+
         # Get info for projects
         get_all = request_json.get("show_all", False) if request_json else False
         all_filters = (
             [] if get_all else [models.Project.is_active == True]
         )  # Default is to only get active projects
-        all_filters.append(
-            models.Project.public_id.in_([x.public_id for x in current_user.projects])
-        )
-
-        # Apply the filters
-        user_projects = models.Project.query.filter(sqlalchemy.and_(*all_filters)).all()
+        all_filters.extend(self.user_project_filters(user=current_user))
+        all_filters.extend(self.listing_filters(listing_args=listing_args))
 
         researcher = False
         if current_user.role not in ["Super Admin", "Unit Admin", "Unit Personnel"]:
             researcher = True
 
+        # Get the projects and all listed information in one query
+        next_page = None
+        try:
+            projects_query = self.project_listing_query(user=current_user, filters=all_filters)
+            projects_query = self.sort_and_paginate(
+                query=projects_query,
+                filters=all_filters,
+                sort=listing_args.get("sort"),
+                descending=listing_args.get("order") == "desc",
+                after=listing_args.get("after"),
+            )
+            if limit:
+                user_projects = projects_query.limit(limit + 1).all()
+                if len(user_projects) > limit:
+                    user_projects = user_projects[:limit]
+                    next_page = user_projects[-1][0].public_id
+            else:
+                user_projects = projects_query.all()
+
+            # Totals for all matching projects, not only the current page
+            if limit:
+                total_size = int(
+                    db.session.query(
+                        sqlalchemy.func.coalesce(sqlalchemy.func.sum(models.Project.size), 0)
+                    )
+                    .filter(*all_filters)
+                    .scalar()
+                )
+                matching_ids = [
+                    project_id
+                    for (project_id,) in db.session.query(models.Project.id).filter(*all_filters)
+                ]
+            else:
+                total_size = sum(row[0].size for row in user_projects)
+                matching_ids = [row[0].id for row in user_projects]
+
+            # Get usage for all projects in one query
+            projects_usage = self.projects_usage(project_ids=matching_ids) if usage else {}
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            raise DatabaseError(
+                message=str(err),
+                alt_message=(
+                    "Could not get the project information"
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else "."
+                    ),
+                ),
+            ) from err
+
         # Get info for all projects
-        for p in user_projects:
-            project_creator = p.creator.name if p.creator else None
+        for p, proj_access, creator_name, unit_name in user_projects:
+            project_creator = creator_name
             if researcher:
-                project_creator = p.responsible_unit.external_display_name
+                project_creator = unit_name
 
             project_info = {
                 "Project ID": p.public_id,
@@ -668,39 +964,15 @@ class UserProjects(flask_restful.Resource):
                 "Status": p.current_status,
                 "Last updated": p.date_updated if p.date_updated else p.date_created,
                 "Created by": project_creator or "Former User",
+                "Size": p.size,
             }
 
-            # Get proj size and update total size
-            proj_size = p.size
-            total_size += proj_size
-            project_info["Size"] = proj_size
-
             if usage:
-                proj_bhours, proj_cost = self.project_usage(project=p)
-                total_bhours_db += proj_bhours
-                total_cost_db += proj_cost
+                proj_bhours, proj_cost = projects_usage.get(p.id, (0.0, 0.0))
                 # return ByteHours
                 project_info.update({"Usage": proj_bhours, "Cost": proj_cost})
 
-            try:
-                project_info["Access"] = (
-                    models.ProjectUserKeys.query.filter_by(
-                        project_id=p.id, user_id=current_user.username
-                    ).count()
-                    > 0
-                )
-            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
-                raise DatabaseError(
-                    message=str(err),
-                    alt_message=(
-                        "Could not get users project access information"
-                        + (
-                            ": Database malfunction."
-                            if isinstance(err, sqlalchemy.exc.OperationalError)
-                            else "."
-                        ),
-                    ),
-                ) from err
+            project_info["Access"] = bool(proj_access)
 
             all_projects.append(project_info)
 
@@ -712,33 +984,223 @@ class UserProjects(flask_restful.Resource):
         if current_user.role in ["Super Admin", "Unit Admin", "Unit Personnel"]:
             return_info["total_usage"] = {
                 # return ByteHours
-                "usage": total_bhours_db,
-                "cost": total_cost_db,
+                "usage": sum(bhours for bhours, _ in projects_usage.values()) if usage else 0.0,
+                "cost": sum(cost for _, cost in projects_usage.values()) if usage else 0.0,
             }
+        if limit:
+            return_info["next_page"] = next_page
 
         return return_info
 
+    @staticmethod
+    def listing_change_stamp():
+        """Get the change stamp of all projects the current user can list.
+
+        Covers the projects, their creators and the user's access to them. None if usage is
+        requested, since the usage changes with time.
+        """
+        request_json = flask.request.get_json(silent=True)
+        if request_json and request_json.get("usage"):
+            return None
+
+        # The identity is enough for the filters, the user row is not needed for 304 responses
+        current_user = auth.current_identity()
+        try:
+            projects = (
+                db.session.query(
+                    models.Project.id, models.Project.revision, models.Project.created_by
+                )
+                .filter(*UserProjects.user_project_filters(user=current_user))
+                .order_by(models.Project.id)
+                .all()
+            )
+            keys = (
+                db.session.query(models.ProjectUserKeys.project_id)
+                .filter(models.ProjectUserKeys.user_id == current_user.username)
+                .order_by(models.ProjectUserKeys.project_id)
+                .all()
+            )
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            raise DatabaseError(
+                message=str(err),
+                alt_message=(
+                    "Could not get the project information"
+                    + (
+                        ": Database malfunction."
+                        if isinstance(err, sqlalchemy.exc.OperationalError)
+                        else "."
+                    ),
+                ),
+            ) from err
+
+        return [tuple(row) for row in projects], [project_id for (project_id,) in keys]
+
+    @staticmethod
+    def user_project_filters(user):
+        """Get the filters limiting the project query to the projects the user can see."""
+        if user.role == "Super Admin":
+            return []
+
+        if user.role in ["Unit Admin", "Unit Personnel"]:
+            return [models.Project.unit_id == user.unit_id]
+
+        return [
+            models.Project.id.in_(
+                sqlalchemy.select(models.ProjectUsers.project_id).where(
+                    models.ProjectUsers.user_id == user.username
+                )
+            )
+        ]
+
+    @staticmethod
+    def listing_filters(listing_args):
+        """Get the filters for the requested status, creation dates and search string."""
+        filters = []
+        if listing_args.get("status"):
+            filters.append(models.Project.current_status == listing_args["status"])
+        if listing_args.get("created_after"):
+            filters.append(
+                models.Project.date_created
+                >= datetime.datetime.combine(listing_args["created_after"], datetime.time.min)
+            )
+        if listing_args.get("created_before"):
+            filters.append(
+                models.Project.date_created
+                < datetime.datetime.combine(
+                    listing_args["created_before"] + datetime.timedelta(days=1), datetime.time.min
+                )
+            )
+        if listing_args.get("search"):
+            search = listing_args["search"].lower()
+            filters.append(
+                sqlalchemy.or_(
+                    sqlalchemy.func.lower(models.Project.title).contains(search, autoescape=True),
+                    sqlalchemy.func.lower(models.Project.pi).contains(search, autoescape=True),
+                )
+            )
+        return filters
+
+    @staticmethod
+    def sort_and_paginate(query, filters, sort=None, descending=False, after=None):
+        """Order the project query and continue after the project with public ID 'after'.
+
+        The project id is used as tie breaker, so that the order is stable between pages.
+        """
+        no_date = datetime.datetime(1970, 1, 1)
+        sort_key = {
+            "id": sqlalchemy.func.coalesce(models.Project.public_id, ""),
+            "title": sqlalchemy.func.coalesce(models.Project.title, ""),
+            "pi": sqlalchemy.func.coalesce(models.Project.pi, ""),
+            "status": sqlalchemy.func.coalesce(models.Project.current_status, ""),
+            "created": sqlalchemy.func.coalesce(models.Project.date_created, no_date),
+            "updated": sqlalchemy.func.coalesce(
+                models.Project.date_updated, models.Project.date_created, no_date
+            ),
+            "size": models.Project.size,
+        }.get(sort)
+        sort_columns = [models.Project.id] if sort_key is None else [sort_key, models.Project.id]
+
+        if after:
+            # Get the sort values of the last project on the previous page
+            last_row = (
+                db.session.query(*sort_columns)
+                .filter(models.Project.public_id == after, *filters)
+                .one_or_none()
+            )
+            if not last_row:
+                raise DDSArgumentError(message=f"Cannot continue after project '{after}'.")
+
+            # Keyset condition: rows after the last row in the requested order
+            condition = None
+            for index in reversed(range(len(sort_columns))):
+                column = sort_columns[index]
+                beyond = column < last_row[index] if descending else column > last_row[index]
+                condition = (
+                    beyond
+                    if condition is None
+                    else sqlalchemy.or_(
+                        beyond, sqlalchemy.and_(column == last_row[index], condition)
+                    )
+                )
+            query = query.filter(condition)
+
+        return query.order_by(
+            *[column.desc() if descending else column.asc() for column in sort_columns]
+        )
+
+    @staticmethod
+    def project_listing_query(user, filters):
+        """Query the projects together with the information listed for each of them.
+
+        Each row contains the project, whether the user has access to the project, the name of
+        the creator and the display name of the unit.
+        """
+        # Whether the user has a key for the project
+        has_access = (
+            sqlalchemy.exists()
+            .where(models.ProjectUserKeys.project_id == models.Project.id)
+            .where(models.ProjectUserKeys.user_id == user.username)
+            .correlate(models.Project)
+        )
+
+        # Base table only, the creator name does not require the user subclass tables
+        creator = models.User.__table__
+
+        return (
+            db.session.query(
+                models.Project,
+                has_access,
+                creator.c.name,
+                models.Unit.external_display_name,
+            )
+            .outerjoin(creator, creator.c.username == models.Project.created_by)
+            .outerjoin(models.Unit, models.Unit.id == models.Project.unit_id)
+            .filter(*filters)
+        )
+
     @staticmethod
     def project_usage(project):
+        """Calculate the usage (byte hours) and cost of a project."""
+        return UserProjects.projects_usage(project_ids=[project.id]).get(project.id, (0.0, 0.0))
+
+    @staticmethod
+    def projects_usage(project_ids, now=None):
+        """Calculate the usage (byte hours) and cost of several projects in one query.
+
+        The byte hours of each version are calculated in the database, from upload until deletion
+        or now. Returns a dict with the project id as key and (byte hours, cost) as value.
+        Projects without versions are not included.
+        """
         # Calculate approximate cost per gbhour: kr per gb per month / (days * hours)
         cost_gbhour = 0.09 / (30 * 24)
-        bhours = 0.0
-        cost = 0.0
 
-        for v in project.file_versions:
-            # Calculate hours of the current file
-            time_deleted = v.time_deleted if v.time_deleted else dds_web.utils.current_time()
-            time_uploaded = v.time_uploaded
+        if not project_ids:
+            return {}
+
+        if now is None:
+            now = dds_web.utils.current_time()
 
-            # Calculate and accumulate BHours for all versions in project
-            bhours += dds_web.utils.calculate_bytehours(
-                minuend=time_deleted, subtrahend=time_uploaded, size_bytes=v.size_stored
+        # Cast size to decimal to avoid overflowing the product
+        byte_microseconds = sqlalchemy.func.sum(
+            sqlalchemy.func.timestampdiff(
+                sqlalchemy.literal_column("MICROSECOND"),
+                models.Version.time_uploaded,
+                sqlalchemy.func.coalesce(models.Version.time_deleted, now),
             )
+            * sqlalchemy.cast(models.Version.size_stored, sqlalchemy.Numeric(65, 0))
+        )
+        usage_query = (
+            db.session.query(models.Version.project_id, byte_microseconds)
+            .filter(models.Version.project_id.in_(project_ids))
+            .group_by(models.Version.project_id)
+        )
 
-        # Save file cost to project info and increase total unit cost
-        cost = (bhours / 1e9) * cost_gbhour
+        usage = {}
+        for project_id, project_byte_microseconds in usage_query:
+            bhours = float(project_byte_microseconds or 0) / (60 * 60 * 1e6)
+            usage[project_id] = (bhours, (bhours / 1e9) * cost_gbhour)
 
-        return bhours, cost
+        return usage
 
 
 class RemoveContents(flask_restful.Resource):
@@ -782,6 +1244,9 @@ class RemoveContents(flask_restful.Resource):
         # If ok delete from database
         try:
             models.File.query.filter(models.File.project_id == project.id).delete()
+            # Bulk deletes bypass the file listeners, reset the statistics here
+            project.size = 0
+            project.num_files = 0
             # TODO: put in class
             project.date_updated = dds_web.utils.current_time()
 
@@ -1069,37 +1534,40 @@ class ProjectAccess(flask_restful.Resource):
         """Give specific user project access."""
         # Loop through and check that the project(s) is(are) active
         fix_errors = {}
-        for proj in project_list:
-            try:
-                if proj.is_active:
-                    project_keys_row = models.ProjectUserKeys.query.filter_by(
-                        project_id=proj.id, user_id=user.username
-                    ).one_or_none()
-                    if not project_keys_row:
-                        # Make sure that Researchers are also listed in project users
-                        if (
-                            user.role == "Researcher"
-                            and not models.ProjectUsers.query.filter_by(
-                                project_id=proj.id, user_id=user.username
-                            ).one_or_none()
-                        ):
-                            # New row in association table
-                            new_projectuser_row = models.ProjectUsers(
-                                project_id=proj.id, user_id=user.username
+        user_token = dds_web.security.auth.obtain_current_encrypted_token()
+        with user_private_key(user=current_user, token=user_token) as private_key:
+            for proj in project_list:
+                try:
+                    if proj.is_active:
+                        project_keys_row = models.ProjectUserKeys.query.filter_by(
+                            project_id=proj.id, user_id=user.username
+                        ).one_or_none()
+                        if not project_keys_row:
+                            # Make sure that Researchers are also listed in project users
+                            if (
+                                user.role == "Researcher"
+                                and not models.ProjectUsers.query.filter_by(
+                                    project_id=proj.id, user_id=user.username
+                                ).one_or_none()
+                            ):
+                                # New row in association table
+                                new_projectuser_row = models.ProjectUsers(
+                                    project_id=proj.id, user_id=user.username
+                                )
+                                # Append association -- only one required, not both ways
+                                proj.researchusers.append(new_projectuser_row)
+
+                            share_project_private_key(
+                                from_user=current_user,
+                                to_another=user,
+                                project=proj,
+                                from_user_token=user_token,
+                                user_private_key=private_key,
                             )
-                            # Append association -- only one required, not both ways
-                            proj.researchusers.append(new_projectuser_row)
-
-                        share_project_private_key(
-                            from_user=current_user,
-                            to_another=user,
-                            project=proj,
-                            from_user_token=dds_web.security.auth.obtain_current_encrypted_token(),
-                        )
-            except KeyNotFoundError as keyerr:
-                fix_errors[proj.public_id] = (
-                    "You do not have access to this project. Please contact the responsible unit."
-                )
+                except KeyNotFoundError as keyerr:
+                    fix_errors[proj.public_id] = (
+                        "You do not have access to this project. Please contact the responsible unit."
+                    )
 
         return fix_errors
 
@@ -1126,6 +1594,7 @@ class ProjectInfo(flask_restful.Resource):
 
     @auth.login_required
     @logging_bind_request
+    @conditional_get(change_stamp=dds_web.utils.project_change_stamp)
     @handle_db_error
     def get(self):
         # Get project ID, project and verify access
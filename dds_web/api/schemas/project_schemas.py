@@ -46,7 +46,7 @@ def verify_project_exists(spec_proj):
 def verify_project_access(project):
     """Check users access to project."""
 
-    if project not in auth.current_user().projects:
+    if not dds_web.utils.has_project_access(project):
         raise ddserr.AccessDeniedError(
             message="Project access denied.",
             username=auth.current_user().username,
@@ -207,6 +207,44 @@ class ProjectRequiredSchema(marshmallow.Schema):
         return data.get("project_row")
 
 
+class ProjectListingSchema(marshmallow.Schema):
+    """Schema for filtering, sorting and paginating the project listing."""
+
+    status = marshmallow.fields.String(
+        required=False,
+        validate=marshmallow.validate.OneOf(
+            ["In Progress", "Available", "Expired", "Deleted", "Archived"]
+        ),
+    )
+    created_after = marshmallow.fields.Date(required=False)
+    created_before = marshmallow.fields.Date(required=False)
+    search = marshmallow.fields.String(
+        required=False, validate=marshmallow.validate.Length(min=1, max=255)
+    )
+    sort = marshmallow.fields.String(
+        required=False,
+        validate=marshmallow.validate.OneOf(
+            ["id", "title", "pi", "status", "created", "updated", "size"]
+        ),
+    )
+    order = marshmallow.fields.String(
+        required=False, load_default="asc", validate=marshmallow.validate.OneOf(["asc", "desc"])
+    )
+    limit = marshmallow.fields.Integer(
+        required=False, validate=marshmallow.validate.Range(min=1, max=1000)
+    )
+    after = marshmallow.fields.String(required=False)
+
+    class Meta:
+        unknown = marshmallow.EXCLUDE
+
+    @marshmallow.pre_load
+    def remove_empty_values(self, data, **kwargs):
+        """Ignore options without value, e.g. empty fields in the web form."""
+
+        return {key: value for key, value in data.items() if value not in (None, "")}
+
+
 class ProjectContentSchema(ProjectRequiredSchema):
     """ """
 
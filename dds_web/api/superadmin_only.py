@@ -22,6 +22,7 @@ from dds_web.api.dds_decorators import json_required, logging_bind_request, hand
 from dds_web import utils
 import dds_web.errors as ddserr
 from dds_web.api.user import AddUser
+from dds_web.security.project_user_keys import key_pair_pool_level
 
 
 # initiate bound logger
@@ -41,6 +42,7 @@ class AllUnits(flask_restful.Resource):
     def get(self):
         """Return info about unit to super admin."""
         all_units = models.Unit.query.all()
+        usage_per_unit = utils.units_usage()
 
         unit_info = [
             {
@@ -51,7 +53,7 @@ class AllUnits(flask_restful.Resource):
                 "Safespring Endpoint": u.sto2_endpoint,
                 "Days In Available": u.days_in_available,
                 "Days In Expired": u.days_in_expired,
-                "Size": u.size,
+                "Size": usage_per_unit.get(u.id, 0),
             }
             for u in all_units
         ]
@@ -90,6 +92,7 @@ class MOTD(flask_restful.Resource):
         new_motd = models.MOTD(message=motd)
         db.session.add(new_motd)
         db.session.commit()
+        utils.bump_global_settings_version()
 
         return {"message": "The MOTD was successfully added to the database."}
 
@@ -136,6 +139,7 @@ class MOTD(flask_restful.Resource):
 
         motd_to_deactivate.active = False
         db.session.commit()
+        utils.bump_global_settings_version()
 
         return {"message": "The MOTD was successfully deactivated in the database."}
 
@@ -318,6 +322,7 @@ class MaintenanceMode(flask_restful.Resource):
 
         current_mode.active = setting == "on"
         db.session.commit()
+        utils.bump_global_settings_version()
 
         return {"message": f"Maintenance set to: {setting.upper()}"}
 
@@ -431,6 +436,10 @@ class Statistics(flask_restful.Resource):
                 "TBHours Last Month": "Number of terrabyte hours that were recorded in the DDS the previous month. ",
                 "TBHours Total": "Total number of terrabyte hours that have been recorded in the DDS since going into production.",
             },
+            "key_pairs": {
+                "available": key_pair_pool_level(),
+                "pool_size": int(flask.current_app.config.get("KEY_PAIR_POOL_SIZE", 100)),
+            },
         }
 
 
@@ -5,12 +5,13 @@
 ####################################################################################################
 
 # Standard library
-import os
 import smtplib
+import threading
 import time
 import datetime
 
 # Installed
+import cachetools
 import flask
 import flask_restful
 from flask_restful import inputs
@@ -22,7 +23,7 @@ import http
 
 
 # Own modules
-from dds_web import auth, mail, db, basic_auth, limiter
+from dds_web import auth, db, basic_auth, limiter
 from dds_web.database import models
 import dds_web.utils
 import dds_web.forms
@@ -37,6 +38,7 @@ from dds_web.api.dds_decorators import (
 from dds_web.security.project_user_keys import (
     generate_invite_key_pair,
     share_project_private_key,
+    user_private_key,
 )
 from dds_web.security.tokens import encrypted_jwt_token, update_token_with_mfa
 from dds_web.security.auth import get_user_roles_common
@@ -224,21 +226,26 @@ class AddUser(flask_restful.Resource):
                 # Give new unit user access to all projects of the unit
                 auth.current_user().unit.invites.append(new_invite)
                 if auth.current_user().unit.projects:
-                    for unit_project in auth.current_user().unit.projects:
-                        if unit_project.is_active:
-                            try:
-                                share_project_private_key(
-                                    from_user=auth.current_user(),
-                                    to_another=new_invite,
-                                    from_user_token=dds_web.security.auth.obtain_current_encrypted_token(),
-                                    project=unit_project,
-                                )
-                            except ddserr.KeyNotFoundError as keyerr:
-                                projects_not_shared[unit_project.public_id] = (
-                                    "You do not have access to the project(s)"
-                                )
-                            else:
-                                goahead = True
+                    user_token = dds_web.security.auth.obtain_current_encrypted_token()
+                    with user_private_key(
+                        user=auth.current_user(), token=user_token
+                    ) as private_key:
+                        for unit_project in auth.current_user().unit.projects:
+                            if unit_project.is_active:
+                                try:
+                                    share_project_private_key(
+                                        from_user=auth.current_user(),
+                                        to_another=new_invite,
+                                        from_user_token=user_token,
+                                        project=unit_project,
+                                        user_private_key=private_key,
+                                    )
+                                except ddserr.KeyNotFoundError as keyerr:
+                                    projects_not_shared[unit_project.public_id] = (
+                                        "You do not have access to the project(s)"
+                                    )
+                                else:
+                                    goahead = True
                 else:
                     goahead = True
 
@@ -270,6 +277,9 @@ class AddUser(flask_restful.Resource):
         # Compose and send email
         status_code = http.HTTPStatus.OK
         if goahead:
+            AddUser.compose_and_send_email_to_user(
+                userobj=new_invite, mail_type="invite", link=link
+            )
             try:
                 db.session.commit()
             except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as sqlerr:
@@ -284,9 +294,6 @@ class AddUser(flask_restful.Resource):
                     ),
                 ) from sqlerr
 
-            AddUser.compose_and_send_email_to_user(
-                userobj=new_invite, mail_type="invite", link=link
-            )
             msg = f"{str(new_invite)} was successful."
         else:
             msg = (
@@ -376,6 +383,11 @@ class AddUser(flask_restful.Resource):
                     "status": ddserr.AccessDeniedError.code.value,
                 }
 
+        # If project is already released and not expired, send mail to user
+        send_email = send_email and project.current_status == "Available"
+        if send_email:
+            AddUser.compose_and_send_email_to_user(whom, "project_release", project=project)
+
         try:
             db.session.commit()
         except (
@@ -395,11 +407,6 @@ class AddUser(flask_restful.Resource):
                 ),
             ) from err
 
-        # If project is already released and not expired, send mail to user
-        send_email = send_email and project.current_status == "Available"
-        if send_email:
-            AddUser.compose_and_send_email_to_user(whom, "project_release", project=project)
-
         flask.current_app.logger.debug(
             f"{str(whom)} was given access to the {str(project)} as a {'Project Owner' if is_owner else 'Researcher'}."
         )
@@ -415,7 +422,7 @@ class AddUser(flask_restful.Resource):
     @staticmethod
     @logging_bind_request
     def compose_and_send_email_to_user(userobj, mail_type, link=None, project=None):
-        """Compose and send email"""
+        """Compose email and add it to the outbox, sent when the session is committed."""
         if hasattr(userobj, "emails"):
             recipients = [x.email for x in userobj.emails]
         else:
@@ -454,19 +461,6 @@ class AddUser(flask_restful.Resource):
             recipients=recipients,
         )
 
-        # Need to attach the image to be able to use it
-        msg.attach(
-            "scilifelab_logo.png",
-            "image/png",
-            open(
-                os.path.join(flask.current_app.static_folder, "img/scilifelab_logo.png"), "rb"
-            ).read(),
-            "inline",
-            headers=[
-                ["Content-ID", "<Logo>"],
-            ],
-        )
-
         msg.body = flask.render_template(
             f"mail/{mail_type}.txt",
             link=link,
@@ -486,7 +480,7 @@ class AddUser(flask_restful.Resource):
             deadline=deadline,
         )
 
-        dds_web.utils.send_email_with_retry(msg)
+        dds_web.utils.queue_email(msg)
 
 
 class RetrieveUserInfo(flask_restful.Resource):
@@ -542,7 +536,29 @@ class DeleteUserSelf(flask_restful.Resource):
         s = itsdangerous.URLSafeTimedSerializer(flask.current_app.config["SECRET_KEY"])
         token = s.dumps(email_str, salt="email-delete")
 
-        # Create deletion request in database unless it already exists
+        # Create link for deletion request email
+        link = flask.url_for("auth_blueprint.confirm_self_deletion", token=token, _external=True)
+        subject = f"Confirm deletion of your user account {username} in the SciLifeLab Data Delivery System"
+
+        msg = flask_mail.Message(
+            subject,
+            recipients=[email_str],
+        )
+
+        msg.body = flask.render_template(
+            "mail/deletion_request.txt",
+            link=link,
+            sender_name=current_user.name,
+            projects=proj_ids,
+        )
+        msg.html = flask.render_template(
+            "mail/deletion_request.html",
+            link=link,
+            sender_name=current_user.name,
+            projects=proj_ids,
+        )
+
+        # Create deletion request in database unless it already exists, together with the email
         try:
             if not dds_web.utils.delrequest_exists(email_str):
                 new_delrequest = models.DeletionRequest(
@@ -553,6 +569,7 @@ class DeleteUserSelf(flask_restful.Resource):
                     }
                 )
                 db.session.add(new_delrequest)
+                dds_web.utils.queue_email(msg)
                 db.session.commit()
             else:
                 return {
@@ -575,43 +592,6 @@ class DeleteUserSelf(flask_restful.Resource):
                 ),
             ) from sqlerr
 
-        # Create link for deletion request email
-        link = flask.url_for("auth_blueprint.confirm_self_deletion", token=token, _external=True)
-        subject = f"Confirm deletion of your user account {username} in the SciLifeLab Data Delivery System"
-
-        msg = flask_mail.Message(
-            subject,
-            recipients=[email_str],
-        )
-
-        # Need to attach the image to be able to use it
-        msg.attach(
-            "scilifelab_logo.png",
-            "image/png",
-            open(
-                os.path.join(flask.current_app.static_folder, "img/scilifelab_logo.png"), "rb"
-            ).read(),
-            "inline",
-            headers=[
-                ["Content-ID", "<Logo>"],
-            ],
-        )
-
-        msg.body = flask.render_template(
-            "mail/deletion_request.txt",
-            link=link,
-            sender_name=current_user.name,
-            projects=proj_ids,
-        )
-        msg.html = flask.render_template(
-            "mail/deletion_request.html",
-            link=link,
-            sender_name=current_user.name,
-            projects=proj_ids,
-        )
-
-        mail.send(msg)
-
         flask.current_app.logger.info(
             f"The user account {username} / {email_str} ({current_user.role}) "
             "has requested self-deletion."
@@ -1140,19 +1120,6 @@ class RequestTOTPActivation(flask_restful.Resource):
             recipients=recipients,
         )
 
-        # Need to attach the image to be able to use it
-        msg.attach(
-            "scilifelab_logo.png",
-            "image/png",
-            open(
-                os.path.join(flask.current_app.static_folder, "img/scilifelab_logo.png"), "rb"
-            ).read(),
-            "inline",
-            headers=[
-                ["Content-ID", "<Logo>"],
-            ],
-        )
-
         msg.body = flask.render_template(
             f"mail/request_activate_totp.txt",
             link=link,
@@ -1162,7 +1129,20 @@ class RequestTOTPActivation(flask_restful.Resource):
             link=link,
         )
 
-        dds_web.utils.send_email_with_retry(msg)
+        dds_web.utils.queue_email(msg)
+        try:
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as sqlerr:
+            db.session.rollback()
+            raise ddserr.DatabaseError(
+                message=str(sqlerr),
+                alt_message="Could not send the activation email"
+                + (
+                    ": Database malfunction."
+                    if isinstance(sqlerr, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from sqlerr
         return {
             "message": "Please check your email and follow the attached link to activate two-factor with authenticator app."
         }
@@ -1205,19 +1185,6 @@ class RequestHOTPActivation(flask_restful.Resource):
             recipients=recipients,
         )
 
-        # Need to attach the image to be able to use it
-        msg.attach(
-            "scilifelab_logo.png",
-            "image/png",
-            open(
-                os.path.join(flask.current_app.static_folder, "img/scilifelab_logo.png"), "rb"
-            ).read(),
-            "inline",
-            headers=[
-                ["Content-ID", "<Logo>"],
-            ],
-        )
-
         msg.body = flask.render_template(
             f"mail/request_activate_hotp.txt",
             link=link,
@@ -1227,7 +1194,20 @@ class RequestHOTPActivation(flask_restful.Resource):
             link=link,
         )
 
-        dds_web.utils.send_email_with_retry(msg)
+        dds_web.utils.queue_email(msg)
+        try:
+            db.session.commit()
+        except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as sqlerr:
+            db.session.rollback()
+            raise ddserr.DatabaseError(
+                message=str(sqlerr),
+                alt_message="Could not send the activation email"
+                + (
+                    ": Database malfunction."
+                    if isinstance(sqlerr, sqlalchemy.exc.OperationalError)
+                    else "."
+                ),
+            ) from sqlerr
         return {
             "message": "Please check your email and follow the attached link to activate two-factor with email."
         }
@@ -1247,11 +1227,19 @@ class ShowUsage(flask_restful.Resource):
                 "Access denied - only unit accounts can get invoicing information."
             )
 
-        # Get unit info from table (incl safespring proj name)
         try:
-            unit_info = models.Unit.query.filter(
-                models.Unit.id == sqlalchemy.func.binary(current_user.unit_id)
-            ).first()
+            # New usage rows give a new key, so the cached responses are not used after the
+            # monthly usage calculation
+            latest_usage_id = db.session.query(sqlalchemy.func.max(models.Usage.id)).scalar()
+            cache_key = (current_user.unit_id, latest_usage_id)
+            cache, cache_lock = self.response_cache()
+            if not flask.request.cache_control.no_cache:
+                with cache_lock:
+                    response = cache.get(cache_key)
+                if response is not None:
+                    return response
+
+            response = self.unit_usage(unit_id=current_user.unit_id)
         except (sqlalchemy.exc.SQLAlchemyError, sqlalchemy.exc.OperationalError) as err:
             flask.current_app.logger.exception(err)
             raise ddserr.DatabaseError(
@@ -1264,51 +1252,71 @@ class ShowUsage(flask_restful.Resource):
                 ),
             ) from err
 
-        # Total number of GB hours and cost saved in the db for the specific unit
-        total_gbhours_db = 0.0
-        total_cost_db = 0.0
-
-        # Project (bucket) specific info
-        usage = {}
-        for p in unit_info.projects:
-            # Define fields in usage dict
-            usage[p.public_id] = {"gbhours": 0.0, "cost": 0.0}
-
-            for f in p.files:
-                for v in f.versions:
-                    # Calculate hours of the current file
-                    time_uploaded = v.time_uploaded
-                    time_deleted = (
-                        v.time_deleted if v.time_deleted else dds_web.utils.current_time()
-                    )
-                    file_hours = (time_deleted - time_uploaded).seconds / (60 * 60)
+        with cache_lock:
+            cache[cache_key] = response
+        return response
 
-                    # Calculate GBHours, if statement to avoid zerodivision exception
-                    gb_hours = ((v.size_stored / 1e9) / file_hours) if file_hours else 0.0
-
-                    # Save file version gbhours to project info and increase total unit sum
-                    usage[p.public_id]["gbhours"] += gb_hours
-                    total_gbhours_db += gb_hours
+    @staticmethod
+    def response_cache():
+        """Get the cache of the usage responses per unit, and its lock, for the app.
+
+        The live part of the usage changes slowly, so the responses are kept for a few minutes.
+        """
+        app = flask.current_app
+        if "usage_cache" not in app.extensions:
+            app.extensions["usage_cache"] = (
+                cachetools.TTLCache(maxsize=1000, ttl=app.config.get("USAGE_CACHE_SECONDS", 300)),
+                threading.Lock(),
+            )
+        return app.extensions["usage_cache"]
 
-                    # Calculate approximate cost per gbhour: kr per gb per month / (days * hours)
-                    cost_gbhour = 0.09 / (30 * 24)
-                    cost = gb_hours * cost_gbhour
+    @staticmethod
+    def unit_usage(unit_id):
+        """Get the GB hours and cost of the unit projects.
+
+        The usage saved by the monthly usage calculation, plus the usage since then which is
+        calculated in the database, both grouped by project.
+        """
+        # Calculate approximate cost per gbhour: kr per gb per month / (days * hours)
+        cost_gbhour = 0.09 / (30 * 24)
+
+        projects = (
+            db.session.query(models.Project.id, models.Project.public_id)
+            .filter(models.Project.unit_id == unit_id)
+            .all()
+        )
+        byte_hours = {
+            project_id: project_byte_hours
+            for project_id, project_byte_hours in db.session.query(
+                models.Usage.project_id, sqlalchemy.func.sum(models.Usage.usage)
+            )
+            .join(models.Project)
+            .filter(models.Project.unit_id == unit_id)
+            .group_by(models.Usage.project_id)
+        }
+        live_byte_hours = dds_web.utils.calculate_period_usage(
+            project_ids=[project.id for project in projects], invoice=False
+        )
 
-                    # Save file cost to project info and increase total unit cost
-                    usage[p.public_id]["cost"] += cost
-                    total_cost_db += cost
+        # Total number of GB hours and cost for the specific unit
+        total_gbhours = 0.0
+        total_cost = 0.0
 
-            usage[p.public_id].update(
-                {
-                    "gbhours": round(usage[p.public_id]["gbhours"], 2),
-                    "cost": round(usage[p.public_id]["cost"], 2),
-                }
-            )
+        # Project (bucket) specific info
+        usage = {}
+        for project in projects:
+            gbhours = (
+                (byte_hours.get(project.id) or 0.0) + live_byte_hours.get(project.id, 0.0)
+            ) / 1e9
+            cost = gbhours * cost_gbhour
+            usage[project.public_id] = {"gbhours": round(gbhours, 2), "cost": round(cost, 2)}
+            total_gbhours += gbhours
+            total_cost += cost
 
         return {
             "total_usage": {
-                "gbhours": round(total_gbhours_db, 2),
-                "cost": round(total_cost_db, 2),
+                "gbhours": round(total_gbhours, 2),
+                "cost": round(total_cost, 2),
             },
             "project_usage": usage,
         }
@@ -11,6 +11,9 @@ from dateutil.relativedelta import relativedelta
 import gc
 import pathlib
 import csv
+import contextlib
+import gzip
+import io
 
 # Installed
 import click
@@ -577,9 +580,44 @@ def delete_lost_files(project_id: str):
     flask.current_app.logger.info(f"Files deleted from DB: {len(in_db_but_not_in_s3)}")
 
 
+def due_projects_query(status):
+    """Get a query for the active projects in a status whose deadline has passed.
+
+    Selected with the index on the current status and deadline, so only the due projects are read.
+    """
+    # Imports
+    # Own
+    from dds_web.database import models
+    from dds_web.utils import current_time
+
+    return db.session.query(models.Project).filter(
+        models.Project.is_active == True,
+        models.Project.current_status == status,
+        models.Project.current_deadline <= current_time(),
+    )
+
+
+def log_transition_errors(errors, process):
+    """Log the projects which could not change status, per unit."""
+    for unit, projects in errors.items():
+        if projects:
+            flask.current_app.logger.error(
+                f"Following projects of Unit '{unit}' encountered issues during {process} process:"
+            )
+            for proj in errors[unit].keys():
+                flask.current_app.logger.error(f"Error for project '{proj}': {errors[unit][proj]} ")
+
+
 @click.command("set-available-to-expired")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=100,
+    show_default=True,
+    help="Number of projects to lock and expire per transaction.",
+)
 @flask.cli.with_appcontext
-def set_available_to_expired():
+def set_available_to_expired(batch_size):
     """
     Search for available projects whose deadlines are past and expire them.
     Should be run every day at around 00:01.
@@ -594,82 +632,145 @@ def set_available_to_expired():
     # Own
     from dds_web import db
     from dds_web.database import models
-    from dds_web.errors import DatabaseError
     from dds_web.api.project import ProjectStatus
-    from dds_web.utils import current_time, page_query
+    from dds_web.utils import current_time
 
     expire = ProjectStatus()
 
     errors = {}
 
     try:
-        for unit in db.session.query(models.Unit).with_for_update().all():
-            errors[unit.name] = {}
+        project_ids = [
+            project_id
+            for (project_id,) in due_projects_query(status="Available")
+            .with_entities(models.Project.id)
+            .order_by(models.Project.id)
+        ]
+        flask.current_app.logger.debug("Projects to expire: %s", len(project_ids))
+
+        for batch_start in range(0, len(project_ids), batch_size):
+            # Lock only the projects in the batch which are still due
+            projects = (
+                due_projects_query(status="Available")
+                .filter(models.Project.id.in_(project_ids[batch_start : batch_start + batch_size]))
+                .order_by(models.Project.id)
+                .with_for_update()
+                .all()
+            )
+            expired_projects = []
+            for project in projects:
+                flask.current_app.logger.debug("Handling expiring project")
+                flask.current_app.logger.debug(
+                    "Project: %s has status %s and expires on: %s",
+                    project.public_id,
+                    project.current_status,
+                    project.current_deadline,
+                )
+                new_status_row = expire.expire_project(
+                    project=project,
+                    current_time=current_time(),
+                    deadline_in=project.responsible_unit.days_in_expired,
+                )
+                project.project_statuses.append(new_status_row)
+                expired_projects.append((project.responsible_unit.name, project.public_id))
+
+            try:
+                db.session.commit()
+                for _, public_id in expired_projects:
+                    flask.current_app.logger.debug("Project: %s has status Expired now!", public_id)
+            except (
+                sqlalchemy.exc.OperationalError,
+                sqlalchemy.exc.SQLAlchemyError,
+            ) as err:
+                flask.current_app.logger.exception(err)
+                db.session.rollback()
+                for unit_name, public_id in expired_projects:
+                    errors.setdefault(unit_name, {})[public_id] = str(err)
+    except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+        flask.current_app.logger.exception(err)
+        db.session.rollback()
+        raise
 
-            days_in_expired = unit.days_in_expired
+    log_transition_errors(errors=errors, process="expiration")
 
-            for project in page_query(
-                db.session.query(models.Project)
-                .filter(
-                    sqlalchemy.and_(
-                        models.Project.is_active == 1, models.Project.unit_id == unit.id
-                    )
-                )
-                .with_for_update()
-            ):
-                if (
-                    project.current_status == "Available"
-                    and project.current_deadline <= current_time()
-                ):
-                    flask.current_app.logger.debug("Handling expiring project")
-                    flask.current_app.logger.debug(
-                        "Project: %s has status %s and expires on: %s",
-                        project.public_id,
-                        project.current_status,
-                        project.current_deadline,
-                    )
-                    new_status_row = expire.expire_project(
-                        project=project,
-                        current_time=current_time(),
-                        deadline_in=days_in_expired,
-                    )
 
-                    project.project_statuses.append(new_status_row)
+def archive_due_project(project_id):
+    """Lock and archive an expired project if it is still due, in its own transaction.
 
-                    try:
-                        db.session.commit()
-                        flask.current_app.logger.debug(
-                            "Project: %s has status Expired now!", project.public_id
-                        )
-                    except (
-                        sqlalchemy.exc.OperationalError,
-                        sqlalchemy.exc.SQLAlchemyError,
-                    ) as err:
-                        flask.current_app.logger.exception(err)
-                        db.session.rollback()
-                        errors[unit.name][project.public_id] = str(err)
-                    continue
-                else:
-                    flask.current_app.logger.debug(
-                        "Nothing to do for Project: %s", project.public_id
-                    )
-    except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+    Returns the unit name, the project public ID and the error message (None if archived), or
+    None if the project is no longer due.
+    """
+    # Imports
+    # Installed
+    import sqlalchemy
+
+    # Own
+    from dds_web import db
+    from dds_web.database import models
+    from dds_web.errors import DeletionError
+    from dds_web.utils import current_time
+    from dds_web.api.project import ProjectStatus
+
+    project = (
+        due_projects_query(status="Expired")
+        .filter(models.Project.id == project_id)
+        .with_for_update()
+        .one_or_none()
+    )
+    if not project:
+        flask.current_app.logger.debug("Project %s is no longer due", project_id)
+        return None
+
+    flask.current_app.logger.debug("Handling project to archive")
+    flask.current_app.logger.debug(
+        "Project: %s has status %s and expired on: %s",
+        project.public_id,
+        project.current_status,
+        project.current_deadline,
+    )
+    unit_name, public_id = project.responsible_unit.name, project.public_id
+
+    try:
+        new_status_row, delete_message = ProjectStatus().archive_project(
+            project=project,
+            current_time=current_time(),
+        )
+        project.project_statuses.append(new_status_row)
+        flask.current_app.logger.debug(delete_message.strip())
+        db.session.commit()
+        flask.current_app.logger.debug("Project: %s has status Archived now!", public_id)
+    except (
+        sqlalchemy.exc.OperationalError,
+        sqlalchemy.exc.SQLAlchemyError,
+        DeletionError,
+    ) as err:
+        # archive or commit operation failed, save error message, log it and continue to next project
         flask.current_app.logger.exception(err)
         db.session.rollback()
-        raise
+        return unit_name, public_id, str(err)
+
+    return unit_name, public_id, None
 
-    for unit, projects in errors.items():
-        if projects:
-            flask.current_app.logger.error(
-                f"Following projects of Unit '{unit}' encountered issues during expiration process:"
-            )
-            for proj in errors[unit].keys():
-                flask.current_app.logger.error(f"Error for project '{proj}': {errors[unit][proj]} ")
+
+def archive_due_project_in_worker(app, project_id):
+    """Archive a project in a worker thread, with its own app context and database session."""
+    with app.app_context():
+        try:
+            return archive_due_project(project_id=project_id)
+        finally:
+            db.session.remove()
 
 
 @click.command("set-expired-to-archived")
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of projects to archive concurrently.",
+)
 @flask.cli.with_appcontext
-def set_expired_to_archived():
+def set_expired_to_archived(workers):
     """
     Search for expired projects whose deadlines are past and archive them.
     Should be run every day at around 01:01.
@@ -678,80 +779,64 @@ def set_expired_to_archived():
     flask.current_app.logger.debug("Task: Checking for projects to archive.")
 
     # Imports
+    # Standard library
+    import concurrent.futures
+
     # Installed
     import sqlalchemy
 
     # Own
     from dds_web import db
     from dds_web.database import models
-    from dds_web.errors import DatabaseError
-    from dds_web.utils import current_time, page_query
-    from dds_web.api.project import ProjectStatus
-
-    archive = ProjectStatus()
-    errors = {}
 
     try:
-        for unit in db.session.query(models.Unit).with_for_update().all():
-            errors[unit.name] = {}
-
-            for project in page_query(
-                db.session.query(models.Project)
-                .filter(
-                    sqlalchemy.and_(
-                        models.Project.is_active == 1, models.Project.unit_id == unit.id
-                    )
-                )
-                .with_for_update()
-            ):
-                if (
-                    project.current_status == "Expired"
-                    and project.current_deadline <= current_time()
-                ):
-                    flask.current_app.logger.debug("Handling project to archive")
-                    flask.current_app.logger.debug(
-                        "Project: %s has status %s and expired on: %s",
-                        project.public_id,
-                        project.current_status,
-                        project.current_deadline,
-                    )
-
-                    try:
-                        new_status_row, delete_message = archive.archive_project(
-                            project=project,
-                            current_time=current_time(),
-                        )
-                        project.project_statuses.append(new_status_row)
-                        flask.current_app.logger.debug(delete_message.strip())
-                        db.session.commit()
-                        flask.current_app.logger.debug(
-                            "Project: %s has status Archived now!", project.public_id
-                        )
-                    except (
-                        sqlalchemy.exc.OperationalError,
-                        sqlalchemy.exc.SQLAlchemyError,
-                    ) as err:
-                        # archive or commit operation failed, save error message, log it and continue to next project
-                        flask.current_app.logger.exception(err)
-                        db.session.rollback()
-                        errors[unit.name][project.public_id] = str(err)
-                    continue
-                else:
-                    flask.current_app.logger.debug(
-                        "Nothing to do for Project: %s", project.public_id
-                    )
+        project_ids = [
+            project_id
+            for (project_id,) in due_projects_query(status="Expired")
+            .with_entities(models.Project.id)
+            .order_by(models.Project.id)
+        ]
     except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
         flask.current_app.logger.exception(err)
         db.session.rollback()
         raise
+    # End the transaction, the projects are locked when archived
+    db.session.commit()
+    flask.current_app.logger.debug("Projects to archive: %s", len(project_ids))
 
-    for unit, projects in errors.items():
-        if projects:
-            flask.current_app.logger.error(
-                f"Following projects of Unit '{unit}' encountered issues during archival process:"
+    # The projects are archived one at a time per worker: the bucket is emptied before the
+    # status is saved
+    if workers == 1:
+        results = [archive_due_project(project_id=project_id) for project_id in project_ids]
+    else:
+        app = flask.current_app._get_current_object()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(
+                executor.map(
+                    lambda project_id: archive_due_project_in_worker(
+                        app=app, project_id=project_id
+                    ),
+                    project_ids,
+                )
             )
-            for proj in errors[unit].keys():
-                flask.current_app.logger.error(f"Error for project '{proj}': {errors[unit][proj]} ")
+
+    errors = {}
+    summary = {"archived": 0, "failed": 0, "no longer due": 0}
+    for result in results:
+        if result is None:
+            summary["no longer due"] += 1
+            continue
+        unit_name, public_id, error = result
+        if error:
+            errors.setdefault(unit_name, {})[public_id] = error
+            summary["failed"] += 1
+        else:
+            summary["archived"] += 1
+
+    flask.current_app.logger.info(
+        "Archival summary: " + ", ".join(f"{key}: {value}" for key, value in summary.items())
+    )
+    log_transition_errors(errors=errors, process="archival")
 
 
 @click.command("delete-invites")
@@ -811,6 +896,176 @@ def delete_invites():
         flask.current_app.logger.error(f"{invite} not deleted: {error}")
 
 
+@click.command("send-emails")
+@click.option(
+    "--batch-size",
+    type=click.IntRange(min=1),
+    default=50,
+    show_default=True,
+    help="Number of emails to send per SMTP connection.",
+)
+@click.option(
+    "--max-attempts",
+    type=click.IntRange(min=1),
+    default=5,
+    show_default=True,
+    help="Number of times to try sending an email before giving up.",
+)
+@click.option(
+    "--interval",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds between checking the outbox. 0 sends the due emails once and exits.",
+)
+@flask.cli.with_appcontext
+def send_emails(batch_size, max_attempts, interval):
+    """Send the emails in the outbox.
+
+    The emails are written to the outbox by the API and are sent here, with retries and
+    backoff if the mail server cannot be reached. Should be run continuously with --interval,
+    or every minute.
+    """
+    # Imports
+    # Standard library
+    import time
+
+    # Own
+    from dds_web.utils import send_outbox_emails
+
+    while True:
+        try:
+            sent, failed = send_outbox_emails(batch_size=batch_size, max_attempts=max_attempts)
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            db.session.rollback()
+            flask.current_app.logger.exception(err)
+            if not interval:
+                sys.exit(1)
+        else:
+            if sent or failed:
+                flask.current_app.logger.info(f"Emails sent: {sent}, failed: {failed}")
+
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@click.command("fill-key-pairs")
+@click.option(
+    "--size",
+    type=click.IntRange(min=0),
+    default=None,
+    help="Number of key pairs to keep in the pool. Defaults to KEY_PAIR_POOL_SIZE.",
+)
+@click.option(
+    "--interval",
+    type=click.IntRange(min=0),
+    default=0,
+    show_default=True,
+    help="Seconds between checking the pool. 0 fills the pool once and exits.",
+)
+@flask.cli.with_appcontext
+def fill_key_pairs(size, interval):
+    """Fill the pool of pre-generated RSA key pairs.
+
+    Invites and new users take their key pairs from the pool, and generate them during the
+    request only if the pool is empty. Should be run continuously with --interval, or every few
+    minutes.
+    """
+    # Imports
+    # Standard library
+    import time
+
+    # Own
+    from dds_web.security.project_user_keys import add_key_pair_to_pool, key_pair_pool_level
+
+    if size is None:
+        size = int(flask.current_app.config.get("KEY_PAIR_POOL_SIZE", 100))
+
+    while True:
+        level = key_pair_pool_level()
+        added = 0
+        while level + added < size:
+            add_key_pair_to_pool()
+            # Commit each key pair, so that they are available as soon as possible
+            try:
+                db.session.commit()
+            except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+                db.session.rollback()
+                flask.current_app.logger.exception(err)
+                if not interval:
+                    sys.exit(1)
+                break
+            added += 1
+
+        if added:
+            flask.current_app.logger.info(
+                f"Key pairs added to the pool: {added}, pool level: {level + added}/{size}"
+            )
+
+        if not interval:
+            break
+        time.sleep(interval)
+
+
+@click.command("daily-storage")
+@flask.cli.with_appcontext
+def daily_storage():
+    """Roll up the storage of the projects per day.
+
+    Adds the days after the last day in the daily storage, up to and including yesterday, one day
+    at a time. Starts at the first upload if there are no days yet. Should be run every day at
+    around 00:01.
+    """
+    # Imports
+    # Own
+    from dds_web.database import models
+    from dds_web.utils import calculate_daily_storage, current_time
+
+    flask.current_app.logger.info("Starting: Rolling up the daily storage...")
+
+    last_day = db.session.query(sqlalchemy.func.max(models.DailyStorage.date)).scalar()
+    if last_day:
+        day = last_day + datetime.timedelta(days=1)
+        previous = dict(
+            db.session.query(models.DailyStorage.project_id, models.DailyStorage.bytes_stored)
+            .filter(models.DailyStorage.date == last_day)
+            .all()
+        )
+    else:
+        first_upload = db.session.query(sqlalchemy.func.min(models.Version.time_uploaded)).scalar()
+        if not first_upload:
+            flask.current_app.logger.info("No data has been uploaded.")
+            return
+        day = first_upload.date()
+        previous = {}
+
+    today = current_time().date()
+    days_added = 0
+    while day < today:
+        storage = calculate_daily_storage(day=day, previous=previous)
+        db.session.add_all(
+            models.DailyStorage(
+                project_id=project_id, date=day, bytes_stored=bytes_stored, byte_hours=byte_hours
+            )
+            for project_id, (bytes_stored, byte_hours) in storage.items()
+        )
+        # Commit each day, so that the next run continues from here on failure
+        try:
+            db.session.commit()
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            db.session.rollback()
+            flask.current_app.logger.exception(err)
+            flask.current_app.logger.error(f"Failed adding the daily storage for {day}.")
+            sys.exit(1)
+
+        previous = {project_id: bytes_stored for project_id, (bytes_stored, _) in storage.items()}
+        day += datetime.timedelta(days=1)
+        days_added += 1
+
+    flask.current_app.logger.info(f"Daily storage added for {days_added} day(s).")
+
+
 @click.command("monthly-usage")
 @flask.cli.with_appcontext
 def monthly_usage():
@@ -837,7 +1092,7 @@ def monthly_usage():
     from dds_web.utils import (
         current_time,
         page_query,
-        calculate_version_period_usage,
+        calculate_period_usage,
         send_email_with_retry,
     )
 
@@ -916,29 +1171,38 @@ def monthly_usage():
         # Save all new rows at once
         all_new_rows = []
 
-        # Iterate through non-done projects
-        for project in page_query(models.Project.query.filter_by(done=False).with_for_update()):
-            project_byte_hours: int = 0
-            for version in project.file_versions:
-                # Skip deleted and already invoiced versions
-                if version.time_deleted == version.time_invoiced and [
-                    version.time_deleted,
-                    version.time_invoiced,
-                ] != [None, None]:
-                    continue
-                version_bhours = calculate_version_period_usage(version=version)
-                project_byte_hours += version_bhours
-            flask.current_app.logger.debug(
-                f"Project {project.public_id} byte hours: {project_byte_hours}"
+        # Calculate the usage for the non-done projects in pages, in the database
+        time_collected = current_time()
+        last_project_id = 0
+        while True:
+            projects = (
+                db.session.query(models.Project.id, models.Project.public_id)
+                .filter(models.Project.done.is_(False), models.Project.id > last_project_id)
+                .order_by(models.Project.id)
+                .limit(1000)
+                .with_for_update()
+                .all()
             )
+            if not projects:
+                break
+            last_project_id = projects[-1].id
 
-            # Create a record in usage table
-            new_usage_row = models.Usage(
-                project_id=project.id,
-                usage=project_byte_hours,
-                time_collected=current_time(),
+            usage = calculate_period_usage(
+                project_ids=[project.id for project in projects], now=time_collected
             )
-            all_new_rows.append(new_usage_row)
+            for project in projects:
+                project_byte_hours = usage.get(project.id, 0)
+                flask.current_app.logger.debug(
+                    f"Project {project.public_id} byte hours: {project_byte_hours}"
+                )
+
+                # Create a record in usage table
+                new_usage_row = models.Usage(
+                    project_id=project.id,
+                    usage=project_byte_hours,
+                    time_collected=time_collected,
+                )
+                all_new_rows.append(new_usage_row)
 
         # Save new rows
         db.session.add_all(all_new_rows)
@@ -971,13 +1235,30 @@ def monthly_usage():
 
 
 @click.command("send-usage")
-@click.option("--months", type=click.IntRange(min=1, max=12), required=True)
+@click.option("--months", type=click.IntRange(min=1), required=True)
+@click.option("--compress", is_flag=True, default=False, help="Gzip compress the CSV files.")
+@click.option(
+    "--output-dir",
+    type=click.Path(exists=True, file_okay=False, writable=True, path_type=pathlib.Path),
+    required=False,
+    help="Write the CSV files to this directory instead of sending them by email.",
+)
 @flask.cli.with_appcontext
-def send_usage(months):
-    """Get unit storage usage for the last x months and send in email."""
+def send_usage(months, compress, output_dir):
+    """Get unit storage usage for the last x months and send in email.
+
+    The usage rows are read in one query and streamed into one CSV file per unit, in memory or in
+    the output directory. More than 12 months can only be written to an output directory.
+    """
     # Imports
     from dds_web.database import models
-    from dds_web.utils import current_time, page_query, send_email_with_retry
+    from dds_web.utils import current_time, send_email_with_retry
+
+    if months > 12 and not output_dir:
+        raise click.BadParameter(
+            "The usage for more than 12 months can only be written to an output directory.",
+            param_hint="--months",
+        )
 
     # Get the instance name (DEVELOPMENT, PRODUCTION, etc.)
     instance_name = flask.current_app.config.get("INSTANCE_NAME")
@@ -1011,26 +1292,57 @@ def send_usage(months):
     flask.current_app.logger.debug(f"Start: {start}")
     flask.current_app.logger.debug(f"End: {end}")
 
-    # CSV files to send
-    csv_file_names = []
-    csv_file_location = "/tmp/"
+    # CSV files to send: (file name, content)
+    csv_files = []
+    content_type = "application/gzip" if compress else "text/csv"
 
     have_failed = False  # Flag to check if any csv files failed to be generated
 
-    # Iterate through units
-    for unit in models.Unit.query:
-        # Generate CSV file name
-        csv_file_name = pathlib.Path(
-            f"{csv_file_location}{unit.public_id}_Usage_Months-{start.month}-to-{end.month}.csv"
+    # Get the units before streaming the usage rows, the connection is busy while streaming
+    units = models.Unit.query.order_by(models.Unit.id).all()
+
+    # Usage rows collected between X months ago and now, for all units, ordered by unit
+    usage_rows = iter(
+        db.session.query(
+            models.Project.unit_id,
+            models.Project.public_id,
+            models.Project.title,
+            models.Project.date_created,
+            models.Usage.time_collected,
+            models.Usage.usage,
+        )
+        .select_from(models.Usage)
+        .join(models.Project)
+        .filter(
+            models.Project.unit_id.isnot(None),
+            models.Usage.time_collected.between(start, end),
+        )
+        .order_by(models.Project.unit_id, models.Usage.id)
+        .execution_options(stream_results=True)
+        .yield_per(1000)
+    )
+    usage_row = next(usage_rows, None)
+
+    # Iterate through units, in the same order as the usage rows
+    for unit in units:
+        # Generate CSV file name, with years in the directory so that other ranges are kept
+        if output_dir:
+            csv_file_name = f"{unit.public_id}_Usage_Months-{start:%Y-%m}-to-{end:%Y-%m}.csv"
+        else:
+            csv_file_name = f"{unit.public_id}_Usage_Months-{start.month}-to-{end.month}.csv"
+        if compress:
+            csv_file_name += ".gz"
+        csv_file = output_dir / csv_file_name if output_dir else io.BytesIO()
+        flask.current_app.logger.debug(
+            f"CSV file name: {csv_file if output_dir else csv_file_name}"
         )
-        flask.current_app.logger.debug(f"CSV file name: {csv_file_name}")
 
         # Total usage for unit
         total_usage = 0
 
-        # Open the csv file
+        # Write the csv file
         try:
-            with csv_file_name.open(mode="w+", newline="") as file:
+            with usage_csv_file(file=csv_file, compress=compress) as file:
                 csv_writer = csv.writer(file)
                 csv_writer.writerow(
                     [
@@ -1042,28 +1354,21 @@ def send_usage(months):
                     ]
                 )
 
-                # Get usage rows connected to unit, that have been collected between X months ago and now
-                for usage_row, project_row in page_query(
-                    db.session.query(models.Usage, models.Project)
-                    .join(models.Project)
-                    .filter(
-                        models.Project.responsible_unit == unit,
-                        models.Usage.time_collected.between(start, end),
-                    )
-                ):
+                while usage_row is not None and usage_row.unit_id == unit.id:
                     # Increase total unit usage
                     total_usage += usage_row.usage
 
                     # Save usage row info to csv file
                     csv_writer.writerow(
                         [
-                            project_row.public_id,
-                            project_row.title,
-                            project_row.date_created,
+                            usage_row.public_id,
+                            usage_row.title,
+                            usage_row.date_created,
                             usage_row.time_collected,
                             usage_row.usage,
                         ]
                     )
+                    usage_row = next(usage_rows, None)
 
                 # Save total
                 csv_writer.writerow(["--", "--", "--", "--", total_usage])
@@ -1074,14 +1379,19 @@ def send_usage(months):
             # Set flag to True, so we know at least 1 file have failed
             have_failed = True
 
-            csv_file_name.unlink(missing_ok=True)  # Delete the csv file if it was created
+            if output_dir:
+                csv_file.unlink(missing_ok=True)  # Delete the csv file if it was created
 
             # Update email body with files with errors
             error_body += "File(s) with errors: \n"
             error_body += f"{csv_file_name}\n"
+
+            # Skip the rest of the unit usage rows
+            while usage_row is not None and usage_row.unit_id == unit.id:
+                usage_row = next(usage_rows, None)
         else:
             # Add correctly created csv to list of files to send
-            csv_file_names.append(csv_file_name)
+            csv_files.append((csv_file_name, None if output_dir else csv_file.getvalue()))
 
     # IF any csv files failed to be generated, send email about error
     if have_failed:
@@ -1093,10 +1403,14 @@ def send_usage(months):
         send_email_with_retry(msg=email_message)
 
     # IF no csv files were generated, log error and return
-    if not csv_file_names:
+    if not csv_files:
         flask.current_app.logger.error("No CSV files generated.")
         return
 
+    if output_dir:
+        flask.current_app.logger.info(f"CSV files written to {output_dir}: {len(csv_files)}")
+        return
+
     # Send email with the csv
     flask.current_app.logger.info("Sending email with the CSV.")
     email_subject += " Usage records attached in the present mail"
@@ -1106,13 +1420,34 @@ def send_usage(months):
         body=email_body,
     )
     # add atachments
-    for csv_file in csv_file_names:
-        with csv_file.open("r") as file:
-            email_message.attach(filename=str(csv_file), content_type="text/csv", data=file.read())
+    for csv_file_name, data in csv_files:
+        email_message.attach(
+            filename=csv_file_name,
+            content_type=content_type,
+            data=data if compress else data.decode("utf-8"),
+        )
     send_email_with_retry(msg=email_message)
 
-    # delete the csv after sending the email
-    [csv_file.unlink() for csv_file in csv_file_names]
+
+@contextlib.contextmanager
+def usage_csv_file(file, compress=False):
+    """Open a usage CSV file for writing text, optionally gzip compressed.
+
+    The file is either a path or a binary buffer. A buffer is left open, so that its content can
+    be read afterwards.
+    """
+    raw_file = file.open(mode="wb") if isinstance(file, pathlib.Path) else file
+    gzip_file = gzip.GzipFile(mode="wb", fileobj=raw_file) if compress else None
+    text_file = io.TextIOWrapper(gzip_file or raw_file, encoding="utf-8", newline="")
+    try:
+        yield text_file
+        text_file.flush()
+    finally:
+        text_file.detach()
+        if gzip_file:
+            gzip_file.close()
+        if raw_file is not file:
+            raw_file.close()
 
 
 @click.command("stats")
@@ -1129,7 +1464,10 @@ def collect_stats():
 
     # Own
     import dds_web.utils
-    from dds_web.utils import bytehours_in_last_month, page_query, calculate_bytehours
+    from dds_web.utils import (
+        bytehours_in_last_month_all_versions,
+        calculate_reporting_accumulators,
+    )
     from dds_web.database.models import (
         Unit,
         UnitUser,
@@ -1137,9 +1475,9 @@ def collect_stats():
         SuperAdmin,
         User,
         Reporting,
+        ReportingAccumulators,
         Project,
         ProjectUsers,
-        Version,
     )
 
     # Get current time
@@ -1187,34 +1525,30 @@ def collect_stats():
 
         # Amount of data
         # Currently stored
-        bytes_stored_now: int = sum(proj.size for proj in Project.query.filter_by(is_active=True))
-        tb_stored_now: float = round(bytes_stored_now / 1e12, 2)
+        bytes_stored_now: int = (
+            db.session.query(func.sum(Project.size)).filter(Project.is_active.is_(True)).scalar()
+            or 0
+        )
+        tb_stored_now: float = round(int(bytes_stored_now) / 1e12, 2)
+
+        # Running totals - from the previous totals and the versions changed since then
+        time_now = dds_web.utils.current_time()
+        accumulators, (bytes_uploaded, _, byte_hours_total) = calculate_reporting_accumulators(
+            now=time_now,
+            previous=ReportingAccumulators.query.order_by(
+                ReportingAccumulators.time_calculated.desc(), ReportingAccumulators.id.desc()
+            ).first(),
+            overlap_ids=flask.current_app.config.get("REPORTING_VERSION_OVERLAP", 10000),
+        )
         # Uploaded since start
-        bytes_uploaded_since_start = db.session.query(
-            func.sum(Version.size_stored).label("sum_bytes")
-        ).first()
-        tb_uploaded_since_start: float = round(int(bytes_uploaded_since_start.sum_bytes) / 1e12, 2)
+        tb_uploaded_since_start: float = round(bytes_uploaded / 1e12, 2)
 
         # TBHours
         # In last month
-        byte_hours_sum = sum(
-            bytehours_in_last_month(version=version)
-            for version in page_query(Version.query)
-            if version.time_deleted is None
-            or version.time_deleted > (dds_web.utils.current_time() - relativedelta(months=1))
-        )
+        byte_hours_sum = bytehours_in_last_month_all_versions(now=time_now)
         tbhours = round(byte_hours_sum / 1e12, 2)
         # Since start
-        time_now = dds_web.utils.current_time()
-        byte_hours_sum_total = sum(
-            calculate_bytehours(
-                minuend=version.time_deleted or time_now,
-                subtrahend=version.time_uploaded,
-                size_bytes=version.size_stored,
-            )
-            for version in page_query(Version.query)
-        )
-        tbhours_total = round(byte_hours_sum_total / 1e12, 2)
+        tbhours_total = round(byte_hours_total / 1e12, 2)
 
         # Add to database
         new_reporting_row = Reporting(
@@ -1232,6 +1566,7 @@ def collect_stats():
             tb_uploaded_since_start=tb_uploaded_since_start,
             tbhours=tbhours,
             tbhours_since_start=tbhours_total,
+            accumulators=accumulators,
         )
         db.session.add(new_reporting_row)
         db.session.commit()
@@ -1272,14 +1607,18 @@ def monitor_usage():
     dds_contact: str = flask.current_app.config.get("MAIL_DDS")
     default_subject: str = "DDS: Usage quota warning!"
 
-    # Run task
-    for unit in models.Unit.query:
+    # Current usage of all units, from one grouped query
+    usage_per_unit = dds_web.utils.units_usage()
+
+    # Calculate the percentages of the quotas for all units before sending any emails
+    units_to_warn = []
+    for unit in models.Unit.query.order_by(models.Unit.id):
         flask.current_app.logger.info(f"Checking quotas and usage for: {unit.name}")
 
         # Get info from database
         quota: int = unit.quota
         warn_after: float = unit.warning_level
-        current_usage: int = unit.size
+        current_usage: int = usage_per_unit.get(unit.id, 0)
 
         # Check if 0 and then skip the next steps
         if not current_usage:
@@ -1304,18 +1643,99 @@ def monitor_usage():
 
         # Email if the unit is using more
         if perc_used_decimal > warn_after:
-            # Email settings
-            unit_contact: str = unit.contact_email
-            message: str = (
-                "Your unit is approaching the allocated data quota (see details below).\n\n"
-                f"NB! If you would like to increase or decrease the allocated quota ('Quota') or the level after which you receive this email ('Warning level'), the technical contact person for your unit must send a request to {dds_contact}.\n"
-                f"Unit name: {unit.name}\n"
-                f"{info_string}"
-            )
-            flask.current_app.logger.info(message)
-            msg: flask_mail.Message = flask_mail.Message(
-                subject=default_subject,
-                recipients=[unit_contact, dds_contact],
-                body=message,
+            units_to_warn.append((unit, info_string))
+
+    # Send the warnings
+    for unit, info_string in units_to_warn:
+        # Email settings
+        unit_contact: str = unit.contact_email
+        message: str = (
+            "Your unit is approaching the allocated data quota (see details below).\n\n"
+            f"NB! If you would like to increase or decrease the allocated quota ('Quota') or the level after which you receive this email ('Warning level'), the technical contact person for your unit must send a request to {dds_contact}.\n"
+            f"Unit name: {unit.name}\n"
+            f"{info_string}"
+        )
+        flask.current_app.logger.info(message)
+        msg: flask_mail.Message = flask_mail.Message(
+            subject=default_subject,
+            recipients=[unit_contact, dds_contact],
+            body=message,
+        )
+        dds_web.utils.send_email_with_retry(msg=msg)
+
+
+@click.command("project-statistics")
+@click.option("--rebuild", is_flag=True, default=False, help="Correct the incorrect statistics.")
+@flask.cli.with_appcontext
+def project_statistics(rebuild):
+    """Verify the statistics stored in the project table and optionally rebuild them.
+
+    The size, number of files, current status, current deadline, whether the project has been
+    available and the number of times it has expired are kept up to date when files and statuses
+    are written. Recalculate them from the files and the status history.
+    """
+    # Imports
+    # Own
+    from dds_web.database import models
+    from dds_web.utils import page_query
+
+    flask.current_app.logger.info("Starting: Verifying project statistics...")
+
+    # Size and number of files for all projects with files
+    file_statistics = {
+        project_id: (int(size), num_files)
+        for project_id, size, num_files in db.session.query(
+            models.File.project_id,
+            sqlalchemy.func.sum(models.File.size_stored),
+            sqlalchemy.func.count(models.File.id),
+        ).group_by(models.File.project_id)
+    }
+
+    incorrect_projects = 0
+    for project in page_query(models.Project.query):
+        size, num_files = file_statistics.get(project.id, (0, 0))
+        status_history = [
+            (row.status, row.deadline, row.date_created) for row in project.project_statuses
+        ]
+        current_status, current_deadline = models.current_status_and_deadline(
+            status_history=status_history
+        )
+        has_been_available, times_expired = models.status_counters(
+            statuses=[row_status for row_status, _, _ in status_history]
+        )
+        expected = {
+            "size": size,
+            "num_files": num_files,
+            "current_status": current_status,
+            "current_deadline": current_deadline,
+            "has_been_available": has_been_available,
+            "times_expired": times_expired,
+        }
+        incorrect = {
+            column: value for column, value in expected.items() if getattr(project, column) != value
+        }
+        if not incorrect:
+            continue
+
+        incorrect_projects += 1
+        flask.current_app.logger.warning(
+            f"Incorrect statistics for project '{project.public_id}': "
+            + ", ".join(
+                f"{column} is {getattr(project, column)}, should be {value}"
+                for column, value in incorrect.items()
             )
-            dds_web.utils.send_email_with_retry(msg=msg)
+        )
+        if rebuild:
+            for column, value in incorrect.items():
+                setattr(project, column, value)
+
+    if rebuild and incorrect_projects:
+        try:
+            db.session.commit()
+        except (sqlalchemy.exc.OperationalError, sqlalchemy.exc.SQLAlchemyError) as err:
+            db.session.rollback()
+            flask.current_app.logger.exception(err)
+            sys.exit(1)
+        flask.current_app.logger.info(f"Statistics rebuilt for {incorrect_projects} projects.")
+    else:
+        flask.current_app.logger.info(f"Projects with incorrect statistics: {incorrect_projects}")
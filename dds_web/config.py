@@ -19,6 +19,8 @@ class Config(object):
 
     SITE_NAME = "Data Delivery System"
     SECRET_KEY = "REPLACE_THE_STRING_IN_PRODUCTION"
+    # Secret keys replaced by SECRET_KEY, tokens issued with them are still accepted
+    PREVIOUS_SECRET_KEYS = []
 
     # DB related config
     SQLALCHEMY_DATABASE_URI = "mysql+pymysql://TEST_USER:TEST_PASSWORD@db/DeliverySystem"
@@ -66,6 +68,22 @@ class Config(object):
 
     INVITATION_EXPIRES_IN_HOURS = 7 * 24
 
+    # Seconds to keep the unit usage responses, also cleared by new monthly usage rows
+    USAGE_CACHE_SECONDS = 5 * 60
+
+    # Number of verified tokens to keep, each until the token expires
+    VERIFIED_TOKEN_CACHE_SIZE = 10000
+
+    # Number of the newest versions that the stats cronjob reads again on each run, in case they
+    # are committed after versions with higher ids
+    REPORTING_VERSION_OVERLAP = 10000
+
+    # Seconds to keep the identity of a user for token authentication, unless the user is changed
+    USER_IDENTITY_CACHE_SECONDS = 30
+
+    # Seconds to keep the maintenance mode and the MOTDs, unless changed in the same process
+    GLOBAL_SETTINGS_CACHE_SECONDS = 10
+
     # Argon2id settings
     # Key derivation - No config to avoid changing important settings by "accident"
     ARGON_TIME_COST_KD = 2
@@ -81,6 +99,17 @@ class Config(object):
     ARGON_HASH_LENGTH_PW = os.environ.get("ARGON_HASH_LENGTH_PW", ARGON_HASH_LENGTH_KD)
     ARGON_TYPE_PW = os.environ.get("ARGON_TYPE_PW", ARGON_TYPE_KD)
 
+    # Argon2 executor: memory (KiB) for the operations running at the same time in each process,
+    # the number of operations allowed to wait, and the seconds to wait for an operation.
+    # The budget is per process, so a pod uses up to the number of gunicorn workers times the
+    # budget: set it to the memory of the pod divided by the number of workers.
+    KDF_MEMORY_BUDGET = os.environ.get("KDF_MEMORY_BUDGET", 0x200000)
+    KDF_MAX_QUEUE = os.environ.get("KDF_MAX_QUEUE", 16)
+    KDF_TIMEOUT_SECONDS = os.environ.get("KDF_TIMEOUT_SECONDS", 30)
+
+    # Number of pre-generated RSA key pairs that the fill-key-pairs command keeps in the pool
+    KEY_PAIR_POOL_SIZE = os.environ.get("KEY_PAIR_POOL_SIZE", 100)
+
     SUPERADMIN_USERNAME = os.environ.get("DDS_SUPERADMIN_USERNAME", "superadmin")
     SUPERADMIN_PASSWORD = os.environ.get("DDS_SUPERADMIN_PASSWORD", "password")
     SUPERADMIN_NAME = os.environ.get("DDS_SUPERADMIN_NAME", "superadmin")
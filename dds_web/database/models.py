@@ -27,6 +27,7 @@ from cryptography.hazmat.primitives import hashes
 from dds_web import db, auth
 from dds_web.errors import AuthenticationError
 from dds_web.security.project_user_keys import generate_user_key_pair
+from dds_web.security.kdf import run_kdf
 import dds_web.utils
 
 
@@ -149,6 +150,9 @@ class ProjectStatuses(db.Model):
 
     # Table setup
     __tablename__ = "projectstatuses"
+    __table_args__ = (
+        db.Index("ix_projectstatuses_project_id_date_created", "project_id", "date_created"),
+    )
 
     # Foreign keys & relationships
     project_id = db.Column(
@@ -224,7 +228,11 @@ class Unit(db.Model):
     def size(self):
         """Calculate size of unit - current total storage usage."""
 
-        return sum([p.size for p in self.projects])
+        return int(
+            db.session.query(sqlalchemy.func.coalesce(sqlalchemy.func.sum(Project.size), 0))
+            .filter(Project.unit_id == self.id)
+            .scalar()
+        )
 
     @validates("warning_level")
     def validate_level(self, key, value):
@@ -247,7 +255,12 @@ class Project(db.Model):
 
     # Table setup
     __tablename__ = "projects"
-    __table_args__ = {"extend_existing": True}
+    __table_args__ = (
+        db.Index(
+            "ix_projects_current_status_current_deadline", "current_status", "current_deadline"
+        ),
+        {"extend_existing": True},
+    )
 
     # Columns
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -270,6 +283,16 @@ class Project(db.Model):
     done = db.Column(db.Boolean, unique=False, nullable=False, default=False)
     busy = db.Column(db.Boolean, unique=False, nullable=False, default=False)
 
+    # Project statistics - kept up to date on write, see the listeners below
+    size = db.Column(db.BigInteger, unique=False, nullable=False, default=0)
+    num_files = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    current_status = db.Column(db.String(50), unique=False, nullable=True)
+    current_deadline = db.Column(db.DateTime(), nullable=True)
+    has_been_available = db.Column(db.Boolean, unique=False, nullable=False, default=False)
+    times_expired = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    # Change stamp - increased on every change to the project, its statuses or its files
+    revision = db.Column(db.Integer, unique=False, nullable=False, default=0)
+
     # Foreign keys & relationships
     unit_id = db.Column(db.Integer, db.ForeignKey("units.id", ondelete="RESTRICT"), nullable=True)
     responsible_unit = db.relationship("Unit", back_populates="projects")
@@ -296,38 +319,7 @@ class Project(db.Model):
         "ProjectInviteKeys", back_populates="project", passive_deletes=True
     )
     monthly_usage = db.relationship("Usage", back_populates="project")
-
-    @property
-    def current_status(self):
-        """Return the current status of the project"""
-        return max(self.project_statuses, key=lambda x: x.date_created).status
-
-    @property
-    def has_been_available(self):
-        """Return True if the project has ever been in the status Available"""
-        result = False
-        if len([x for x in self.project_statuses if "Available" in x.status]) > 0:
-            result = True
-        return result
-
-    @property
-    def times_expired(self):
-        return len([x for x in self.project_statuses if "Expired" in x.status])
-
-    @property
-    def current_deadline(self):
-        """Return deadline for statuses that have a deadline"""
-        deadline = None
-        if self.current_status in ["Available", "Expired"]:
-            deadline = max(self.project_statuses, key=lambda x: x.date_created).deadline
-        elif self.current_status in ["In Progress"]:
-            if self.has_been_available:
-                list_available = list(
-                    filter(lambda x: x.status == "Available", self.project_statuses)
-                )
-                latest_available = max(list_available, key=lambda x: x.date_created)
-                deadline = latest_available.deadline
-        return deadline
+    daily_storage = db.relationship("DailyStorage", back_populates="project")
 
     @property
     def safespring_project(self):
@@ -335,18 +327,6 @@ class Project(db.Model):
 
         return self.responsible_unit.safespring
 
-    @property
-    def size(self):
-        """Calculate size of project."""
-
-        return sum([f.size_stored for f in self.files])
-
-    @property
-    def num_files(self):
-        """Get number of files in project."""
-
-        return len(self.files)
-
     def __str__(self):
         """Called by str(), creates representation of object"""
 
@@ -361,11 +341,80 @@ class Project(db.Model):
 @sqlalchemy.event.listens_for(Project, "before_update")
 def add_before_project_update(mapper, connection, target):
     """Listen for the 'before_update' event on Project and update certain of its fields"""
+    # Increased in the database to not lose changes made in concurrent requests
+    target.revision = Project.revision + 1
     if auth.current_user():
         target.date_updated = dds_web.utils.current_time()
         target.last_updated_by = auth.current_user().username
 
 
+def deadline_after_status(status, deadline, previous_deadline):
+    """Get the project deadline after a status change.
+
+    Available and Expired have their own deadlines, In Progress keeps the deadline from when the
+    project was last Available (if ever) and the other statuses have no deadline.
+    """
+    if status in ["Available", "Expired"]:
+        return deadline
+    if status == "In Progress":
+        return previous_deadline
+    return None
+
+
+def current_status_and_deadline(status_history):
+    """Get the current status and deadline from a list of (status, deadline, date_created)."""
+    status = None
+    deadline = None
+    for row_status, row_deadline, _ in sorted(status_history, key=lambda x: x[2]):
+        status = row_status
+        deadline = deadline_after_status(
+            status=row_status, deadline=row_deadline, previous_deadline=deadline
+        )
+    return status, deadline
+
+
+def status_counters(statuses):
+    """Get whether the project has been available and the number of times it has expired."""
+    return "Available" in statuses, statuses.count("Expired")
+
+
+@sqlalchemy.event.listens_for(Project.project_statuses, "append")
+def update_current_status_on_append(target, value, initiator):
+    """Listen for new statuses on Project and update the current status, deadline and counters."""
+    target.current_deadline = deadline_after_status(
+        status=value.status, deadline=value.deadline, previous_deadline=target.current_deadline
+    )
+    target.current_status = value.status
+    if value.status == "Available":
+        target.has_been_available = True
+    elif value.status == "Expired":
+        target.times_expired = (target.times_expired or 0) + 1
+
+
+@sqlalchemy.event.listens_for(ProjectStatuses.status, "set")
+@sqlalchemy.event.listens_for(ProjectStatuses.deadline, "set")
+def update_current_status_on_change(target, value, oldvalue, initiator):
+    """Listen for changes to existing statuses and update the current status and counters."""
+    project = target.project
+    if project is None:
+        return
+
+    status_history = [
+        (
+            value if row is target and initiator.key == "status" else row.status,
+            value if row is target and initiator.key == "deadline" else row.deadline,
+            row.date_created,
+        )
+        for row in project.project_statuses
+    ]
+    project.current_status, project.current_deadline = current_status_and_deadline(
+        status_history=status_history
+    )
+    project.has_been_available, project.times_expired = status_counters(
+        statuses=[row_status for row_status, _, _ in status_history]
+    )
+
+
 # Users #################################################################################### Users #
 
 
@@ -449,7 +498,7 @@ class User(flask_login.UserMixin, db.Model):
             hash_len=flask.current_app.config["ARGON_HASH_LENGTH_PW"],
             type=flask.current_app.config["ARGON_TYPE_PW"],
         )
-        self._password_hash = pw_hasher.hash(plaintext_password)
+        self._password_hash = run_kdf(pw_hasher.hash, plaintext_password)
 
         # User key pair should only be set from here if the password is lost
         # and all the keys associated with the user should be cleaned up
@@ -472,7 +521,7 @@ class User(flask_login.UserMixin, db.Model):
 
         # Verify the input password
         try:
-            password_hasher.verify(self._password_hash, input_password)
+            run_kdf(password_hasher.verify, self._password_hash, input_password)
         except (
             argon2.exceptions.VerifyMismatchError,
             argon2.exceptions.VerificationError,
@@ -685,6 +734,13 @@ class ResearchUser(User):
 
         return [proj.project for proj in self.project_associations]
 
+    def has_project_access(self, project):
+        """Check if the user is associated with the project, without loading the projects."""
+
+        return db.session.query(
+            ProjectUsers.query.filter_by(project_id=project.id, user_id=self.username).exists()
+        ).scalar()
+
 
 class UnitUser(User):
     """
@@ -727,6 +783,11 @@ class UnitUser(User):
 
         return self.unit.projects
 
+    def has_project_access(self, project):
+        """Check if the project belongs to the unit of the user."""
+
+        return project.unit_id == self.unit_id
+
 
 class SuperAdmin(User):
     """
@@ -757,6 +818,11 @@ class SuperAdmin(User):
 
         return Project.query.all()
 
+    def has_project_access(self, project):
+        """Super admins can access all projects."""
+
+        return True
+
 
 ####################################################################################################
 
@@ -924,6 +990,50 @@ class PasswordReset(db.Model):
     valid = db.Column(db.Boolean, unique=False, nullable=False, default=True)
 
 
+def invalidate_user_identity_after_commit(target, username):
+    """Remove the cached identity of the user now, and again when the session is committed.
+
+    Requests reading the user between the flush and the commit would otherwise cache the old
+    identity again.
+    """
+    from dds_web.security.auth import invalidate_user_identity
+
+    invalidate_user_identity(username=username)
+    session = sqlalchemy.orm.object_session(target)
+    if session is not None:
+        session.info.setdefault("dds.changed_users", set()).add(username)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_commit")
+def invalidate_changed_user_identities(session):
+    """Remove the cached identities of the users changed in the committed transaction"""
+    from dds_web.security.auth import invalidate_user_identity
+
+    for username in session.info.pop("dds.changed_users", set()):
+        invalidate_user_identity(username=username)
+
+
+@sqlalchemy.event.listens_for(sqlalchemy.orm.Session, "after_rollback")
+def forget_changed_user_identities(session):
+    """The changes were rolled back, the identities were removed from the cache at flush"""
+    session.info.pop("dds.changed_users", None)
+
+
+@sqlalchemy.event.listens_for(User, "after_update", propagate=True)
+@sqlalchemy.event.listens_for(User, "after_delete", propagate=True)
+def add_after_user_change(mapper, connection, target):
+    """Listen for changes of User and remove the cached identity used for token authentication"""
+    invalidate_user_identity_after_commit(target=target, username=target.username)
+
+
+@sqlalchemy.event.listens_for(PasswordReset, "after_insert")
+@sqlalchemy.event.listens_for(PasswordReset, "after_update")
+def add_after_password_reset_change(mapper, connection, target):
+    """Listen for password resets and remove the cached identity used for token authentication"""
+    if target.user_id:
+        invalidate_user_identity_after_commit(target=target, username=target.user_id)
+
+
 class File(db.Model):
     """
     Data model for files.
@@ -970,6 +1080,70 @@ class File(db.Model):
         return f"<File {pathlib.Path(self.name).name}>"
 
 
+def update_project_file_statistics(connection, target, size_delta, files_delta):
+    """Update the size, number of files and revision of the project the file belongs to.
+
+    The update is done in the database, in the same transaction as the file change. A project
+    loaded in the session is updated to match.
+    """
+    projects_table = Project.__table__
+    connection.execute(
+        projects_table.update()
+        .where(projects_table.c.id == target.project_id)
+        .values(
+            size=projects_table.c.size + size_delta,
+            num_files=projects_table.c.num_files + files_delta,
+            revision=projects_table.c.revision + 1,
+        )
+    )
+
+    session = sqlalchemy.orm.object_session(target)
+    if not session:
+        return
+    project = session.identity_map.get(sqlalchemy.orm.util.identity_key(Project, target.project_id))
+    if project is None:
+        return
+    for key, delta in (("size", size_delta), ("num_files", files_delta), ("revision", 1)):
+        if isinstance(project.__dict__.get(key), int):
+            sqlalchemy.orm.attributes.set_committed_value(
+                project, key, project.__dict__[key] + delta
+            )
+
+
+@sqlalchemy.event.listens_for(File, "after_insert")
+def add_after_file_insert(mapper, connection, target):
+    """Listen for the 'after_insert' event on File and update the project statistics"""
+    update_project_file_statistics(
+        connection=connection, target=target, size_delta=target.size_stored, files_delta=1
+    )
+
+
+@sqlalchemy.event.listens_for(File, "after_update")
+def add_after_file_update(mapper, connection, target):
+    """Listen for the 'after_update' event on File and update the project statistics if changed"""
+    state = sqlalchemy.inspect(target)
+    changed = {attr.key for attr in state.attrs if attr.history.has_changes()}
+    # Downloads are not shown in the file listing and do not change the project
+    if not changed - {"time_latest_download"}:
+        return
+
+    history = state.attrs.size_stored.history
+    size_delta = 0
+    if history.added and history.deleted:
+        size_delta = sum(history.added) - sum(history.deleted)
+    update_project_file_statistics(
+        connection=connection, target=target, size_delta=size_delta, files_delta=0
+    )
+
+
+@sqlalchemy.event.listens_for(File, "after_delete")
+def add_after_file_delete(mapper, connection, target):
+    """Listen for the 'after_delete' event on File and update the project statistics"""
+    update_project_file_statistics(
+        connection=connection, target=target, size_delta=-target.size_stored, files_delta=-1
+    )
+
+
 class Version(db.Model):
     """
     Data model for keeping track of all active and non active files. Used for invoicing.
@@ -1004,9 +1178,9 @@ class Version(db.Model):
     # Additional columns
     size_stored = db.Column(db.BigInteger, unique=False, nullable=False)
     time_uploaded = db.Column(
-        db.DateTime(), unique=False, nullable=False, default=dds_web.utils.current_time
+        db.DateTime(), unique=False, nullable=False, default=dds_web.utils.current_time, index=True
     )
-    time_deleted = db.Column(db.DateTime(), unique=False, nullable=True, default=None)
+    time_deleted = db.Column(db.DateTime(), unique=False, nullable=True, default=None, index=True)
     time_invoiced = db.Column(db.DateTime(), unique=False, nullable=True, default=None)
 
     def __repr__(self):
@@ -1065,6 +1239,67 @@ class Usage(db.Model):
     )
 
 
+class DailyStorage(db.Model):
+    """
+    Data model for keeping track of the projects storage per day.
+
+    Rolled up from the file versions by the daily-storage command, so that the usage of any
+    period is the sum of the byte hours of its days. There is a row for every project with data
+    stored during the day, bytes_stored is the size stored at the end of the day.
+
+    Primary key:
+    - id
+
+    Foreign key(s):
+    - project_id
+    """
+
+    # Table setup
+    __tablename__ = "daily_storage"
+    __table_args__ = (
+        db.Index("ix_daily_storage_date_project_id", "date", "project_id", unique=True),
+        {"extend_existing": True},
+    )
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    # Foreign keys & relationships
+    project_id = db.Column(
+        db.Integer, db.ForeignKey("projects.id", ondelete="RESTRICT"), nullable=False
+    )
+    project = db.relationship("Project", back_populates="daily_storage")
+
+    # Additional columns
+    date = db.Column(db.Date(), unique=False, nullable=False)
+    bytes_stored = db.Column(db.BigInteger, unique=False, nullable=False)
+    byte_hours = db.Column(db.Float(precision=53), unique=False, nullable=False)
+
+
+class KeyPair(db.Model):
+    """
+    Data model for the pool of pre-generated RSA key pairs.
+
+    Filled by the fill-key-pairs command, and taken by new invites and users instead of generating
+    the keys during the request. The private keys are encrypted with a key derived from the
+    secret key of the app.
+
+    Primary key:
+    - id
+    """
+
+    # Table setup
+    __tablename__ = "key_pairs"
+    __table_args__ = {"extend_existing": True}
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    nonce = db.Column(db.LargeBinary(12), nullable=False)
+    public_key = db.Column(db.LargeBinary(600), nullable=False)
+    private_key = db.Column(db.LargeBinary(3000), nullable=False)
+    created_at = db.Column(db.DateTime(), nullable=False, default=dds_web.utils.current_time)
+
+
 class Maintenance(db.Model):
     """
     Keep track of whether or not the DDS is in maintenance mode.
@@ -1082,6 +1317,17 @@ class Maintenance(db.Model):
     active = db.Column(db.Boolean, nullable=False, default=True)
 
 
+@sqlalchemy.event.listens_for(MOTD, "after_insert")
+@sqlalchemy.event.listens_for(MOTD, "after_update")
+@sqlalchemy.event.listens_for(MOTD, "after_delete")
+@sqlalchemy.event.listens_for(Maintenance, "after_insert")
+@sqlalchemy.event.listens_for(Maintenance, "after_update")
+@sqlalchemy.event.listens_for(Maintenance, "after_delete")
+def add_after_global_settings_change(mapper, connection, target):
+    """Listen for changes of the MOTDs and the maintenance mode and bump the cached version"""
+    dds_web.utils.bump_global_settings_version()
+
+
 class Reporting(db.Model):
     """Keep track of number of users and units."""
 
@@ -1106,3 +1352,85 @@ class Reporting(db.Model):
     tb_uploaded_since_start = db.Column(db.Float, unique=False, nullable=True)
     tbhours = db.Column(db.Float, unique=False, nullable=True)
     tbhours_since_start = db.Column(db.Float, unique=False, nullable=True)
+    accumulators = db.relationship(
+        "ReportingAccumulators",
+        back_populates="reporting",
+        uselist=False,
+        passive_deletes=True,
+        cascade="all, delete",
+    )
+
+
+class ReportingAccumulators(db.Model):
+    """
+    Running totals of the uploaded data, for the reporting.
+
+    Calculated from the previous row and the versions added or deleted since then, so that the
+    reporting does not read all versions. A version is stored until it has been deleted. The
+    totals include the versions up to last_version_id; the newer versions are read again by the
+    next calculation in case versions with lower ids are committed after them.
+
+    Primary key:
+    - id
+
+    Foreign key(s):
+    - reporting_id
+    """
+
+    # Table setup
+    __tablename__ = "reporting_accumulators"
+    __table_args__ = {"extend_existing": True}
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    # Foreign keys & relationships
+    reporting_id = db.Column(
+        db.Integer, db.ForeignKey("reporting.id", ondelete="CASCADE"), unique=True, nullable=False
+    )
+    reporting = db.relationship("Reporting", back_populates="accumulators")
+    # ---
+
+    # Additional columns
+    time_calculated = db.Column(db.DateTime(), unique=False, nullable=False)
+    last_version_id = db.Column(db.Integer, unique=False, nullable=False)
+    bytes_uploaded = db.Column(db.BigInteger, unique=False, nullable=False)
+    bytes_stored = db.Column(db.BigInteger, unique=False, nullable=False)
+    byte_hours = db.Column(db.Float(precision=53), unique=False, nullable=False)
+
+
+class OutboxEmail(db.Model):
+    """
+    Emails waiting to be sent by the send-emails command.
+
+    Written in the same transaction as the change the email is about. The content is removed
+    once the email has been sent, or when sending it has been given up.
+
+    Primary key:
+    - id
+    """
+
+    # Table setup
+    __tablename__ = "outbox"
+    __table_args__ = {"extend_existing": True}
+
+    # Columns
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    subject = db.Column(db.String(255), unique=False, nullable=False)
+    recipients = db.Column(db.JSON, unique=False, nullable=False)
+    body = db.Column(db.Text, unique=False, nullable=True)
+    html = db.Column(db.Text, unique=False, nullable=True)
+    date_created = db.Column(
+        db.DateTime(), unique=False, nullable=False, default=dds_web.utils.current_time
+    )
+    next_attempt = db.Column(
+        db.DateTime(), unique=False, nullable=False, default=dds_web.utils.current_time, index=True
+    )
+    attempts = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    last_error = db.Column(db.Text, unique=False, nullable=True)
+    date_sent = db.Column(db.DateTime(), unique=False, nullable=True, index=True)
+
+    def __repr__(self):
+        """Called by print, creates representation of object"""
+
+        return f"<OutboxEmail {self.id}>"
@@ -396,6 +396,15 @@ class TooManyRequestsError(LoggedHTTPException):
         general_logger.warning(self.description)
 
 
+class KDFUnavailableError(LoggedHTTPException):
+    code = http.HTTPStatus.SERVICE_UNAVAILABLE
+
+    def __init__(self, message="The server is busy. Please try again in a moment."):
+        """Inform that too many password and key operations are already waiting."""
+        super().__init__(message)
+        general_logger.warning(message)
+
+
 class RoleException(LoggedHTTPException):
     code = http.HTTPStatus.FORBIDDEN
 
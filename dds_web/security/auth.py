@@ -6,18 +6,22 @@
 
 # built in libraries
 import gc
+import hashlib
+import threading
+import time
 
 # Installed
+import cachetools
 import datetime
 import http
 import flask
 import json
 import jwcrypto
-from jwcrypto import jwk, jwt
+from jwcrypto import jwt
 import structlog
 
 # Own modules
-from dds_web import basic_auth, auth, mail
+from dds_web import basic_auth, auth, db
 from dds_web.errors import (
     AuthenticationError,
     AccessDeniedError,
@@ -25,6 +29,7 @@ from dds_web.errors import (
     TokenMissingError,
 )
 from dds_web.database import models
+from dds_web.security.token_keys import token_verification_keys, verification_keys_fingerprint
 import dds_web.utils
 
 action_logger = structlog.getLogger("actions")
@@ -33,6 +38,45 @@ action_logger = structlog.getLogger("actions")
 
 MFA_EXPIRES_IN = datetime.timedelta(hours=168)
 
+# The claims kept in the verified token cache, the sensitive content is never cached
+CACHED_TOKEN_CLAIMS = ("sub", "exp", "iat", "inv", "rst", "mfa_auth_time")
+
+####################################################################################################
+# CLASSES ################################################################################ CLASSES #
+####################################################################################################
+
+
+class UserIdentity:
+    """The fields of a user needed for token authentication.
+
+    Cached between requests and returned by verify_token instead of the user row. The row is
+    loaded when auth.current_user() is first called during the request.
+    """
+
+    def __init__(self, user):
+        self.username = user.username
+        self.role = user.role
+        self.is_active = user.is_active
+        self.unit_id = getattr(user, "unit_id", None)
+        self.totp_enabled = user.totp_enabled
+        password_reset_row = user.password_reset[0] if user.password_reset else None
+        self.password_reset_changed = (
+            password_reset_row.changed
+            if password_reset_row and not password_reset_row.valid
+            else None
+        )
+
+    def __repr__(self):
+        return f"<UserIdentity {self.username}>"
+
+    def load(self):
+        """Load the user row."""
+        user = models.User.query.get(self.username)
+        if not user:
+            raise AccessDeniedError(message="Invalid token. Try reauthenticating.")
+        return user
+
+
 ####################################################################################################
 # FUNCTIONS ############################################################################ FUNCTIONS #
 ####################################################################################################
@@ -226,26 +270,89 @@ def obtain_current_encrypted_token_claims():
         return decrypt_and_verify_token_signature(token)
 
 
+def verified_token_cache():
+    """Get the cache of the verified token claims, and its lock, for the app.
+
+    The claims are kept by hash of the token until the token expires, so that repeated requests
+    with the same token are not decrypted and verified again.
+    """
+    app = flask.current_app
+    if "verified_token_cache" not in app.extensions:
+        app.extensions["verified_token_cache"] = (
+            cachetools.TLRUCache(
+                maxsize=app.config.get("VERIFIED_TOKEN_CACHE_SIZE", 10000),
+                ttu=lambda _, claims, __: claims.get("exp") or 0,
+                timer=time.time,
+            ),
+            threading.Lock(),
+        )
+    return app.extensions["verified_token_cache"]
+
+
+def user_identity_cache():
+    """Get the cache of the user identities, and its lock, for the app.
+
+    The identities are kept for a short time, since other processes are not notified of changes.
+    """
+    app = flask.current_app
+    if "user_identity_cache" not in app.extensions:
+        app.extensions["user_identity_cache"] = (
+            cachetools.TTLCache(
+                maxsize=10000, ttl=app.config.get("USER_IDENTITY_CACHE_SECONDS", 30)
+            ),
+            threading.Lock(),
+        )
+    return app.extensions["user_identity_cache"]
+
+
+def user_identity(username):
+    """Get the identity of the user from the cache, or from the user row.
+
+    Returns None if the user does not exist.
+    """
+    cache, cache_lock = user_identity_cache()
+    with cache_lock:
+        identity = cache.get(username)
+    if identity is None:
+        user = models.User.query.get(username)
+        if not user:
+            return None
+        identity = UserIdentity(user=user)
+        with cache_lock:
+            cache[username] = identity
+    return identity
+
+
+def invalidate_user_identity(username):
+    """Remove the identity of the user from the cache, after the user has been changed."""
+    if flask.has_app_context():
+        cache, cache_lock = user_identity_cache()
+        with cache_lock:
+            cache.pop(username, None)
+
+
 @auth.verify_token
 def verify_token(token):
-    """Verify token used in token authentication."""
-    claims = __verify_general_token(token=token)
+    """Verify token used in token authentication.
+
+    Returns the identity of the user, the user row is loaded by auth.current_user().
+    """
+    claims = __verify_general_token(token=token, use_cache=True)
 
     if claims.get("rst"):
         raise AuthenticationError(message="Invalid token")
 
-    user = __user_from_subject(subject=claims.get("sub"))
+    user = __identity_from_subject(subject=claims.get("sub"))
     if not user:
         raise AccessDeniedError(message="Invalid token. Try reauthenticating.")
 
     # Block all users but Super Admins during maintenance
     dds_web.utils.block_if_maintenance(user=user)
 
-    if user.password_reset:
+    if user.password_reset_changed:
         token_expired = claims.get("exp")
         token_issued = datetime.datetime.fromtimestamp(token_expired) - MFA_EXPIRES_IN
-        password_reset_row = user.password_reset[0]
-        if not password_reset_row.valid and password_reset_row.changed > token_issued:
+        if user.password_reset_changed > token_issued:
             raise AuthenticationError(
                 message=(
                     "Password reset performed after last authentication. "
@@ -257,29 +364,52 @@ def verify_token(token):
     )
 
 
-def __verify_general_token(token):
+def __verify_general_token(token, use_cache=False):
     """Verifies the format, signature and expiration time of an encrypted and signed JWT token.
 
     Raises AuthenticationError if token is invalid or absent, could raise other exceptions from
     dependencies. On successful verification, it returns a dictionary of the claims in the token.
+
+    With use_cache, the claims of a token which has already been verified are taken from the
+    verified token cache, and only the claims in CACHED_TOKEN_CLAIMS are returned. The sensitive
+    content is decrypted from the token when needed. The expiration time is checked either way.
     """
     # Token required
     if not token:
         raise AuthenticationError(message="No token")
 
-    # Verify token signature if signed or decrypt first if encrypted
-    try:
-        data = (
-            verify_token_signature(token=token)
-            if token.count(".") == 2
-            else decrypt_and_verify_token_signature(token=token)
+    data = None
+    if use_cache:
+        cache, cache_lock = verified_token_cache()
+        cache_key = (
+            hashlib.sha256(token.encode("utf-8")).hexdigest(),
+            verification_keys_fingerprint(),
         )
-    except (ValueError, jwcrypto.common.JWException) as e:
-        # ValueError is raised when the token doesn't look right (for example no periods)
-        # jwcryopto.common.JWException is the base exception raised by jwcrypto,
-        # and is raised when the token is malformed or invalid.
-        flask.current_app.logger.warning(f"Error with Token operation: {type(e).__name__}")
-        raise AuthenticationError(message="Invalid token") from e
+        with cache_lock:
+            data = cache.get(cache_key)
+
+    if data is None:
+        # Verify token signature if signed or decrypt first if encrypted
+        try:
+            data = (
+                verify_token_signature(token=token)
+                if token.count(".") == 2
+                else decrypt_and_verify_token_signature(token=token)
+            )
+        except (ValueError, jwcrypto.common.JWException) as e:
+            # ValueError is raised when the token doesn't look right (for example no periods)
+            # jwcryopto.common.JWException is the base exception raised by jwcrypto,
+            # and is raised when the token is malformed or invalid.
+            flask.current_app.logger.warning(f"Error with Token operation: {type(e).__name__}")
+            raise AuthenticationError(message="Invalid token") from e
+
+        if use_cache:
+            data = {claim: data[claim] for claim in CACHED_TOKEN_CLAIMS if claim in data}
+            with cache_lock:
+                cache[cache_key] = data
+
+    # Copy, the cached claims must not be changed by the caller
+    data = dict(data)
 
     expiration_time = data.get("exp")
     # Use a hard check on top of the one from the dependency
@@ -304,6 +434,18 @@ def __user_from_subject(subject):
             return user
 
 
+def __identity_from_subject(subject):
+    """Get user identity from username."""
+    if subject:
+        identity = user_identity(username=subject)
+        if identity:
+            if not identity.is_active:
+                raise AccessDeniedError(
+                    message=("Your account has been deactivated. You cannot use the DDS.")
+                )
+            return identity
+
+
 def __handle_multi_factor_authentication(user, mfa_auth_time_string):
     """Verify multifactor authentication time frame."""
     if user:
@@ -314,7 +456,7 @@ def __handle_multi_factor_authentication(user, mfa_auth_time_string):
 
         error_message = ""
         if not user.totp_enabled:
-            send_hotp_email(user)
+            send_hotp_email(user.load() if isinstance(user, UserIdentity) else user)
             error_message = "Please check your primary e-mail!"
 
         if flask.request.path.endswith("/user/second_factor"):
@@ -339,9 +481,10 @@ def send_hotp_email(user):
         # Generate the one time code from the users specific hotp secret
         hotp_value = user.generate_HOTP_token()
 
-        # Create and send email
+        # Create email and add it to the outbox
         msg = dds_web.utils.create_one_time_password_email(user=user, hotp_value=hotp_value)
-        mail.send(msg)
+        dds_web.utils.queue_email(msg)
+        db.session.commit()
         return True
     return False
 
@@ -365,11 +508,9 @@ def decrypt_token(token):
 
     Return the signed token embedded inside.
     """
-    # Get key used for encryption
-    key = jwk.JWK.from_password(flask.current_app.config.get("SECRET_KEY"))
-    # Decrypt token
+    # Decrypt token with the current or a previous key
     try:
-        decrypted_token = jwt.JWT(key=key, jwt=token, expected_type="JWE")
+        decrypted_token = jwt.JWT(key=token_verification_keys(), jwt=token, expected_type="JWE")
     except ValueError as exc:
         # "Token format unrecognized"
         raise AuthenticationError(message="Invalid token") from exc
@@ -382,12 +523,11 @@ def verify_token_signature(token):
 
     Return the claims such as subject/username on valid signature.
     """
-    # Get key used for signing
-    key = jwk.JWK.from_password(flask.current_app.config.get("SECRET_KEY"))
-
-    # Verify token
+    # Verify token with the current or a previous key
     try:
-        jwttoken = jwt.JWT(key=key, jwt=token, algs=["HS256"], expected_type="JWS")
+        jwttoken = jwt.JWT(
+            key=token_verification_keys(), jwt=token, algs=["HS256"], expected_type="JWS"
+        )
         return json.loads(jwttoken.claims)
     except jwt.JWTExpired as exc:
         # jwt dependency uses a 60 seconds leeway to check exp
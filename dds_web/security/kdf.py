@@ -0,0 +1,123 @@
+"""Bounded executor for the Argon2 password hashing and key derivation."""
+
+# Standard library
+import concurrent.futures
+import threading
+import time
+
+# Installed
+import flask
+
+# Own modules
+from dds_web.errors import KDFUnavailableError
+
+# The executor of the process and the settings it was created with
+_executor = None
+_executor_settings = None
+_executor_lock = threading.Lock()
+
+
+class KDFExecutor:
+    """Run Argon2 operations on a fixed number of workers with a bounded queue.
+
+    Every Argon2 operation allocates its full memory cost, so the number of workers is the
+    memory budget divided by the largest memory cost. Operations that cannot be queued, or
+    that are not finished within the timeout, fail with KDFUnavailableError (503).
+    """
+
+    def __init__(self, workers, max_queue, timeout):
+        self.workers = workers
+        self.timeout = timeout
+        self.__executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="dds-kdf"
+        )
+        self.__slots = threading.BoundedSemaphore(workers + max_queue)
+        self.__depth = 0
+        self.__depth_lock = threading.Lock()
+
+    @property
+    def depth(self):
+        """Number of operations waiting or running."""
+        return self.__depth
+
+    def shutdown(self):
+        """Stop the workers once the operations already submitted are done, without waiting."""
+        self.__executor.shutdown(wait=False)
+
+    def __change_depth(self, change):
+        with self.__depth_lock:
+            self.__depth += change
+            return self.__depth
+
+    def __release(self, _future):
+        self.__change_depth(-1)
+        self.__slots.release()
+
+    def run(self, function, *args, **kwargs):
+        """Run the function on a worker and return its result, or raise its exception."""
+        if not self.__slots.acquire(blocking=False):
+            flask.current_app.logger.warning(
+                f"KDF executor saturated: {self.depth} operations waiting or running."
+            )
+            raise KDFUnavailableError()
+
+        depth = self.__change_depth(1)
+        submitted = time.perf_counter()
+        started = []
+
+        def timed():
+            started.append(time.perf_counter())
+            return function(*args, **kwargs)
+
+        future = self.__executor.submit(timed)
+        future.add_done_callback(self.__release)
+        try:
+            result = future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError as exc:
+            future.cancel()
+            flask.current_app.logger.warning(
+                f"KDF operation timed out after {self.timeout} seconds "
+                f"with {self.depth} operations waiting or running."
+            )
+            raise KDFUnavailableError() from exc
+
+        finished = time.perf_counter()
+        flask.current_app.logger.debug(
+            f"KDF operation done: queue depth {depth}, "
+            f"waited {started[0] - submitted:.3f} s, total {finished - submitted:.3f} s."
+        )
+        return result
+
+
+def kdf_executor():
+    """Get the KDF executor of the process.
+
+    The memory budget is per process, so there is one executor, which is replaced when the
+    settings of the app change.
+    """
+    global _executor, _executor_settings
+    config = flask.current_app.config
+    memory_cost = max(int(config["ARGON_MEMORY_COST_KD"]), int(config["ARGON_MEMORY_COST_PW"]))
+    settings = (
+        max(1, int(config.get("KDF_MEMORY_BUDGET", 0)) // memory_cost),
+        int(config.get("KDF_MAX_QUEUE", 16)),
+        float(config.get("KDF_TIMEOUT_SECONDS", 30)),
+    )
+    with _executor_lock:
+        if settings != _executor_settings:
+            if _executor is not None:
+                _executor.shutdown()
+            workers, max_queue, timeout = settings
+            _executor = KDFExecutor(workers=workers, max_queue=max_queue, timeout=timeout)
+            _executor_settings = settings
+        return _executor
+
+
+def run_kdf(function, *args, **kwargs):
+    """Run an Argon2 operation on the KDF executor.
+
+    Outside of requests, e.g. in the flask commands, the operation is run directly.
+    """
+    if not flask.has_request_context():
+        return function(*args, **kwargs)
+    return kdf_executor().run(function, *args, **kwargs)
@@ -1,14 +1,17 @@
 """ Code for generating and maintaining project and user related keys """
 
+import contextlib
 import os
 
 import argon2
 import cryptography.exceptions
 from cryptography.hazmat.primitives import asymmetric, hashes, serialization
 from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import flask
 import gc
 
+from dds_web import db
 from dds_web.database import models
 from dds_web.errors import (
     KeyNotFoundError,
@@ -20,13 +23,15 @@ from dds_web.security.auth import (
     extract_encrypted_token_sensitive_content,
     extract_token_invite_key,
 )
+from dds_web.security.kdf import run_kdf
 
 
 def __derive_key(user, password):
     if not user.kd_salt:
         raise KeySetupError(message="User keys are not properly setup!")
 
-    derived_key = argon2.low_level.hash_secret_raw(
+    derived_key = run_kdf(
+        argon2.low_level.hash_secret_raw,
         secret=password.encode(),
         salt=user.kd_salt,
         time_cost=flask.current_app.config["ARGON_TIME_COST_KD"],
@@ -84,48 +89,89 @@ def __encrypt_project_private_key(owner, project_private_key):
         raise KeyOperationError(message="User public key could not be loaded!") from exc
 
 
-def __decrypt_project_private_key(user, token, encrypted_project_private_key):
+def __load_user_private_key(user, token):
     private_key_bytes = __decrypt_user_private_key_via_token(user, token)
     if not private_key_bytes:
         raise KeyOperationError(message="User private key could not be decrypted!")
 
     try:
         user_private_key = serialization.load_der_private_key(private_key_bytes, password=None)
-        if isinstance(user_private_key, asymmetric.rsa.RSAPrivateKey):
-            return __decrypt_with_rsa(encrypted_project_private_key, user_private_key)
+    except ValueError as exc:
+        raise KeyOperationError(message="User private key could not be loaded!") from exc
+    finally:
+        del private_key_bytes
+        gc.collect()
+
+    if isinstance(user_private_key, asymmetric.rsa.RSAPrivateKey):
+        return user_private_key
+    return None
+
+
+def __decrypt_project_private_key(user_private_key, encrypted_project_private_key):
+    if not user_private_key:
+        return None
+
+    try:
+        return __decrypt_with_rsa(encrypted_project_private_key, user_private_key)
     except ValueError as exc:
         raise KeyOperationError(message="User private key could not be loaded!") from exc
 
 
-def obtain_project_private_key(user, project, token):
+@contextlib.contextmanager
+def user_private_key(user, token):
+    """
+    Derive and decrypt the private key of the user at most once within the context.
+
+    Yields a function returning the private key. The key derivation is only done the first
+    time the function is called, and the decrypted key is removed when the context exits.
+    Pass the function as user_private_key to obtain_project_private_key and
+    share_project_private_key when handling several projects in the same request.
+    """
+    unlocked = {}
+
+    def get_private_key():
+        if "key" not in unlocked:
+            unlocked["key"] = __load_user_private_key(user, token)
+        return unlocked["key"]
+
+    try:
+        yield get_private_key
+    finally:
+        unlocked.clear()
+        gc.collect()
+
+
+def obtain_project_private_key(user, project, token, user_private_key=None):
     project_key = models.ProjectUserKeys.query.filter_by(
         project_id=project.id, user_id=user.username
     ).first()
     if project_key:
-        return __decrypt_project_private_key(user, token, project_key.key)
+        if user_private_key:
+            return __decrypt_project_private_key(user_private_key(), project_key.key)
+        return __decrypt_project_private_key(__load_user_private_key(user, token), project_key.key)
     raise KeyNotFoundError(project=project.public_id)
 
 
 def share_project_private_key(
-    from_user, to_another, from_user_token, project, is_project_owner=False
+    from_user, to_another, from_user_token, project, is_project_owner=False, user_private_key=None
 ):
+    project_private_key = obtain_project_private_key(
+        user=from_user, project=project, token=from_user_token, user_private_key=user_private_key
+    )
     if isinstance(to_another, models.Invite):
         __init_and_append_project_invite_key(
             invite=to_another,
             project=project,
-            project_private_key=obtain_project_private_key(
-                user=from_user, project=project, token=from_user_token
-            ),
+            project_private_key=project_private_key,
             is_project_owner=is_project_owner,
         )
     else:
         __init_and_append_project_user_key(
             user=to_another,
             project=project,
-            project_private_key=obtain_project_private_key(
-                user=from_user, project=project, token=from_user_token
-            ),
+            project_private_key=project_private_key,
         )
+    del project_private_key
 
 
 def __init_and_append_project_user_key(user, project, project_private_key):
@@ -306,8 +352,8 @@ def __verify_invite_temporary_key(invite, temporary_key):
     return None
 
 
-def __generate_rsa_key_pair(owner):
-    """Generate RSA key pair."""
+def __new_rsa_key_pair():
+    """Generate RSA key pair and return the private and public key bytes."""
     # Generate keys and get them in bytes
     private_key = asymmetric.rsa.generate_private_key(public_exponent=65537, key_size=4096)
     private_key_bytes = private_key.private_bytes(
@@ -317,13 +363,70 @@ def __generate_rsa_key_pair(owner):
         serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
     )
 
-    # Set row public key
-    owner.public_key = public_key_bytes
-
     # Clean up sensitive information
     del private_key
     gc.collect()
 
+    return private_key_bytes, public_key_bytes
+
+
+def __key_pair_pool_key():
+    """Key encrypting the private keys in the key pair pool, derived from the app secret key."""
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"dds key pair pool").derive(
+        flask.current_app.config["SECRET_KEY"].encode()
+    )
+
+
+def __take_pooled_key_pair():
+    """Take a key pair from the pool. Returns None if the pool is empty."""
+    key_pair = (
+        models.KeyPair.query.order_by(models.KeyPair.id).with_for_update(skip_locked=True).first()
+    )
+    if not key_pair:
+        return None
+
+    db.session.delete(key_pair)
+    private_key_bytes = __decrypt_with_aes(
+        key=__key_pair_pool_key(),
+        ciphertext=key_pair.private_key,
+        nonce=key_pair.nonce,
+        aad=key_pair.public_key,
+    )
+    if not private_key_bytes:
+        # E.g. the secret key has changed since the key pair was added
+        flask.current_app.logger.warning("Pooled key pair could not be decrypted; discarded.")
+        return None
+
+    return private_key_bytes, key_pair.public_key
+
+
+def add_key_pair_to_pool():
+    """Generate a key pair and add it, with the private key encrypted, to the pool."""
+    private_key_bytes, public_key_bytes = __new_rsa_key_pair()
+    nonce, encrypted_key = __encrypt_with_aes(
+        key=__key_pair_pool_key(), plaintext=private_key_bytes, aad=public_key_bytes
+    )
+    db.session.add(
+        models.KeyPair(public_key=public_key_bytes, private_key=encrypted_key, nonce=nonce)
+    )
+    del private_key_bytes
+    gc.collect()
+
+
+def key_pair_pool_level():
+    """Number of key pairs available in the pool."""
+    return models.KeyPair.query.count()
+
+
+def __generate_rsa_key_pair(owner):
+    """Set up RSA key pair, taken from the pool if possible and otherwise generated."""
+    key_pair = __take_pooled_key_pair() or __new_rsa_key_pair()
+    private_key_bytes, public_key_bytes = key_pair
+    del key_pair
+
+    # Set row public key
+    owner.public_key = public_key_bytes
+
     return private_key_bytes
 
 
@@ -0,0 +1,76 @@
+"""Keys for signing, encrypting, verifying and decrypting the tokens."""
+
+# Standard library
+import hashlib
+import threading
+
+# Installed
+import cachetools
+import flask
+from jwcrypto import jwk
+
+# Keys derived from the secret keys, by fingerprint of the secrets
+_keys = cachetools.LRUCache(maxsize=16)
+_keys_lock = threading.Lock()
+
+
+def secret_fingerprint(secret):
+    """Return a fingerprint of a secret key, which identifies it without revealing it."""
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+def __cached_key(fingerprint, create):
+    """Return the key with the fingerprint from the cache, or create and cache it."""
+    with _keys_lock:
+        key = _keys.get(fingerprint)
+    if key is None:
+        key = create()
+        with _keys_lock:
+            _keys[fingerprint] = key
+    return key
+
+
+def token_key():
+    """Return the key for signing and encrypting tokens, derived from SECRET_KEY.
+
+    The key is derived once per secret and reused, a new key is derived when the secret changes.
+    """
+    secret = flask.current_app.config.get("SECRET_KEY")
+    return __cached_key(
+        fingerprint=secret_fingerprint(secret), create=lambda: jwk.JWK.from_password(secret)
+    )
+
+
+def __verification_secrets():
+    """Return SECRET_KEY followed by PREVIOUS_SECRET_KEYS."""
+    return [
+        flask.current_app.config.get("SECRET_KEY"),
+        *flask.current_app.config.get("PREVIOUS_SECRET_KEYS", []),
+    ]
+
+
+def verification_keys_fingerprint():
+    """Return a fingerprint of the secret keys used for verifying and decrypting tokens."""
+    return "keyset:" + ":".join(secret_fingerprint(secret) for secret in __verification_secrets())
+
+
+def token_verification_keys():
+    """Return the keys for verifying and decrypting tokens.
+
+    The key from SECRET_KEY and the keys from PREVIOUS_SECRET_KEYS, so that tokens issued before
+    the secret key was rotated are still valid. The keys are tried in that order.
+    """
+    secrets_in_use = __verification_secrets()
+
+    def create():
+        keys = jwk.JWKSet()
+        for secret in secrets_in_use:
+            keys.add(
+                __cached_key(
+                    fingerprint=secret_fingerprint(secret),
+                    create=lambda: jwk.JWK.from_password(secret),
+                )
+            )
+        return keys
+
+    return __cached_key(fingerprint=verification_keys_fingerprint(), create=create)
@@ -7,12 +7,12 @@ import datetime
 import secrets
 
 # Installed
-import flask
-from jwcrypto import jwk, jwt
+from jwcrypto import jwt
 
 # Own modules
 import dds_web.utils
 import dds_web.forms
+from dds_web.security.token_keys import token_key
 
 
 # Functions ############################################################################ FUNCTIONS #
@@ -56,8 +56,7 @@ def encrypted_jwt_token(
         ),
         expected_type="JWE",
     )
-    key = jwk.JWK.from_password(flask.current_app.config.get("SECRET_KEY"))
-    token.make_encrypted_token(key)
+    token.make_encrypted_token(token_key())
     return token.serialize()
 
 
@@ -99,9 +98,8 @@ def __signed_jwt_token(
     if sensitive_content:
         data["sen_con"] = sensitive_content
 
-    key = jwk.JWK.from_password(flask.current_app.config.get("SECRET_KEY"))
     token = jwt.JWT(header={"alg": "HS256"}, claims=data, algs=["HS256"], expected_type="JWS")
-    token.make_signed_token(key)
+    token.make_signed_token(token_key())
     return token.serialize()
 
 
@@ -12,11 +12,13 @@ import typing
 import urllib.parse
 import time
 import smtplib
+import threading
 from dateutil.relativedelta import relativedelta
 import gc
 
 # Installed
 import botocore
+import cachetools
 from contextlib import contextmanager
 import flask
 from dds_web.errors import (
@@ -74,10 +76,24 @@ def get_required_item(req: str, obj: werkzeug.datastructures.ImmutableMultiDict
     return req_val
 
 
+def has_project_access(project) -> bool:
+    """Check if the current authenticated user has access to the project.
+
+    The check depends on the role of the user and does not load the projects of the user. The
+    result is kept for the rest of the request.
+    """
+    user = auth.current_user()
+    checked = flask.request.environ.setdefault("dds.project_access", {})
+    key = (user.username, project.id)
+    if key not in checked:
+        checked[key] = bool(user.has_project_access(project))
+    return checked[key]
+
+
 # Cannot have type hint for return due to models.Project giving circular import
 def verify_project_access(project) -> None:
     """Verify that current authenticated user has access to project."""
-    if project not in auth.current_user().projects:
+    if not has_project_access(project):
         raise AccessDeniedError(
             message="Project access denied.",
             username=auth.current_user().username,
@@ -85,6 +101,25 @@ def verify_project_access(project) -> None:
         )
 
 
+def project_change_stamp():
+    """Get the change stamp of the project in the request args, used for conditional requests.
+
+    None if the project does not exist or the user does not have access to it, the resource
+    then reports the error as usual.
+    """
+    project_id = flask.request.args.get("project")
+    if not project_id:
+        return None
+
+    project = models.Project.query.filter(
+        models.Project.public_id == sqlalchemy.func.binary(project_id)
+    ).one_or_none()
+    if not project or not has_project_access(project):
+        return None
+
+    return project.id, project.revision, project.created_by
+
+
 def verify_project_user_key(project) -> None:
     """Verify that current authenticated user has a row in projectUserKeys."""
     project_key = models.ProjectUserKeys.query.filter_by(
@@ -348,8 +383,8 @@ def username_in_db(username):
 def get_username_or_request_ip():
     """Util function for action logger: Try to identify the requester"""
 
-    if auth.current_user():
-        current_user = auth.current_user().username
+    if auth.current_identity():
+        current_user = auth.current_identity().username
     elif flask_login.current_user.is_authenticated:
         current_user = flask_login.current_user.username
     else:
@@ -474,15 +509,40 @@ def working_directory(path):
         os.chdir(current_path)
 
 
-def page_query(q):
-    offset = 0
+def page_query(q, key=None, page_size=1000):
+    """Iterate over the rows of a query in pages ordered by a unique key.
+
+    Each page is selected with `key > last key` instead of an OFFSET, so reading a page costs the
+    same however many rows have already been read, and rows are neither skipped nor repeated
+    when the session is committed during the iteration. The key is a unique column of the first
+    entity in the query, by default its primary key. Entities with a composite primary key need
+    an explicit key, raises ValueError otherwise. Queries with several entities, e.g. joins,
+    yield the rows as tuples as usual. The query should not be ordered or limited.
+    """
+    entity = q.column_descriptions[0]["entity"]
+    mapper = sqlalchemy.inspect(entity)
+    if key is None:
+        if len(mapper.primary_key) != 1:
+            raise ValueError(
+                f"{entity.__name__} has a composite primary key, a unique key is required."
+            )
+        key = getattr(entity, mapper.get_property_by_column(mapper.primary_key[0]).key)
+    single_entity = len(q.column_descriptions) == 1
+
+    last_key = None
     while True:
-        r = False
-        for elem in q.limit(1000).offset(offset):
-            r = True
-            yield elem
-        offset += 1000
-        if not r:
+        page = q.order_by(None).order_by(key)
+        if last_key is not None:
+            page = page.filter(key > last_key)
+        rows = page.limit(page_size).all()
+        if not rows:
+            break
+
+        # Get the last key before yielding, the rows may be expired by a commit
+        last_row = rows[-1] if single_entity else rows[-1][0]
+        last_key = getattr(last_row, key.key)
+        yield from rows
+        if len(rows) < page_size:
             break
 
 
@@ -501,13 +561,8 @@ def send_email_with_retry(msg, times_retried=0, obj=None):
             send_email_with_retry(msg, times_retried=retry, obj=obj)
 
 
-def create_one_time_password_email(user, hotp_value):
-    """Create HOTP email."""
-    msg = flask_mail.Message(
-        "DDS One-Time Authentication Code",
-        recipients=[user.primary_email],
-    )
-
+def attach_logo(msg):
+    """Attach the SciLifeLab logo, used in the html emails, to the message."""
     msg.attach(
         "scilifelab_logo.png",
         "image/png",
@@ -517,6 +572,110 @@ def create_one_time_password_email(user, hotp_value):
             ["Content-ID", "<Logo>"],
         ],
     )
+
+
+def queue_email(msg):
+    """Add an email to the outbox, to be sent by the send-emails command.
+
+    The email is added to the current database session and is only sent if the session is
+    committed. The logo is attached when the email is sent.
+    """
+    from dds_web import db
+
+    db.session.add(
+        models.OutboxEmail(
+            subject=msg.subject,
+            recipients=list(msg.recipients),
+            body=msg.body,
+            html=msg.html,
+        )
+    )
+
+
+def send_outbox_emails(batch_size=50, max_attempts=5, retry_delay=60):
+    """Send the emails in the outbox which are due, in batches over one SMTP connection per batch.
+
+    Failed emails are retried with exponential backoff, starting at retry_delay seconds, until
+    they have been attempted max_attempts times, then their content is removed. The emails are
+    locked while being sent so that several dispatchers can run at the same time.
+
+    Returns the number of sent and failed emails.
+    """
+    from dds_web import db
+
+    sent = 0
+    failed = 0
+    while True:
+        now = current_time()
+        emails = (
+            models.OutboxEmail.query.filter(
+                models.OutboxEmail.date_sent.is_(None),
+                models.OutboxEmail.attempts < max_attempts,
+                models.OutboxEmail.next_attempt <= now,
+            )
+            .order_by(models.OutboxEmail.next_attempt, models.OutboxEmail.id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        if not emails:
+            break
+
+        try:
+            with mail.connect() as connection:
+                for email in emails:
+                    msg = flask_mail.Message(
+                        email.subject,
+                        recipients=email.recipients,
+                        body=email.body,
+                        html=email.html,
+                    )
+                    attach_logo(msg)
+                    try:
+                        connection.send(msg)
+                    except smtplib.SMTPRecipientsRefused as err:
+                        email.last_error = str(err)
+                        email.attempts = max_attempts
+                        # Given up, don't keep the codes and links in the email
+                        email.body = None
+                        email.html = None
+                        failed += 1
+                        continue
+
+                    email.attempts += 1
+                    email.date_sent = current_time()
+                    email.body = None
+                    email.html = None
+                    email.last_error = None
+                    sent += 1
+        except (smtplib.SMTPException, OSError) as err:
+            # The remaining emails in the batch are retried later
+            flask.current_app.logger.warning(f"Sending emails failed: {err}")
+            for email in emails:
+                if email.date_sent or email.attempts >= max_attempts:
+                    continue
+                email.attempts += 1
+                email.last_error = str(err)
+                email.next_attempt = current_time() + datetime.timedelta(
+                    seconds=retry_delay * 2 ** (email.attempts - 1)
+                )
+                if email.attempts >= max_attempts:
+                    email.body = None
+                    email.html = None
+                    failed += 1
+
+        db.session.commit()
+
+    return sent, failed
+
+
+def create_one_time_password_email(user, hotp_value):
+    """Create HOTP email."""
+    msg = flask_mail.Message(
+        "DDS One-Time Authentication Code",
+        recipients=[user.primary_email],
+    )
+
     msg.body = flask.render_template(
         "mail/authenticate.txt", one_time_value=hotp_value.decode("utf-8")
     )
@@ -548,12 +707,81 @@ def bucket_is_valid(bucket_name):
     return valid, message
 
 
+def __global_settings_state():
+    """Get the cached global settings of the app, their version and the lock."""
+    app = flask.current_app
+    if "global_settings" not in app.extensions:
+        app.extensions["global_settings"] = {
+            "cache": cachetools.TTLCache(
+                maxsize=4, ttl=app.config.get("GLOBAL_SETTINGS_CACHE_SECONDS", 10)
+            ),
+            "version": 0,
+            "lock": threading.Lock(),
+        }
+    return app.extensions["global_settings"]
+
+
+def global_settings():
+    """Return the maintenance mode and the active MOTDs, newest first.
+
+    Needed by every request, so they are cached in the process for a few seconds. Changes made in
+    this process bump the version, which makes the next request read them again.
+    """
+    state = __global_settings_state()
+    with state["lock"]:
+        version = state["version"]
+        settings = state["cache"].get(version)
+
+    if settings is None:
+        maintenance = models.Maintenance.query.first()
+        settings = {
+            "maintenance_active": bool(maintenance and maintenance.active),
+            "motds": [
+                {"id": motd.id, "message": motd.message, "date_created": motd.date_created}
+                for motd in models.MOTD.query.filter_by(active=True).order_by(
+                    models.MOTD.date_created.desc()
+                )
+            ],
+        }
+        # Settings read before a version bump are not kept
+        with state["lock"]:
+            state["cache"][version] = settings
+
+    return settings
+
+
+def bump_global_settings_version():
+    """Make the next request read the maintenance mode and the MOTDs again."""
+    if flask.has_app_context():
+        state = __global_settings_state()
+        with state["lock"]:
+            state["version"] += 1
+            state["cache"].clear()
+
+
 def get_active_motds():
     """Return latest MOTD."""
-    motds_active = (
-        models.MOTD.query.filter_by(active=True).order_by(models.MOTD.date_created.desc()).all()
-    )
-    return motds_active or None
+    return global_settings()["motds"] or None
+
+
+def units_usage(unit_ids=None):
+    """Return the current storage usage of the units, in bytes.
+
+    The project sizes, which are kept up to date when files are added and deleted, are summed per
+    unit in one grouped query. Only the units in unit_ids are included if specified.
+
+    Returns a dict with the unit id as key and the usage as value, for all units with projects.
+    """
+    from dds_web import db
+
+    query = db.session.query(
+        models.Project.unit_id,
+        sqlalchemy.func.coalesce(sqlalchemy.func.sum(models.Project.size), 0),
+    ).filter(models.Project.unit_id.isnot(None))
+    if unit_ids is not None:
+        query = query.filter(models.Project.unit_id.in_(unit_ids))
+
+    return {unit_id: int(usage) for unit_id, usage in query.group_by(models.Project.unit_id)}
 
 
 def calculate_bytehours(
@@ -609,6 +837,261 @@ def calculate_version_period_usage(version):
     return bytehours
 
 
+def calculate_period_usage(project_ids, now=None, invoice=True):
+    """Calculate the byte hours since the last usage calculation for several projects.
+
+    Set based version of calculate_version_period_usage: the byte hours of each version, from
+    time_invoiced (or time_uploaded) until time_deleted (or now), are summed per project in the
+    database, and time_invoiced is set to time_deleted (or now) with one update unless invoice is
+    False. Versions which have been deleted and fully invoiced are skipped. The changes are not
+    committed.
+
+    Returns a dict with the project id as key and the byte hours as value, for the projects with
+    versions to invoice.
+    """
+    from dds_web import db
+
+    if not project_ids:
+        return {}
+
+    if now is None:
+        now = current_time()
+
+    not_invoiced = sqlalchemy.and_(
+        models.Version.project_id.in_(project_ids),
+        sqlalchemy.or_(
+            models.Version.time_deleted.is_(None),
+            models.Version.time_invoiced.is_(None),
+            models.Version.time_deleted != models.Version.time_invoiced,
+        ),
+    )
+
+    # Cast size to decimal to avoid overflowing the product
+    byte_microseconds = sqlalchemy.func.sum(
+        sqlalchemy.func.timestampdiff(
+            sqlalchemy.literal_column("MICROSECOND"),
+            sqlalchemy.func.coalesce(models.Version.time_invoiced, models.Version.time_uploaded),
+            sqlalchemy.func.coalesce(models.Version.time_deleted, now),
+        )
+        * sqlalchemy.cast(models.Version.size_stored, sqlalchemy.Numeric(65, 0))
+    )
+    usage = {
+        project_id: float(project_byte_microseconds or 0) / (60 * 60 * 1e6)
+        for project_id, project_byte_microseconds in db.session.query(
+            models.Version.project_id, byte_microseconds
+        )
+        .filter(not_invoiced)
+        .group_by(models.Version.project_id)
+    }
+
+    if invoice:
+        models.Version.query.filter(not_invoiced).update(
+            {
+                models.Version.time_invoiced: sqlalchemy.func.coalesce(
+                    models.Version.time_deleted, now
+                )
+            },
+            synchronize_session=False,
+        )
+
+    return usage
+
+
+def _byte_microseconds(start, end):
+    """Sum of the version sizes times the microseconds between start and end, in SQL."""
+    # Cast size to decimal to avoid overflowing the product
+    return sqlalchemy.func.sum(
+        sqlalchemy.func.timestampdiff(sqlalchemy.literal_column("MICROSECOND"), start, end)
+        * sqlalchemy.cast(models.Version.size_stored, sqlalchemy.Numeric(65, 0))
+    )
+
+
+def _byte_hours(byte_microseconds):
+    """Convert a byte microseconds sum from the database to byte hours."""
+    return float(byte_microseconds or 0) / (60 * 60 * 1e6)
+
+
+def _versions_totals(now, after_id, up_to_id):
+    """Get the bytes uploaded, bytes stored and byte hours until now of a range of version ids."""
+    from dds_web import db
+
+    stored = sqlalchemy.or_(
+        models.Version.time_deleted.is_(None), models.Version.time_deleted > now
+    )
+    new_bytes, new_bytes_stored, new_byte_microseconds = (
+        db.session.query(
+            sqlalchemy.func.sum(models.Version.size_stored),
+            sqlalchemy.func.sum(sqlalchemy.case((stored, models.Version.size_stored), else_=0)),
+            _byte_microseconds(
+                start=models.Version.time_uploaded,
+                end=sqlalchemy.case((stored, now), else_=models.Version.time_deleted),
+            ),
+        )
+        .filter(models.Version.id > after_id, models.Version.id <= up_to_id)
+        .one()
+    )
+    return int(new_bytes or 0), int(new_bytes_stored or 0), _byte_hours(new_byte_microseconds)
+
+
+def calculate_reporting_accumulators(now, previous=None, overlap_ids=10000):
+    """Calculate the running totals of the uploaded data from the previous totals.
+
+    The saved totals include the versions up to last_version_id, which stays overlap_ids below
+    the highest version id. The versions above it are read again on every calculation, so that
+    versions committed after versions with a higher id are not missed. Only those versions and
+    the versions deleted since the previous totals are read, all versions if there are no
+    previous totals. The byte hours of a version are counted from upload until deletion or now.
+
+    Returns a new ReportingAccumulators row, which is not added to the session, and the totals
+    of all versions: bytes uploaded, bytes stored and byte hours.
+    """
+    from dds_web import db
+
+    last_version_id = db.session.query(sqlalchemy.func.max(models.Version.id)).scalar() or 0
+
+    if previous:
+        previous_version_id = previous.last_version_id
+        hours_since_previous = (now - previous.time_calculated).total_seconds() / (60 * 60)
+        bytes_uploaded = previous.bytes_uploaded
+        bytes_stored = previous.bytes_stored
+        total_byte_hours = previous.byte_hours + previous.bytes_stored * hours_since_previous
+
+        # Versions deleted since the previous totals: counted until now above
+        deleted_bytes, deleted_byte_microseconds = (
+            db.session.query(
+                sqlalchemy.func.sum(models.Version.size_stored),
+                _byte_microseconds(start=models.Version.time_deleted, end=now),
+            )
+            .filter(
+                models.Version.id <= previous_version_id,
+                models.Version.time_deleted > previous.time_calculated,
+                models.Version.time_deleted <= now,
+            )
+            .one()
+        )
+        bytes_stored -= int(deleted_bytes or 0)
+        total_byte_hours -= _byte_hours(deleted_byte_microseconds)
+    else:
+        previous_version_id = 0
+        bytes_uploaded = 0
+        bytes_stored = 0
+        total_byte_hours = 0.0
+
+    # Versions which are now old enough to be included in the saved totals
+    settled_version_id = max(previous_version_id, last_version_id - overlap_ids)
+    settled_bytes, settled_bytes_stored, settled_byte_hours = _versions_totals(
+        now=now, after_id=previous_version_id, up_to_id=settled_version_id
+    )
+    accumulators = models.ReportingAccumulators(
+        time_calculated=now,
+        last_version_id=settled_version_id,
+        bytes_uploaded=bytes_uploaded + settled_bytes,
+        bytes_stored=bytes_stored + settled_bytes_stored,
+        byte_hours=total_byte_hours + settled_byte_hours,
+    )
+
+    # The newest versions, read again next time
+    recent_bytes, recent_bytes_stored, recent_byte_hours = _versions_totals(
+        now=now, after_id=settled_version_id, up_to_id=last_version_id
+    )
+    return accumulators, (
+        accumulators.bytes_uploaded + recent_bytes,
+        accumulators.bytes_stored + recent_bytes_stored,
+        accumulators.byte_hours + recent_byte_hours,
+    )
+
+
+def calculate_daily_storage(day, previous):
+    """Calculate the storage of the projects during a day from the storage the day before.
+
+    Only the versions uploaded or deleted during the day are read: the versions stored during the
+    whole day are included through previous, a dict with the project id as key and the bytes
+    stored at the end of the day before as value. A version is stored until it has been deleted.
+
+    Returns a dict with the project id as key and the bytes stored at the end of the day and the
+    byte hours during the day as value, for the projects with data stored during the day.
+    """
+    from dds_web import db
+
+    start = datetime.datetime.combine(day, datetime.time())
+    end = start + datetime.timedelta(days=1)
+    hours = (end - start).total_seconds() / (60 * 60)
+
+    # Data stored at the start of the day is stored during the whole day, unless deleted below
+    storage = {
+        project_id: [bytes_stored, bytes_stored * hours]
+        for project_id, bytes_stored in previous.items()
+        if bytes_stored
+    }
+
+    # Versions uploaded during the day
+    stored = sqlalchemy.or_(
+        models.Version.time_deleted.is_(None), models.Version.time_deleted > end
+    )
+    for project_id, bytes_stored, byte_microseconds in (
+        db.session.query(
+            models.Version.project_id,
+            sqlalchemy.func.sum(sqlalchemy.case((stored, models.Version.size_stored), else_=0)),
+            _byte_microseconds(
+                start=models.Version.time_uploaded,
+                end=sqlalchemy.case((stored, end), else_=models.Version.time_deleted),
+            ),
+        )
+        .filter(models.Version.time_uploaded >= start, models.Version.time_uploaded < end)
+        .group_by(models.Version.project_id)
+    ):
+        project_storage = storage.setdefault(project_id, [0, 0.0])
+        project_storage[0] += int(bytes_stored or 0)
+        project_storage[1] += _byte_hours(byte_microseconds)
+
+    # Versions uploaded before and deleted during the day: counted until the end of the day above
+    for project_id, bytes_deleted, byte_microseconds in (
+        db.session.query(
+            models.Version.project_id,
+            sqlalchemy.func.sum(models.Version.size_stored),
+            _byte_microseconds(start=models.Version.time_deleted, end=end),
+        )
+        .filter(
+            models.Version.time_deleted > start,
+            models.Version.time_deleted <= end,
+            models.Version.time_uploaded < start,
+        )
+        .group_by(models.Version.project_id)
+    ):
+        project_storage = storage.setdefault(project_id, [0, 0.0])
+        project_storage[0] -= int(bytes_deleted or 0)
+        project_storage[1] -= _byte_hours(byte_microseconds)
+
+    return {
+        project_id: (bytes_stored, byte_hours)
+        for project_id, (bytes_stored, byte_hours) in storage.items()
+        if bytes_stored or byte_hours
+    }
+
+
+def storage_usage(start, end, project_ids=None):
+    """Return the usage of the projects between two dates from the daily storage.
+
+    The byte hours of the days from start up to, but not including, end are summed per project.
+    Only the projects in project_ids are included if specified. The days must have been added by
+    the daily-storage command.
+
+    Returns a dict with the project id as key and the byte hours as value.
+    """
+    from dds_web import db
+
+    query = db.session.query(
+        models.DailyStorage.project_id, sqlalchemy.func.sum(models.DailyStorage.byte_hours)
+    ).filter(models.DailyStorage.date >= start, models.DailyStorage.date < end)
+    if project_ids is not None:
+        query = query.filter(models.DailyStorage.project_id.in_(project_ids))
+
+    return {
+        project_id: float(byte_hours)
+        for project_id, byte_hours in query.group_by(models.DailyStorage.project_id)
+    }
+
+
 def format_timestamp(
     timestamp_string: str = None, timestamp_object=None, timestamp_format: str = "%Y-%m-%d %H:%M:%S"
 ):
@@ -672,14 +1155,44 @@ def bytehours_in_last_month(version):
     return byte_hours
 
 
+def bytehours_in_last_month_all_versions(now=None):
+    """Calculate the byte hours stored in the last month for all versions, in the database.
+
+    Same as summing bytehours_in_last_month for all versions.
+    """
+    from dds_web import db
+
+    if now is None:
+        now = current_time()
+    now = format_timestamp(timestamp_object=now)
+    a_month_ago = now - relativedelta(months=1)
+
+    month_byte_microseconds = (
+        db.session.query(
+            sqlalchemy.func.sum(
+                sqlalchemy.func.timestampdiff(
+                    sqlalchemy.literal_column("MICROSECOND"),
+                    sqlalchemy.func.greatest(models.Version.time_uploaded, a_month_ago),
+                    sqlalchemy.func.coalesce(models.Version.time_deleted, now),
+                )
+                * sqlalchemy.cast(models.Version.size_stored, sqlalchemy.Numeric(65, 0))
+            )
+        )
+        .filter(
+            sqlalchemy.or_(
+                models.Version.time_deleted.is_(None), models.Version.time_deleted > a_month_ago
+            )
+        )
+        .scalar()
+    )
+    return float(month_byte_microseconds or 0) / (60 * 60 * 1e6)
+
+
 # maintenance check
 def block_if_maintenance(user=None):
     """Block API requests if maintenance is ongoing and projects are busy."""
-    # Get maintenance row
-    maintenance: models.Maintenance = models.Maintenance.query.first()
-
     # Possibly block request if maintenance ongoing / planned
-    if maintenance.active:
+    if global_settings()["maintenance_active"]:
         if not user:
             # Endpoints accepting requests during active maintenance - only login for non-logged in users
             admin_endpoints: typing.List = [
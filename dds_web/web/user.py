@@ -13,6 +13,7 @@ import flask
 import werkzeug
 import flask_login
 import itsdangerous
+import marshmallow
 import qrcode
 import qrcode.image.svg
 import sqlalchemy
@@ -33,6 +34,9 @@ from dds_web.security.project_user_keys import update_user_keys_for_password_cha
 
 auth_blueprint = flask.Blueprint("auth_blueprint", __name__)
 
+# Number of projects shown per page on the projects page
+PROJECTS_PER_PAGE = 100
+
 ####################################################################################################
 # ERROR HANDLING ################################################################## ERROR HANDLING #
 ####################################################################################################
@@ -717,7 +721,29 @@ def account_info():
 @logging_bind_request
 def projects_info():
     """User projects page"""
+    # Current filter and sort options, kept when going to another page
+    listing_args = {
+        key: value for key, value in flask.request.args.items() if key != "after" and value
+    }
+
     projects_obj = UserProjects()
-    projects = projects_obj.format_project_dict(flask_login.current_user)
+    try:
+        projects = projects_obj.format_project_dict(
+            flask_login.current_user, default_limit=PROJECTS_PER_PAGE
+        )
+    except marshmallow.ValidationError:
+        flask.flash("Invalid project filter, showing all projects.", "warning")
+        return flask.redirect(flask.url_for("auth_blueprint.projects_info"))
+    except ddserr.DDSArgumentError:
+        # E.g. the project to continue after was deleted or no longer matches the filter
+        flask.flash("The page is no longer available, showing the first page.", "warning")
+        if "after" not in flask.request.args:
+            return flask.redirect(flask.url_for("auth_blueprint.projects_info"))
+        return flask.redirect(flask.url_for("auth_blueprint.projects_info", **listing_args))
 
-    return flask.render_template("user/projects.html", projects=projects, enumerate=enumerate)
+    return flask.render_template(
+        "user/projects.html",
+        projects=projects,
+        listing_args=listing_args,
+        enumerate=enumerate,
+    )
@@ -150,6 +150,7 @@ class DDSEndpoint:
     CANCEL_2FA = "/cancel_2fa"
     CONFIRM_2FA = "/confirm_2fa"
     CHANGE_PASSWORD = "/change_password"
+    PROJECTS_WEB = "/projects"
 
     # User creation
     USER_ADD = BASE_ENDPOINT + "/user/add"
@@ -200,6 +201,7 @@ class DDSEndpoint:
     # Project specific urls
     PROJECT_CREATE = BASE_ENDPOINT + "/proj/create"
     PROJECT_STATUS = BASE_ENDPOINT + "/proj/status"
+    PROJECT_STATUS_BATCH = BASE_ENDPOINT + "/proj/status/batch"
     PROJECT_ACCESS = BASE_ENDPOINT + "/proj/access"
     PROJECT_BUSY = BASE_ENDPOINT + "/proj/busy"
     PROJECT_BUSY_ANY = BASE_ENDPOINT + "/proj/busy/any"
@@ -7,6 +7,7 @@ import pytest
 from _pytest.logging import LogCaptureFixture
 import logging
 import datetime
+import random
 import time
 import unittest.mock
 from unittest.mock import MagicMock
@@ -14,7 +15,6 @@ from unittest.mock import patch
 
 # Installed
 import boto3
-import flask_mail
 import werkzeug
 import sqlalchemy
 
@@ -800,7 +800,7 @@ def test_projectstatus_set_project_to_available_no_mail(module_client, boto3_ses
 
     public_project_id = response.json.get("project_id")
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         with unittest.mock.patch.object(
             dds_web.api.user.AddUser, "compose_and_send_email_to_user"
         ) as mock_mail_func:
@@ -1811,6 +1811,51 @@ def test_project_usage(module_client):
     assert (proj_bhours / 1e9) * cost_gbhour == proj_cost
 
 
+@pytest.mark.parametrize("seed", range(5))
+def test_projects_usage_matches_python_calculation(client, seed):
+    """The usage calculated in the database should match the per version calculation."""
+    rng = random.Random(seed)
+    now = dds_web.utils.current_time()
+
+    # Add random versions to the projects - stored timestamps have whole seconds
+    projects = models.Project.query.all()
+    for project in projects:
+        for _ in range(rng.randint(0, 20)):
+            time_uploaded = (
+                now - datetime.timedelta(seconds=rng.randint(0, 2 * 365 * 24 * 3600))
+            ).replace(microsecond=0)
+            time_deleted = None
+            if rng.random() < 0.5:
+                time_deleted = (
+                    time_uploaded + datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+                ).replace(microsecond=0)
+                time_deleted = min(time_deleted, now.replace(microsecond=0))
+            project.file_versions.append(
+                models.Version(
+                    size_stored=rng.randint(0, 5 * 10**12),
+                    time_uploaded=time_uploaded,
+                    time_deleted=time_deleted,
+                )
+            )
+    db.session.commit()
+
+    usage = UserProjects.projects_usage(project_ids=[p.id for p in projects], now=now)
+
+    cost_gbhour = 0.09 / (30 * 24)
+    for project in projects:
+        expected_bhours = sum(
+            dds_web.utils.calculate_bytehours(
+                minuend=version.time_deleted or now,
+                subtrahend=version.time_uploaded,
+                size_bytes=version.size_stored,
+            )
+            for version in project.file_versions
+        )
+        bhours, cost = usage.get(project.id, (0.0, 0.0))
+        assert bhours == pytest.approx(expected_bhours, rel=1e-9)
+        assert cost == pytest.approx((expected_bhours / 1e9) * cost_gbhour, rel=1e-9)
+
+
 def test_email_project_release(module_client, boto3_session):
     """Test that check that the email sent to the researchers when project is released is correct"""
     public_project_id = "public_project_id"
@@ -1826,6 +1871,9 @@ def test_email_project_release(module_client, boto3_session):
     # num of researchers that will receive email
     num_users = models.ProjectUsers.query.filter_by(project_id=project.id).count()
 
+    # Send the emails already in the outbox
+    dds_web.utils.send_outbox_emails()
+
     # Release project and check email
     with mail.record_messages() as outbox:
         response = module_client.post(
@@ -1834,6 +1882,9 @@ def test_email_project_release(module_client, boto3_session):
             query_string={"project": public_project_id},
             json={"new_status": "Available", "deadline": 10, "send_email": True},
         )
+        # The emails are added to the outbox and sent by the dispatcher
+        assert len(outbox) == 0
+        dds_web.utils.send_outbox_emails()
         assert len(outbox) == num_users  # nº of Emails informing researchers
         assert "Project made available by" in outbox[-1].subject
 
@@ -1865,3 +1916,118 @@ def test_email_project_release(module_client, boto3_session):
         )
 
     assert response.status_code == http.HTTPStatus.OK
+
+
+# Batch status change
+
+
+def test_projectstatusbatch_release_and_retry(client, boto3_session):
+    """Release several projects at once and retry the same request."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    project_ids = ["public_project_id", "second_public_project_id", "non_existent", "unit2testing"]
+    num_users = models.ProjectUsers.query.filter(
+        models.ProjectUsers.project.has(
+            models.Project.public_id.in_(["public_project_id", "second_public_project_id"])
+        )
+    ).count()
+    assert num_users
+    num_emails = models.OutboxEmail.query.count()
+
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS_BATCH,
+        headers=token,
+        json={"projects": project_ids, "new_status": "Available", "deadline": 10},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert "2 of 4 projects updated to status Available" in response.json["message"]
+    results = {result["project"]: result for result in response.json["projects"]}
+    assert [result["project"] for result in response.json["projects"]] == project_ids
+    assert results["public_project_id"]["result"] == "updated"
+    assert results["second_public_project_id"]["result"] == "updated"
+    assert results["non_existent"]["result"] == "failed"
+    assert results["unit2testing"]["result"] == "failed"
+    assert results["unit2testing"]["message"] == "Project access denied."
+    assert models.OutboxEmail.query.count() == num_emails + num_users
+
+    for project_id in ["public_project_id", "second_public_project_id"]:
+        project = project_row(project_id=project_id)
+        assert project.current_status == "Available"
+        assert project.has_been_available
+        assert not project.busy
+        assert len(project.project_statuses) == 2
+    assert project_row(project_id="unit2testing").current_status == "In Progress"
+
+    # Retrying does not change the projects again or send more emails
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS_BATCH,
+        headers=token,
+        json={"projects": project_ids[:2], "new_status": "Available", "deadline": 10},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert all(result["result"] == "unchanged" for result in response.json["projects"])
+    assert len(project_row(project_id="public_project_id").project_statuses) == 2
+    assert models.OutboxEmail.query.count() == num_emails + num_users
+
+
+def test_projectstatusbatch_busy_and_invalid_transitions(client, boto3_session):
+    """Busy projects and invalid transitions are reported and the other projects are changed."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    project_row(project_id="second_public_project_id").busy = True
+    db.session.commit()
+
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS_BATCH,
+        headers=token,
+        json={
+            "projects": ["public_project_id", "second_public_project_id", "unused_project_id"],
+            "new_status": "Available",
+            "send_email": False,
+        },
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    results = {result["project"]: result for result in response.json["projects"]}
+    assert results["public_project_id"]["result"] == "updated"
+    assert results["second_public_project_id"]["result"] == "failed"
+    assert "in the process of being changed" in results["second_public_project_id"]["message"]
+    assert results["unused_project_id"]["result"] == "updated"
+    assert project_row(project_id="second_public_project_id").busy
+    assert project_row(project_id="second_public_project_id").current_status == "In Progress"
+
+    # Expire: one project is still In Progress
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS_BATCH,
+        headers=token,
+        json={"projects": ["public_project_id", "restricted_project_id"], "new_status": "Expired"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    results = {result["project"]: result for result in response.json["projects"]}
+    assert results["public_project_id"]["result"] == "updated"
+    assert results["restricted_project_id"]["result"] == "failed"
+    assert "You cannot expire a project" in results["restricted_project_id"]["message"]
+    assert project_row(project_id="public_project_id").times_expired == 1
+    assert not project_row(project_id="restricted_project_id").busy
+
+
+@pytest.mark.parametrize(
+    "json_data,error",
+    [
+        ({"projects": ["public_project_id"]}, "No status transition provided"),
+        (
+            {"projects": ["public_project_id"], "new_status": "Deleted"},
+            "cannot be changed to 'Deleted' for several projects",
+        ),
+        ({"projects": "public_project_id", "new_status": "Available"}, "list of project IDs"),
+        ({"projects": [], "new_status": "Available"}, "list of project IDs"),
+        (
+            {"projects": ["public_project_id"], "new_status": "Available", "deadline": "10"},
+            "should be of type Int",
+        ),
+    ],
+)
+def test_projectstatusbatch_invalid_request(client, json_data, error):
+    """Invalid requests do not change any project."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.post(tests.DDSEndpoint.PROJECT_STATUS_BATCH, headers=token, json=json_data)
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert error in response.json["message"]
+    assert project_row(project_id="public_project_id").current_status == "In Progress"
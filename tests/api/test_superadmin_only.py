@@ -949,6 +949,12 @@ def test_statistics_return_none(client: flask.testing.FlaskClient) -> None:
     returned: typing.Dict = response.json.get("stats")
     assert returned == []
 
+    # The key pair pool is empty
+    assert response.json.get("key_pairs") == {
+        "available": 0,
+        "pool_size": client.application.config["KEY_PAIR_POOL_SIZE"],
+    }
+
 
 def test_statistics_return_rows(client: flask.testing.FlaskClient, cli_runner) -> None:
     """Verify list returned when there are rows in reporting table."""
@@ -3,7 +3,6 @@ from datetime import timedelta
 import typing
 from unittest import mock
 import dds_web
-import flask_mail
 import http
 import json
 import sqlalchemy
@@ -151,7 +150,7 @@ def test_add_user_with_unitadmin_and_invalid_role(client):
 
 def test_add_user_with_unitadmin_and_invalid_email(client):
     """An invalid email should not be accepted."""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client),
@@ -169,7 +168,7 @@ def test_add_user_with_unitadmin_and_invalid_email(client):
 
 def test_add_user_with_unitadmin(client):
     """Add researcher as unit admin."""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
@@ -192,7 +191,7 @@ def test_add_user_with_unitadmin(client):
     assert invited_user.project_invite_keys == []
 
     # Repeating the invite should not send a new invite:
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
             headers=token,
@@ -207,7 +206,7 @@ def test_add_user_with_unitadmin(client):
 
 def test_add_unit_user_with_unitadmin(client):
     """Add unit user as unit admin."""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
@@ -243,7 +242,7 @@ def test_add_unit_user_with_unitadmin(client):
     assert len(project_invite_keys) == len(invited_user.unit.projects)
     assert len(project_invite_keys) == 5
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
             headers=token,
@@ -259,7 +258,7 @@ def test_add_unit_user_with_unitadmin(client):
 
 def test_add_user_with_superadmin(client):
     """Adding users as super admin should work."""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         token = tests.UserAuth(tests.USER_CREDENTIALS["superadmin"]).token(client)
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
@@ -276,7 +275,7 @@ def test_add_user_with_superadmin(client):
     assert invited_user.email == first_new_user["email"]
     assert invited_user.role == first_new_user["role"]
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.post(
             tests.DDSEndpoint.USER_ADD,
             headers=token,
@@ -576,7 +575,7 @@ def test_add_existing_user_to_existing_project_no_mail_flag(client):
 
     # Test mail sending is suppressed
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         with unittest.mock.patch.object(
             dds_web.api.user.AddUser, "compose_and_send_email_to_user"
         ) as mock_mail_func:
@@ -1,7 +1,18 @@
-import tests
+import datetime
 import http
+from unittest.mock import patch
+
+import flask
+import pytest
+
+import tests
+import dds_web.security.auth
+import dds_web.utils
 from dds_web.database import models
-from dds_web import db
+from dds_web import auth, db
+from dds_web.errors import AccessDeniedError, AuthenticationError
+from dds_web.security.auth import UserIdentity, verify_token, verified_token_cache
+from dds_web.security.tokens import encrypted_jwt_token
 
 
 # verify_token
@@ -36,3 +47,155 @@ def test_verify_token_user_not_exists_after_deletion(client):
     response_json = response.json
     message = response_json.get("message")
     assert message == "Invalid token. Try reauthenticating."
+
+
+def fully_authenticated_token(username, expires_in=datetime.timedelta(hours=168)):
+    """Create an encrypted token after two-factor authentication."""
+    return encrypted_jwt_token(
+        username=username,
+        sensitive_content=None,
+        expires_in=expires_in,
+        additional_claims={"mfa_auth_time": dds_web.utils.current_time().timestamp()},
+        fully_authenticated=True,
+    )
+
+
+def test_verify_token_cached(client):
+    """A verified token is not decrypted and verified again."""
+    token = fully_authenticated_token(username="unituser")
+
+    with patch(
+        "dds_web.security.auth.decrypt_and_verify_token_signature",
+        wraps=dds_web.security.auth.decrypt_and_verify_token_signature,
+    ) as mock_decrypt:
+        assert verify_token(token).username == "unituser"
+        assert verify_token(token).username == "unituser"
+        assert mock_decrypt.call_count == 1
+
+        # Other tokens are verified
+        assert verify_token(fully_authenticated_token(username="unituser"))
+        assert mock_decrypt.call_count == 2
+
+
+def test_verify_token_cached_without_sensitive_content(client):
+    """The sensitive content of the token is not kept in the verified token cache."""
+    token = encrypted_jwt_token(
+        username="unituser",
+        sensitive_content="abcd",
+        additional_claims={"mfa_auth_time": dds_web.utils.current_time().timestamp()},
+        fully_authenticated=True,
+    )
+    assert verify_token(token)
+
+    cache, _ = verified_token_cache()
+    cached = [claims for claims in cache.values() if claims.get("sub") == "unituser"]
+    assert cached
+    assert all(set(claims) <= set(dds_web.security.auth.CACHED_TOKEN_CLAIMS) for claims in cached)
+
+    # Still available from the token itself
+    assert (
+        dds_web.security.auth.extract_encrypted_token_sensitive_content(
+            token=token, username="unituser"
+        )
+        == "abcd"
+    )
+
+
+def test_verify_token_cached_expiry(client):
+    """Cached tokens still expire."""
+    token = fully_authenticated_token(
+        username="unituser", expires_in=datetime.timedelta(minutes=10)
+    )
+    assert verify_token(token)
+
+    cache, _ = verified_token_cache()
+    exp = next(claims["exp"] for claims in cache.values() if claims.get("sub") == "unituser")
+
+    # Checked against the expiration time also when cached
+    with patch(
+        "dds_web.utils.current_time",
+        return_value=datetime.datetime.fromtimestamp(exp) + datetime.timedelta(seconds=1),
+    ):
+        with pytest.raises(AuthenticationError) as error:
+            verify_token(token)
+    assert "Expired token" in str(error.value)
+
+    # Removed from the cache when expired
+    num_cached = len(cache)
+    cache.expire(time=exp + 1)
+    assert len(cache) < num_cached
+
+
+def test_verify_token_cached_password_reset(client):
+    """Cached tokens are invalid after a password reset."""
+    token = fully_authenticated_token(username="unituser")
+    assert verify_token(token)
+
+    user = models.User.query.get("unituser")
+    db.session.add(
+        models.PasswordReset(
+            user=user,
+            email=user.primary_email,
+            issued=dds_web.utils.current_time(),
+            changed=dds_web.utils.current_time() + datetime.timedelta(seconds=1),
+            valid=False,
+        )
+    )
+    db.session.commit()
+
+    with pytest.raises(AuthenticationError) as error:
+        verify_token(token)
+    assert "Password reset performed after last authentication." in str(error.value)
+
+
+def test_verify_token_cached_identity(client):
+    """The user identity is cached between requests and the user row is loaded when needed."""
+    token = fully_authenticated_token(username="unituser")
+    identity = verify_token(token)
+    assert isinstance(identity, UserIdentity)
+    assert identity.role == "Unit Personnel"
+    assert verify_token(token) is identity
+
+    # The user row is loaded by current_user
+    flask.g.flask_httpauth_user = identity
+    user = auth.current_user()
+    assert isinstance(user, models.UnitUser)
+    assert user.username == "unituser"
+    assert flask.g.flask_httpauth_user is user
+    assert auth.current_user() is user
+
+    # Changing the user removes the cached identity
+    user.totp_enabled = not user.totp_enabled
+    db.session.commit()
+    assert verify_token(token) is not identity
+
+
+def test_cached_identity_removed_after_commit(client):
+    """An identity cached between the flush and the commit of a user change is removed."""
+    token = fully_authenticated_token(username="unituser")
+    identity = verify_token(token)
+
+    user = models.User.query.get("unituser")
+    user.totp_enabled = not user.totp_enabled
+    db.session.flush()
+
+    # Another request caches the identity from the row committed before the change
+    cache, _ = dds_web.security.auth.user_identity_cache()
+    cache["unituser"] = identity
+
+    db.session.commit()
+    assert "unituser" not in cache
+    assert verify_token(token) is not identity
+
+
+def test_verify_token_cached_identity_deactivated(client):
+    """A deactivated user cannot use a token with a cached identity."""
+    token = fully_authenticated_token(username="unituser")
+    assert verify_token(token)
+
+    models.User.query.get("unituser").active = False
+    db.session.commit()
+
+    with pytest.raises(AccessDeniedError) as error:
+        verify_token(token)
+    assert "Your account has been deactivated." in str(error.value)
@@ -8,7 +8,6 @@ import unittest
 
 # Installed
 import flask
-import flask_mail
 import pytest
 
 # Own
@@ -86,7 +85,7 @@ def test_auth_incorrect_username_check_statuscode_401_incorrect_info(client):
 def test_auth_correct_credentials(client):
     """Test that the token endpoint called correctly returns a token and sends an email."""
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.get(
             tests.DDSEndpoint.ENCRYPTED_TOKEN,
             auth=("researchuser", "password"),
@@ -96,7 +95,7 @@ def test_auth_correct_credentials(client):
     assert response.status_code == http.HTTPStatus.OK
 
     # Shouldn't send an email shortly after the first
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.get(
             tests.DDSEndpoint.ENCRYPTED_TOKEN,
             auth=("researchuser", "password"),
@@ -13,11 +13,13 @@ import logging
 from datetime import datetime, timedelta
 import pathlib
 import csv
+import gzip
 from dateutil.relativedelta import relativedelta
 import json
 
 # Installed
 import click
+from cryptography.hazmat.primitives import serialization
 from pyfakefs.fake_filesystem import FakeFilesystem
 import flask_mail
 import freezegun
@@ -32,6 +34,7 @@ from dds_web.commands import (
     monitor_usage,
     set_available_to_expired,
     set_expired_to_archived,
+    send_emails,
     delete_invites,
     monthly_usage,
     collect_stats,
@@ -39,10 +42,19 @@ from dds_web.commands import (
     update_unit_sto4,
     update_unit_quota,
     send_usage,
+    project_statistics,
+    daily_storage,
+    fill_key_pairs,
 )
 from dds_web.database import models
 from dds_web import db, mail
-from dds_web.utils import current_time
+from dds_web.utils import (
+    current_time,
+    queue_email,
+    calculate_bytehours,
+    calculate_reporting_accumulators,
+    storage_usage,
+)
 
 # Tools
 
@@ -1370,12 +1382,103 @@ def test_delete_lost_files_sqlalchemyerror(
     assert f"Files deleted from DB: 0" not in err
 
 
+# daily_storage
+
+
+def test_daily_storage(client, cli_runner, capfd: LogCaptureFixture):
+    """The daily storage should add the days up to yesterday and match the version byte hours."""
+    now = current_time().replace(microsecond=0)
+    today = now.date()
+    midnight = datetime.combine(today, datetime.min.time())
+    first_day = (now - timedelta(days=5, hours=3)).date()
+
+    # Versions uploaded and deleted at different times the last days
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    for uploaded, deleted, size in [
+        (now - timedelta(days=5, hours=3), None, 1000),
+        (now - timedelta(days=5, hours=1), now - timedelta(days=2, hours=7), 2000),
+        (now - timedelta(days=3, hours=5), now - timedelta(days=3, hours=2), 3000),
+        (now - timedelta(days=2, hours=4), midnight + timedelta(hours=1), 4000),
+        (midnight - timedelta(days=1), midnight, 5000),
+    ]:
+        project.file_versions.append(
+            models.Version(size_stored=size, time_uploaded=uploaded, time_deleted=deleted)
+        )
+    db.session.commit()
+
+    def expected_usage(end):
+        """Byte hours of all versions until end, per project."""
+        usage = {}
+        for version in models.Version.query:
+            version_end = min(version.time_deleted or end, end)
+            if version.time_uploaded < version_end:
+                usage[version.project_id] = usage.get(version.project_id, 0) + calculate_bytehours(
+                    minuend=version_end,
+                    subtrahend=version.time_uploaded,
+                    size_bytes=version.size_stored,
+                )
+        return usage
+
+    def check_usage(end):
+        usage = storage_usage(start=first_day, end=end.date())
+        expected = expected_usage(end=end)
+        assert usage.keys() == expected.keys()
+        for project_id, byte_hours in expected.items():
+            assert usage[project_id] == pytest.approx(byte_hours, rel=1e-9)
+
+    cli_runner.invoke(daily_storage)
+    _, logs = capfd.readouterr()
+    assert f"Daily storage added for {(today - first_day).days} day(s)." in logs
+    assert db.session.query(sqlalchemy.func.max(models.DailyStorage.date)).scalar() == (
+        today - timedelta(days=1)
+    )
+    check_usage(end=midnight)
+    last_day = models.DailyStorage.query.filter_by(
+        project_id=project.id, date=today - timedelta(days=1)
+    ).one()
+    assert last_day.bytes_stored == 1000 + 4000
+
+    # Nothing more to add today
+    cli_runner.invoke(daily_storage)
+    _, logs = capfd.readouterr()
+    assert "Daily storage added for 0 day(s)." in logs
+
+    # Continue from the last day
+    with patch("dds_web.utils.current_time", return_value=now + timedelta(days=2)):
+        cli_runner.invoke(daily_storage)
+    _, logs = capfd.readouterr()
+    assert "Daily storage added for 2 day(s)." in logs
+    check_usage(end=midnight + timedelta(days=2))
+
+
+def test_fill_key_pairs(client, cli_runner, capfd: LogCaptureFixture):
+    """The pool should be filled up to the size, with the private keys encrypted."""
+    assert not models.KeyPair.query.count()
+
+    result: click.testing.Result = cli_runner.invoke(fill_key_pairs, ["--size", "2"])
+    assert not result.exception
+    _, logs = capfd.readouterr()
+    assert "Key pairs added to the pool: 2, pool level: 2/2" in logs
+    key_pairs = models.KeyPair.query.all()
+    assert len(key_pairs) == 2
+    for key_pair in key_pairs:
+        assert key_pair.public_key and key_pair.nonce
+        with pytest.raises(ValueError):
+            serialization.load_der_private_key(key_pair.private_key, password=None)
+
+    # Already full
+    cli_runner.invoke(fill_key_pairs, ["--size", "2"])
+    _, logs = capfd.readouterr()
+    assert "Key pairs added to the pool" not in logs
+    assert models.KeyPair.query.count() == 2
+
+
 # usage = 0 --> check log
 def test_monitor_usage_no_usage(client, cli_runner, capfd: LogCaptureFixture):
     """If a unit has no uploaded data, there's no need to do the calculations or send email warning."""
-    # Mock the size property of the Unit table
-    with patch("dds_web.database.models.Unit.size", new_callable=PropertyMock) as mock_size:
-        mock_size.return_value = 0  # Test size = 0
+    # Mock the usage of the units
+    with patch("dds_web.utils.units_usage") as mock_usage:
+        mock_usage.return_value = {unit.id: 0 for unit in models.Unit.query}  # Test size = 0
         # Mock emails - only check if function call
         with patch.object(flask_mail.Mail, "send") as mock_mail_send:
             # Run command
@@ -1399,9 +1502,9 @@ def test_monitor_usage_no_email(client, cli_runner, capfd: LogCaptureFixture):
         unit.warning_level = 0.8
     db.session.commit()
 
-    # Mock the size property of the Unit table
-    with patch("dds_web.database.models.Unit.size", new_callable=PropertyMock) as mock_size:
-        mock_size.return_value = 0.7 * quota_in_test
+    # Mock the usage of the units
+    with patch("dds_web.utils.units_usage") as mock_usage:
+        mock_usage.return_value = {unit.id: 0.7 * quota_in_test for unit in models.Unit.query}
         # Mock emails - only check if function call
         with patch.object(flask_mail.Mail, "send") as mock_mail_send:
             # Run command
@@ -1429,9 +1532,9 @@ def test_monitor_usage_warning_sent(client, cli_runner, capfd: LogCaptureFixture
         unit.warning_level = 0.8
     db.session.commit()
 
-    # Mock the size property of the Unit table
-    with patch("dds_web.database.models.Unit.size", new_callable=PropertyMock) as mock_size:
-        mock_size.return_value = 0.9 * quota_in_test
+    # Mock the usage of the units
+    with patch("dds_web.utils.units_usage") as mock_usage:
+        mock_usage.return_value = {unit.id: 0.9 * quota_in_test for unit in models.Unit.query}
 
         with mail.record_messages() as outbox:
             # Run command
@@ -1488,6 +1591,31 @@ def test_set_available_to_expired(client, cli_runner):
     assert j == 6
 
 
+def test_set_available_to_expired_only_due_projects(client, cli_runner):
+    """Only available projects whose deadline has passed are expired, in batches."""
+    projects = models.Project.query.filter(
+        models.Project.public_id.in_(["public_project_id", "second_public_project_id"])
+    ).all()
+    due, not_due = sorted(projects, key=lambda p: p.public_id != "public_project_id")
+    for project, deadline in (
+        (due, current_time() - timedelta(weeks=1)),
+        (not_due, current_time() + timedelta(weeks=1)),
+    ):
+        for status in project.project_statuses:
+            status.deadline = deadline
+            status.status = "Available"
+    db.session.commit()
+
+    cli_runner.invoke(set_available_to_expired, ["--batch-size", "1"])
+
+    due = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    not_due = models.Project.query.filter_by(public_id="second_public_project_id").one_or_none()
+    assert due.current_status == "Expired"
+    assert due.times_expired == 1
+    assert not_due.current_status == "Available"
+    assert not_due.times_expired == 0
+
+
 # set_expired_to_archived
 
 
@@ -1520,6 +1648,36 @@ def test_set_expired_to_archived(_: MagicMock, client, cli_runner):
     assert j == 6
 
 
+@mock.patch("boto3.session.Session")
+def test_set_expired_to_archived_workers(
+    _: MagicMock, client, cli_runner, capfd: LogCaptureFixture
+):
+    """Projects are archived concurrently with --workers and a summary is logged."""
+    units: List = db.session.query(models.Unit).all()
+    for unit in units:
+        for project in unit.projects:
+            for status in project.project_statuses:
+                status.deadline = current_time() - timedelta(weeks=1)
+                status.status = "Expired"
+    db.session.commit()
+
+    cli_runner.invoke(set_expired_to_archived, ["--workers", "3"])
+
+    _, err = capfd.readouterr()
+    assert "Archival summary: archived: 6, failed: 0, no longer due: 0" in err
+
+    db.session.expire_all()
+    units: List = db.session.query(models.Unit).all()
+    archived = [
+        project
+        for unit in units
+        for project in unit.projects
+        if project.current_status == "Archived"
+    ]
+    assert len(archived) == 6
+    assert not any(project.is_active for project in archived)
+
+
 @mock.patch("boto3.session.Session")
 def test_set_expired_to_archived_db_failed(
     _: MagicMock, client, cli_runner, capfd: LogCaptureFixture
@@ -1887,6 +2045,119 @@ def test_collect_stats(client, cli_runner, fs: FakeFilesystem):
         verify_reporting_row(row=row, time_date=first_time if row.id == 1 else second_time)
 
 
+@pytest.mark.parametrize("overlap", [0, 2, 10000])
+def test_collect_stats_accumulators(client, cli_runner, overlap):
+    """The running totals are updated from the previous totals and match a full calculation."""
+    client.application.config["REPORTING_VERSION_OVERLAP"] = overlap
+
+    def expected_totals(now):
+        """Calculate the totals from all versions."""
+        versions = models.Version.query.all()
+        stored = [v for v in versions if v.time_deleted is None or v.time_deleted > now]
+        byte_hours = sum(
+            ((v.time_deleted if v not in stored else now) - v.time_uploaded).total_seconds()
+            / (60 * 60)
+            * v.size_stored
+            for v in versions
+        )
+        return (
+            sum(v.size_stored for v in versions),
+            sum(v.size_stored for v in stored),
+            byte_hours,
+        )
+
+    def run_and_verify(now):
+        with freezegun.freeze_time(now):
+            result: click.testing.Result = cli_runner.invoke(collect_stats)
+            assert not result.exception, "Raised an unwanted exception."
+        row = models.Reporting.query.order_by(models.Reporting.id.desc()).first()
+        accumulators = row.accumulators
+        assert accumulators.time_calculated == now
+        last_version_id = db.session.query(sqlalchemy.func.max(models.Version.id)).scalar()
+        assert last_version_id - overlap <= accumulators.last_version_id <= last_version_id
+        bytes_uploaded, bytes_stored, byte_hours = expected_totals(now=now)
+        if not overlap:
+            assert accumulators.bytes_uploaded == bytes_uploaded
+            assert accumulators.bytes_stored == bytes_stored
+            assert accumulators.byte_hours == pytest.approx(byte_hours, rel=1e-9)
+        assert row.tb_uploaded_since_start == round(bytes_uploaded / 1e12, 2)
+        assert row.tbhours_since_start == round(byte_hours / 1e12, 2)
+
+    first_time = datetime(year=2023, month=3, day=1, hour=0, minute=1)
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+
+    # Existing versions: stored and deleted before the first reporting
+    for i, version in enumerate(models.Version.query.all()):
+        version.size_stored = 10**12 * (i + 1)
+        version.time_uploaded = first_time - timedelta(days=30 + i)
+        version.time_deleted = first_time - timedelta(days=i) if i % 2 else None
+    db.session.commit()
+    run_and_verify(now=first_time)
+
+    # New versions, some deleted before the next reporting, and deleted existing versions
+    second_time = datetime(year=2023, month=4, day=1, hour=0, minute=1)
+    for i in range(3):
+        project.file_versions.append(
+            models.Version(
+                size_stored=10**11 * (i + 1),
+                time_uploaded=first_time + timedelta(days=i + 1),
+                time_deleted=first_time + timedelta(days=10) if i == 1 else None,
+            )
+        )
+    for version in models.Version.query.filter(models.Version.time_deleted.is_(None)).limit(2):
+        version.time_deleted = first_time + timedelta(days=5)
+    db.session.commit()
+    run_and_verify(now=second_time)
+
+    # Nothing changed
+    third_time = datetime(year=2023, month=5, day=1, hour=0, minute=1)
+    run_and_verify(now=third_time)
+
+    # Delete everything
+    for version in models.Version.query.filter(models.Version.time_deleted.is_(None)):
+        version.time_deleted = third_time + timedelta(hours=12)
+    db.session.commit()
+    run_and_verify(now=datetime(year=2023, month=6, day=1, hour=0, minute=1))
+
+
+def test_reporting_accumulators_late_commit(client):
+    """Versions committed after versions with higher ids are counted within the overlap."""
+    now = datetime(year=2023, month=3, day=1, hour=0, minute=1)
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    for version in models.Version.query:
+        version.size_stored = 0
+    versions = [
+        models.Version(size_stored=1000, time_uploaded=now - timedelta(days=2)) for _ in range(3)
+    ]
+    project.file_versions.extend(versions)
+    db.session.commit()
+
+    # The middle version is not committed yet when the totals are calculated
+    late_version_id = versions[1].id
+    db.session.delete(versions[1])
+    db.session.commit()
+    for overlap, expected_bytes in [(0, 2000), (10, 3000)]:
+        previous, totals = calculate_reporting_accumulators(now=now, overlap_ids=overlap)
+        assert totals[0] == 2000
+
+        db.session.execute(
+            models.Version.__table__.insert(),
+            {
+                "id": late_version_id,
+                "project_id": project.id,
+                "size_stored": 1000,
+                "time_uploaded": now - timedelta(days=1),
+            },
+        )
+        _, (bytes_uploaded, bytes_stored, byte_hours) = calculate_reporting_accumulators(
+            now=now + timedelta(days=1), previous=previous, overlap_ids=overlap
+        )
+        assert bytes_uploaded == bytes_stored == expected_bytes
+        db.session.execute(
+            models.Version.__table__.delete().where(models.Version.id == late_version_id)
+        )
+
+
 def test_send_usage(client, cli_runner, capfd: LogCaptureFixture):
     """Test that the email with the usage report is send"""
     # Imports
@@ -1937,8 +2208,6 @@ def test_send_usage(client, cli_runner, capfd: LogCaptureFixture):
         Return the csv files attached to the email.
         """
 
-        csv_file_location = "/tmp/"
-
         with mail.record_messages() as outbox:
             with patch("dds_web.utils.current_time") as current_time_func:  # Mock current time
                 current_time_func.return_value = start_time
@@ -1957,16 +2226,12 @@ def test_send_usage(client, cli_runner, capfd: LogCaptureFixture):
             end_month = end_time.month
             unit_1_id = project_1_unit_1.responsible_unit.public_id
             unit_2_id = project_1_unit_2.responsible_unit.public_id
-            csv_1_name = (
-                f"{csv_file_location}{unit_1_id}_Usage_Months-{end_month}-to-{start_month}.csv"
-            )
-            csv_2_name = (
-                f"{csv_file_location}{unit_2_id}_Usage_Months-{end_month}-to-{start_month}.csv"
-            )
+            csv_1_name = f"{unit_1_id}_Usage_Months-{end_month}-to-{start_month}.csv"
+            csv_2_name = f"{unit_2_id}_Usage_Months-{end_month}-to-{start_month}.csv"
 
-            # check that the files no longer exist in the filesystem
-            assert not os.path.exists(csv_1_name)
-            assert not os.path.exists(csv_2_name)
+            # check that no temporary files are written
+            assert not os.path.exists(f"/tmp/{csv_1_name}")
+            assert not os.path.exists(f"/tmp/{csv_2_name}")
 
             _, logs = capfd.readouterr()
             assert f"Month now: {start_month}" in logs
@@ -2067,6 +2332,55 @@ def test_send_usage(client, cli_runner, capfd: LogCaptureFixture):
     assert "2022-09-01 00:00:00" in csv_2
 
 
+def test_send_usage_compress_and_output_dir(client, cli_runner, tmp_path, capfd):
+    """The CSV files can be gzip compressed and written to a directory instead of emailed."""
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+    for i in range(24):
+        project.monthly_usage.append(
+            models.Usage(usage=100, time_collected=datetime(2021, 1, 1) + relativedelta(months=i))
+        )
+    db.session.commit()
+    unit_ids = [unit.public_id for unit in models.Unit.query.order_by(models.Unit.id)]
+
+    # Compressed attachments
+    with mail.record_messages() as outbox:
+        with patch("dds_web.utils.current_time", return_value=datetime(2022, 12, 15)):
+            result = cli_runner.invoke(send_usage, ["--months", 3, "--compress"])
+            assert not result.exception
+    assert len(outbox) == 1
+    attachments = outbox[-1].attachments
+    assert [a.filename for a in attachments] == [
+        f"{unit_id}_Usage_Months-9-to-12.csv.gz" for unit_id in unit_ids
+    ]
+    assert all(a.content_type == "application/gzip" for a in attachments)
+    content = gzip.decompress(attachments[0].data).decode("utf-8").splitlines()
+    assert sum(row.startswith("public_project_id,") for row in content) == 3
+    assert content[-1] == "--,--,--,--,300.0"
+
+    # More than 12 months only to a directory
+    with mail.record_messages() as outbox:
+        with patch("dds_web.utils.current_time", return_value=datetime(2022, 12, 15)):
+            result = cli_runner.invoke(send_usage, ["--months", 24])
+            assert result.exit_code != 0
+            result = cli_runner.invoke(send_usage, ["--months", 24, "--output-dir", str(tmp_path)])
+            assert not result.exception
+    assert len(outbox) == 0
+    _, logs = capfd.readouterr()
+    assert f"CSV files written to {tmp_path}: {len(unit_ids)}" in logs
+    content = (
+        (tmp_path / f"{unit_ids[0]}_Usage_Months-2020-12-to-2022-12.csv").read_text().splitlines()
+    )
+    assert sum(row.startswith("public_project_id,") for row in content) == 24
+    assert content[-1] == "--,--,--,--,2400.0"
+
+    # Another range with the same months is written to another file
+    with patch("dds_web.utils.current_time", return_value=datetime(2022, 12, 15)):
+        result = cli_runner.invoke(send_usage, ["--months", 12, "--output-dir", str(tmp_path)])
+        assert not result.exception
+    assert (tmp_path / f"{unit_ids[0]}_Usage_Months-2021-12-to-2022-12.csv").exists()
+    assert (tmp_path / f"{unit_ids[0]}_Usage_Months-2020-12-to-2022-12.csv").exists()
+
+
 def test_send_usage_error_csv(client, cli_runner, capfd: LogCaptureFixture):
     """Test that checks errors in the csv handling"""
 
@@ -2089,3 +2403,66 @@ def test_send_usage_error_csv(client, cli_runner, capfd: LogCaptureFixture):
             == outbox[-1].subject
         )
         assert "There was an error in the cronjob 'send-usage'" in outbox[-1].body
+
+
+# project_statistics
+
+
+def test_project_statistics_correct(client, cli_runner, capfd: LogCaptureFixture):
+    """Nothing should be reported when the stored statistics are correct."""
+    cli_runner.invoke(project_statistics)
+
+    _, err = capfd.readouterr()
+    assert "Incorrect statistics" not in err
+    assert "Projects with incorrect statistics: 0" in err
+
+
+def test_project_statistics_verify_and_rebuild(client, cli_runner, capfd: LogCaptureFixture):
+    """Incorrect statistics should be reported, and corrected with --rebuild."""
+    project = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    size = project.size
+    num_files = project.num_files
+    assert size > 0 and num_files > 0
+
+    project.size = 0
+    project.num_files = 0
+    project.current_status = "Available"
+    project.times_expired = 3
+    db.session.commit()
+
+    # Only verify
+    cli_runner.invoke(project_statistics)
+    _, err = capfd.readouterr()
+    assert "Incorrect statistics for project 'public_project_id'" in err
+    assert "Projects with incorrect statistics: 1" in err
+    project = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    assert project.size == 0
+
+    # Rebuild
+    cli_runner.invoke(project_statistics, ["--rebuild"])
+    _, err = capfd.readouterr()
+    assert "Statistics rebuilt for 1 projects." in err
+    project = models.Project.query.filter_by(public_id="public_project_id").one_or_none()
+    assert project.size == size
+    assert project.num_files == num_files
+    assert project.current_status == "In Progress"
+    assert project.times_expired == 0
+
+
+# send_emails
+
+
+def test_send_emails(client, cli_runner, capfd: LogCaptureFixture):
+    """The emails in the outbox are sent by the command."""
+    for recipient in ["researchuser@mailtrap.io", "unituser1@mailtrap.io"]:
+        msg = flask_mail.Message("Test email", recipients=[recipient], body="Test")
+        queue_email(msg)
+    db.session.commit()
+
+    with mail.record_messages() as outbox:
+        cli_runner.invoke(send_emails, ["--batch-size", "1"])
+    assert len(outbox) == 2
+
+    _, err = capfd.readouterr()
+    assert "Emails sent: 2, failed: 0" in err
+    assert not models.OutboxEmail.query.filter(models.OutboxEmail.date_sent.is_(None)).count()
@@ -0,0 +1,249 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import http
+
+# Installed
+import pytest
+
+# Own
+from dds_web import db
+import tests
+from tests.test_files_new import project_row, FIRST_NEW_FILE
+from tests.test_utils import record_statements
+from tests.api.test_project import (
+    create_and_release_project,
+    proj_data,
+    release_project_small_deadline,
+    extend_deadline_data,
+)
+
+# CONFIG ################################################################################## CONFIG #
+
+conditional_endpoints = [
+    (tests.DDSEndpoint.PROJECT_STATUS, {"project": "file_testing_project"}),
+    (tests.DDSEndpoint.PROJECT_INFO, {"project": "file_testing_project"}),
+    (tests.DDSEndpoint.LIST_FILES, {"project": "file_testing_project"}),
+    (tests.DDSEndpoint.LIST_PROJ, {}),
+]
+
+# TOOLS #################################################################################### TOOLS #
+
+
+def project_revision(project_id):
+    """Get the current change stamp of the project from the database."""
+    db.session.expire_all()
+    return project_row(project_id=project_id).revision
+
+
+# TESTS #################################################################################### TESTS #
+
+
+@pytest.mark.parametrize("endpoint,query", conditional_endpoints)
+def test_conditional_get_not_modified(client, endpoint, query):
+    """A request with the current ETag in If-None-Match gets 304 Not Modified."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+
+    response = client.get(endpoint, headers=token, query_string=query)
+    assert response.status_code == http.HTTPStatus.OK
+    etag = response.headers.get("ETag")
+    assert etag
+
+    response = client.get(endpoint, headers={**token, "If-None-Match": etag}, query_string=query)
+    assert response.status_code == http.HTTPStatus.NOT_MODIFIED
+    assert response.headers.get("ETag") == etag
+    assert not response.data
+
+    # Other ETags get the full response
+    response = client.get(
+        endpoint, headers={**token, "If-None-Match": '"not-the-etag"'}, query_string=query
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.headers.get("ETag") == etag
+
+
+def test_conditional_get_without_user_row(client):
+    """The project listing is not modified and the user row is not loaded."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+
+    response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token)
+    assert response.status_code == http.HTTPStatus.OK
+    etag = response.headers.get("ETag")
+
+    statements, stop_recording = record_statements()
+    try:
+        response = client.get(tests.DDSEndpoint.LIST_PROJ, headers={**token, "If-None-Match": etag})
+    finally:
+        stop_recording()
+
+    assert response.status_code == http.HTTPStatus.NOT_MODIFIED
+    assert statements
+    assert not [statement for statement in statements if "FROM users" in statement]
+
+
+def test_conditional_get_etag_per_user_and_request(client):
+    """The ETag depends on the user and the request options."""
+    unitadmin = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    unituser = tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client)
+    query = {"project": "public_project_id"}
+
+    etag = client.get(tests.DDSEndpoint.PROJECT_INFO, headers=unitadmin, query_string=query)
+    etag = etag.headers.get("ETag")
+    response = client.get(
+        tests.DDSEndpoint.PROJECT_INFO,
+        headers={**unituser, "If-None-Match": etag},
+        query_string=query,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.headers.get("ETag") != etag
+
+    response = client.get(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers={**unitadmin, "If-None-Match": etag},
+        query_string=query,
+        json={"history": True},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert "history" in response.json
+
+
+def test_conditional_get_no_access(client):
+    """Users without access get the usual error, also with If-None-Match."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["researchuser"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.PROJECT_INFO,
+        headers={**token, "If-None-Match": "*"},
+        query_string={"project": "restricted_project_id"},
+    )
+    assert response.status_code == http.HTTPStatus.FORBIDDEN
+    assert not response.headers.get("ETag")
+
+
+def test_revision_changes_on_file_endpoints(client, boto3_session):
+    """Adding, overwriting and deleting files changes the project revision and ETags."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    query = {"project": "file_testing_project"}
+    revision = project_revision(project_id="file_testing_project")
+    etag = client.get(tests.DDSEndpoint.LIST_FILES, headers=token, query_string=query)
+    etag = etag.headers.get("ETag")
+
+    def assert_changed():
+        nonlocal revision, etag
+        new_revision = project_revision(project_id="file_testing_project")
+        assert new_revision > revision
+        response = client.get(
+            tests.DDSEndpoint.LIST_FILES,
+            headers={**token, "If-None-Match": etag},
+            query_string=query,
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        assert response.headers.get("ETag") != etag
+        revision, etag = new_revision, response.headers.get("ETag")
+
+    # Add file
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW, headers=token, query_string=query, json=FIRST_NEW_FILE
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+    # Overwrite file
+    response = client.put(
+        tests.DDSEndpoint.FILE_NEW,
+        headers=token,
+        query_string=query,
+        json={**FIRST_NEW_FILE, "size": 1200, "size_processed": 600},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+    # Delete file
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FILE, headers=token, query_string=query, json=["filename1"]
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+    # Delete folder
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW, headers=token, query_string=query, json=FIRST_NEW_FILE
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+    response = client.delete(
+        tests.DDSEndpoint.REMOVE_FOLDER,
+        headers=token,
+        query_string=query,
+        json=[FIRST_NEW_FILE["subpath"]],
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+    # Delete all contents
+    response = client.post(
+        tests.DDSEndpoint.FILE_NEW, headers=token, query_string=query, json=FIRST_NEW_FILE
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+    response = client.delete(tests.DDSEndpoint.REMOVE_PROJ_CONT, headers=token, query_string=query)
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+    # Change project information
+    response = client.put(
+        tests.DDSEndpoint.PROJECT_INFO,
+        headers=token,
+        query_string=query,
+        json={"description": "A new description"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert_changed()
+
+
+def test_revision_changes_on_status_endpoints(client, boto3_session):
+    """Releasing a project and extending the deadline changes the project revision and ETags."""
+    project_id, _ = create_and_release_project(
+        client=client, proj_data=proj_data, release_data=release_project_small_deadline
+    )
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    query = {"project": project_id}
+    revision = project_revision(project_id=project_id)
+    assert revision > 0
+    etag = client.get(tests.DDSEndpoint.PROJECT_STATUS, headers=token, query_string=query)
+    etag = etag.headers.get("ETag")
+    listing_etag = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token).headers.get("ETag")
+
+    # Extend deadline
+    response = client.patch(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=token,
+        query_string=query,
+        json=extend_deadline_data,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert project_revision(project_id=project_id) > revision
+    revision = project_revision(project_id=project_id)
+
+    # Set to In Progress
+    response = client.post(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers=token,
+        query_string=query,
+        json={"new_status": "In Progress"},
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert project_revision(project_id=project_id) > revision
+
+    response = client.get(
+        tests.DDSEndpoint.PROJECT_STATUS,
+        headers={**token, "If-None-Match": etag},
+        query_string=query,
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json["current_status"] == "In Progress"
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers={**token, "If-None-Match": listing_etag}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.headers.get("ETag") != listing_etag
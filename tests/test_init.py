@@ -1,13 +1,13 @@
 import click.testing
 import pytest
 from dds_web import db
+import dds_web.utils
 from dds_web.database import models
 from unittest.mock import patch
 from tests import DDSEndpoint, DEFAULT_HEADER, UserAuth, USER_CREDENTIALS
 import http
 import werkzeug
 import flask
-import flask_mail
 
 
 # block_if_maintenance - should be blocked in init by before_request
@@ -27,7 +27,7 @@ def test_block_if_maintenance_active_encryptedtoken_blocked(
 
     # Researcher, Unit Personnel, Unit Admin
     for user in ["researcher", "unituser", "unitadmin"]:
-        with patch.object(flask_mail.Mail, "send") as mock_mail_send:
+        with patch.object(dds_web.utils, "queue_email") as mock_mail_send:
             response = client.get(
                 DDSEndpoint.ENCRYPTED_TOKEN,
                 auth=UserAuth(USER_CREDENTIALS[user]).as_tuple(),
@@ -48,7 +48,7 @@ def test_block_if_maintenance_active_encryptedtoken_super_admin_approved(
     db.session.commit()
 
     # Try encrypted token - "/user/encrypted_token"
-    with patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.get(
             DDSEndpoint.ENCRYPTED_TOKEN,
             auth=UserAuth(USER_CREDENTIALS["superadmin"]).as_tuple(),
@@ -68,7 +68,7 @@ def test_block_if_maintenance_inactive_approved(
 
     # Try authenticating all
     for user in ["superadmin", "unitadmin", "unituser", "researcher"]:
-        with patch.object(flask_mail.Mail, "send") as mock_mail_send:
+        with patch.object(dds_web.utils, "queue_email") as mock_mail_send:
             response = client.get(
                 DDSEndpoint.ENCRYPTED_TOKEN,
                 auth=UserAuth(USER_CREDENTIALS[user]).as_tuple(),
@@ -0,0 +1,77 @@
+# IMPORTS ################################################################################ IMPORTS #
+
+# Standard library
+import http
+import threading
+import time
+import unittest.mock
+
+# Installed
+import pytest
+
+# Own
+from dds_web.errors import KDFUnavailableError
+from dds_web.security.kdf import KDFExecutor, kdf_executor, run_kdf
+import tests
+
+# TESTS #################################################################################### TESTS #
+
+
+def test_run_kdf_result_and_exception(client):
+    """The result and the exceptions of the operations are returned to the caller."""
+    assert run_kdf(sum, [1, 2, 3]) == 6
+    with pytest.raises(ZeroDivisionError):
+        run_kdf(divmod, 1, 0)
+
+
+def test_kdf_executor_workers_from_memory_budget(client):
+    """The number of workers is the memory budget divided by the Argon2 memory cost."""
+    config = client.application.config
+    with unittest.mock.patch.dict(
+        config,
+        {"ARGON_MEMORY_COST_KD": 0x80000, "ARGON_MEMORY_COST_PW": 0x40000},
+    ):
+        config["KDF_MEMORY_BUDGET"] = 0x200000
+        executor = kdf_executor()
+        assert executor.workers == 4
+        assert kdf_executor() is executor
+
+        # Replaced, and the previous executor shut down, when the settings change
+        config["KDF_MEMORY_BUDGET"] = 0x10
+        with unittest.mock.patch.object(executor, "shutdown", wraps=executor.shutdown) as shutdown:
+            assert kdf_executor().workers == 1
+        shutdown.assert_called_once_with()
+
+
+def test_kdf_executor_saturated(client):
+    """Operations that cannot be queued or are not done in time fail with 503."""
+    executor = KDFExecutor(workers=1, max_queue=0, timeout=0.1)
+    release = threading.Event()
+
+    # The only worker is busy, and the operation is not done in time
+    with pytest.raises(KDFUnavailableError):
+        executor.run(release.wait)
+    assert executor.depth == 1
+
+    # No place in the queue
+    with pytest.raises(KDFUnavailableError):
+        executor.run(sum, [1])
+
+    release.set()
+    while executor.depth:
+        time.sleep(0.01)
+    executor.timeout = 5
+    assert executor.run(sum, [1]) == 1
+
+
+def test_kdf_saturated_returns_503(client):
+    """Login gives 503 Service Unavailable when the KDF executor is saturated."""
+    with unittest.mock.patch(
+        "dds_web.security.kdf.KDFExecutor.run", side_effect=KDFUnavailableError
+    ):
+        response = client.get(
+            tests.DDSEndpoint.ENCRYPTED_TOKEN,
+            headers=tests.DEFAULT_HEADER,
+            auth=tests.UserAuth(tests.USER_CREDENTIALS["researcher"]).as_tuple(),
+        )
+    assert response.status_code == http.HTTPStatus.SERVICE_UNAVAILABLE
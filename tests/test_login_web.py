@@ -1,8 +1,10 @@
 import datetime
+import re
 import flask
 from http import HTTPStatus
 import werkzeug
 from typing import Dict
+from unittest.mock import patch
 
 from tests import UserAuth, USER_CREDENTIALS, DDSEndpoint, DEFAULT_HEADER
 
@@ -183,3 +185,33 @@ def test_password_reset(client: flask.testing.FlaskClient):
         response.json.get("message")
         == "Password reset performed after last authentication. Start a new authenticated session to proceed."
     )
+
+
+def test_projects_page_next_and_stale_links(client: flask.testing.FlaskClient):
+    """The next page link continues the listing, a stale link shows the first page."""
+    successful_web_login(client, UserAuth(USER_CREDENTIALS["unitadmin"]))
+
+    with patch("dds_web.web.user.PROJECTS_PER_PAGE", 2):
+        response: werkzeug.test.WrapperTestResponse = client.get(
+            DDSEndpoint.PROJECTS_WEB, headers=DEFAULT_HEADER
+        )
+        assert response.status_code == HTTPStatus.OK
+        next_link = re.search(r'href="(/projects\?after=[^"]+)"', response.data.decode())
+        assert next_link
+
+        # Next page
+        response = client.get(next_link.group(1), headers=DEFAULT_HEADER)
+        assert response.status_code == HTTPStatus.OK
+        assert "The page is no longer available" not in response.data.decode()
+
+        # Stale link, e.g. the last project on the previous page was deleted
+        response = client.get(
+            DDSEndpoint.PROJECTS_WEB,
+            query_string={"after": "deleted_project_id"},
+            headers=DEFAULT_HEADER,
+            follow_redirects=True,
+        )
+        assert response.status_code == HTTPStatus.OK
+        assert response.request.path == DDSEndpoint.PROJECTS_WEB
+        assert not response.request.args.get("after")
+        assert "The page is no longer available, showing the first page." in response.data.decode()
@@ -1,6 +1,7 @@
 # IMPORTS ################################################################################ IMPORTS #
 
 # Standard library
+import datetime
 
 # Installed
 from typing import no_type_check
@@ -10,6 +11,7 @@ import flask
 import argon2
 
 # Own
+import dds_web.utils
 from dds_web import db
 from dds_web.database import models
 from dds_web.config import Config
@@ -247,6 +249,109 @@ def test_delete_project(client):
     assert project_users == []
 
 
+def test_project_statistics_follow_files(client):
+    """Project size and number of files are updated when files are added, changed and deleted."""
+    project = __setup_project()
+    size = project.size
+    num_files = project.num_files
+    assert size == sum(file.size_stored for file in project.files)
+    assert num_files == len(project.files)
+
+    # Add file
+    new_file = models.File(
+        name="statistics_file",
+        name_in_bucket="statistics_file_in_bucket",
+        subpath=".",
+        size_original=200,
+        size_stored=100,
+        compressed=True,
+        public_key="A" * 64,
+        salt="B" * 32,
+        checksum="C" * 64,
+    )
+    project.files.append(new_file)
+    db.session.commit()
+    assert project.size == size + 100
+    assert project.num_files == num_files + 1
+
+    # Change file size
+    new_file.size_stored = 150
+    db.session.commit()
+    assert project.size == size + 150
+    assert project.num_files == num_files + 1
+
+    # Delete file
+    db.session.delete(new_file)
+    db.session.commit()
+    assert project.size == size
+    assert project.num_files == num_files
+
+
+def test_project_current_status_follows_statuses(client):
+    """Project current status and deadline are updated when new statuses are added."""
+    project = __setup_project()
+    assert project.current_status == "In Progress"
+    assert project.current_deadline is None
+
+    now = dds_web.utils.current_time()
+    deadline = now + datetime.timedelta(days=10)
+    project.project_statuses.append(
+        models.ProjectStatuses(status="Available", date_created=now, deadline=deadline)
+    )
+    db.session.commit()
+    assert project.current_status == "Available"
+    assert project.current_deadline == deadline
+
+    # Retracting keeps the deadline from when the project was available
+    project.project_statuses.append(
+        models.ProjectStatuses(
+            status="In Progress", date_created=now + datetime.timedelta(seconds=1)
+        )
+    )
+    db.session.commit()
+    assert project.current_status == "In Progress"
+    assert project.current_deadline == deadline
+
+    # The stored values match the status history
+    assert (project.current_status, project.current_deadline) == (
+        models.current_status_and_deadline(
+            status_history=[
+                (row.status, row.deadline, row.date_created) for row in project.project_statuses
+            ]
+        )
+    )
+
+
+def test_project_status_counters_follow_statuses(client):
+    """Project has_been_available and times_expired are updated when statuses change."""
+    project = __setup_project()
+    assert not project.has_been_available
+    assert project.times_expired == 0
+
+    now = dds_web.utils.current_time()
+    for seconds, status in enumerate(["Available", "Expired", "Available", "Expired"]):
+        project.project_statuses.append(
+            models.ProjectStatuses(
+                status=status,
+                date_created=now + datetime.timedelta(seconds=seconds),
+                deadline=now + datetime.timedelta(days=10),
+            )
+        )
+    db.session.commit()
+    assert project.has_been_available
+    assert project.times_expired == 2
+
+    # Changing an existing status updates the counters
+    latest_status = max(project.project_statuses, key=lambda x: x.date_created)
+    latest_status.status = "Archived"
+    db.session.commit()
+    assert project.current_status == "Archived"
+    assert project.times_expired == 1
+    assert (project.has_been_available, project.times_expired) == models.status_counters(
+        statuses=[row.status for row in project.project_statuses]
+    )
+
+
 # User ########################################################################################## User #
 
 
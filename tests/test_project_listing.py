@@ -153,6 +153,31 @@ def test_list_proj_superadmin(client):
     assert "Unit User" == public_project.get("Created by")
 
 
+def test_list_proj_only_projects_with_access(client):
+    """Researchers, unit users and super admins should only list the projects they can see"""
+
+    expected = {
+        "researchuser": {
+            project.public_id for project in models.User.query.get("researchuser").projects
+        },
+        "unitadmin": {
+            project.public_id for project in models.UnitUser.query.get("unitadmin").unit.projects
+        },
+        "superadmin": {project.public_id for project in models.Project.query.all()},
+    }
+    for username, public_ids in expected.items():
+        token = tests.UserAuth(tests.USER_CREDENTIALS[username]).token(client)
+        response = client.get(
+            tests.DDSEndpoint.LIST_PROJ,
+            headers=token,
+            json={"show_all": True},
+            content_type="application/json",
+        )
+        assert response.status_code == http.HTTPStatus.OK
+        listed = {project.get("Project ID") for project in response.json.get("project_info")}
+        assert public_ids and listed == public_ids
+
+
 def test_list_only_active_projects_unit_user(client):
     """Unit admin should be able to list only active projects without --show-all flag"""
 
@@ -193,6 +218,125 @@ def test_list_all_projects_unit_user(client):
     assert len(response.json.get("project_info")) == 5
 
 
+def test_list_proj_matches_project_properties(client):
+    """The aggregated listing should give the same information as the project properties"""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ,
+        headers=token,
+        json={"show_all": True},
+        content_type="application/json",
+    )
+    assert response.status_code == http.HTTPStatus.OK
+
+    unitadmin = models.User.query.get("unitadmin")
+    listed_projects = response.json.get("project_info")
+    assert len(listed_projects) == len(unitadmin.projects)
+    for listed in listed_projects:
+        project = models.Project.query.filter_by(public_id=listed.get("Project ID")).one()
+        assert listed.get("Status") == project.current_status
+        assert listed.get("Size") == project.size
+        assert listed.get("Access") == (
+            models.ProjectUserKeys.query.filter_by(
+                project_id=project.id, user_id="unitadmin"
+            ).count()
+            > 0
+        )
+    assert response.json.get("total_size") == sum(p.size for p in unitadmin.projects)
+
+
+def test_list_proj_filter_status(client):
+    """Only projects with the requested status should be listed"""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"status": "In Progress"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert len(response.json.get("project_info")) == 5
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"status": "Available"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert response.json.get("project_info") == []
+    assert response.json.get("total_size") == 0
+
+
+def test_list_proj_search(client):
+    """Search should match title or PI, case insensitive"""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"search": "ELITE"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert [p.get("Project ID") for p in response.json.get("project_info")] == [
+        "restricted_project_id"
+    ]
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"search": "testing project PI"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    assert [p.get("Project ID") for p in response.json.get("project_info")] == [
+        "file_testing_project"
+    ]
+
+
+def test_list_proj_sort_and_paginate(client):
+    """Pages should together contain all projects in the requested order"""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"sort": "title", "order": "desc"}
+    )
+    assert response.status_code == http.HTTPStatus.OK
+    all_projects = [p.get("Project ID") for p in response.json.get("project_info")]
+    assert all_projects == [
+        "unused_project_id",
+        "public_project_id",
+        "second_public_project_id",
+        "file_testing_project",
+        "restricted_project_id",
+    ]
+    assert "next_page" not in response.json
+    total_size = response.json.get("total_size")
+
+    paginated_projects = []
+    query_string = {"sort": "title", "order": "desc", "limit": 2}
+    while True:
+        response = client.get(tests.DDSEndpoint.LIST_PROJ, headers=token, query_string=query_string)
+        assert response.status_code == http.HTTPStatus.OK
+        assert len(response.json.get("project_info")) <= 2
+        assert response.json.get("total_size") == total_size
+        paginated_projects.extend(p.get("Project ID") for p in response.json.get("project_info"))
+        if not response.json.get("next_page"):
+            break
+        query_string["after"] = response.json.get("next_page")
+
+    assert paginated_projects == all_projects
+
+
+def test_list_proj_invalid_listing_options(client):
+    """Invalid sort key or continuation project should give bad request"""
+
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unitadmin"]).token(client)
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ, headers=token, query_string={"sort": "unknown"}
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+
+    response = client.get(
+        tests.DDSEndpoint.LIST_PROJ,
+        headers=token,
+        query_string={"limit": 2, "after": "unit2testing"},
+    )
+    assert response.status_code == http.HTTPStatus.BAD_REQUEST
+    assert "Cannot continue after project 'unit2testing'" in response.json.get("message")
+
+
 def test_proj_private_successful(client):
     """Successfully get the private key"""
 
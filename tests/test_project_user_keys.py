@@ -3,6 +3,7 @@ import uuid
 import argon2
 import itertools
 import typing
+import unittest.mock
 
 import pytest
 from cryptography.hazmat.primitives import serialization
@@ -21,11 +22,14 @@ from dds_web.errors import (
     SensitiveContentMissingError,
 )
 from dds_web.security.project_user_keys import (
+    add_key_pair_to_pool,
     generate_invite_key_pair,
     generate_user_key_pair,
+    key_pair_pool_level,
     share_project_private_key,
     verify_and_transfer_invite_to_user,
     update_user_keys_for_password_change,
+    user_private_key,
 )
 from dds_web.security.tokens import encrypted_jwt_token
 from dds_web.utils import timestamp
@@ -537,6 +541,64 @@ def test_share_project_keys_via_two_invites(client):
     assert len(project_invite_keys) == 5
 
 
+def test_share_project_keys_with_single_key_derivation(client):
+    invite1 = models.Invite(email="new_unit_user@mailtrap.io", role="Unit Personnel")
+    generate_invite_key_pair(invite1)
+    unituser = models.User.query.filter_by(username="unituser").first()
+    unituser.unit.invites.append(invite1)
+    unituser_token = encrypted_jwt_token(
+        username=unituser.username,
+        sensitive_content="password",
+    )
+
+    with unittest.mock.patch(
+        "argon2.low_level.hash_secret_raw", wraps=argon2.low_level.hash_secret_raw
+    ) as mock_kdf:
+        with user_private_key(user=unituser, token=unituser_token) as private_key:
+            # The key is only derived when it is needed
+            assert mock_kdf.call_count == 0
+            for project in unituser.unit.projects:
+                share_project_private_key(
+                    from_user=unituser,
+                    to_another=invite1,
+                    from_user_token=unituser_token,
+                    project=project,
+                    user_private_key=private_key,
+                )
+        assert mock_kdf.call_count == 1
+    dds_web.db.session.commit()
+
+    assert len(invite1.project_invite_keys) == len(unituser.unit.projects) == 5
+
+
+def test_invite_key_pair_from_pool(client):
+    add_key_pair_to_pool()
+    dds_web.db.session.commit()
+    pooled_public_key = models.KeyPair.query.one().public_key
+    assert key_pair_pool_level() == 1
+
+    # The invite takes the key pair from the pool
+    invite1 = models.Invite(email="new_unit_user@mailtrap.io", role="Unit Personnel")
+    temporary_key = generate_invite_key_pair(invite1)
+    assert invite1.public_key == pooled_public_key
+    assert key_pair_pool_level() == 0
+
+    # The private key can be transferred to the user
+    invite_token = encrypted_jwt_token(
+        username="",
+        sensitive_content=temporary_key.hex(),
+        additional_claims={"inv": invite1.email},
+    )
+    new_user = models.UnitUser(username="user_not_existing", password="Password123", name="Test")
+    assert verify_and_transfer_invite_to_user(invite_token, new_user, "Password123")
+    assert new_user.public_key == pooled_public_key
+
+    # Generated inline when the pool is empty
+    invite2 = models.Invite(email="another_unit_user@mailtrap.io", role="Unit Personnel")
+    generate_invite_key_pair(invite2)
+    assert invite2.public_key and invite2.public_key != pooled_public_key
+
+
 def test_update_user_keys_for_password_change(client):
     user = models.User(username="randomtestuser", password="password")
 
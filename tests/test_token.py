@@ -1,16 +1,20 @@
 import datetime
+import os
+import time
 
 import flask
 import pytest
-from jwcrypto import jwt
+from jwcrypto import jwk, jwt
 
 import dds_web.utils
 import tests
 from dds_web.errors import AuthenticationError, TokenMissingError, InviteError
 from dds_web.security.tokens import encrypted_jwt_token, jwt_token
+from dds_web.security.token_keys import token_key, token_verification_keys
 from dds_web.security.auth import (
     extract_encrypted_token_sensitive_content,
     decrypt_and_verify_token_signature,
+    verify_token_signature,
     verify_invite_token,
     matching_email_with_invite,
     verify_token_no_data,
@@ -313,3 +317,68 @@ def test_expired_encrypted_token(client):
         verify_token(token)
 
     assert "Expired token" in str(error.value)
+
+
+def test_token_key_derived_once_per_secret(client, monkeypatch):
+    key = token_key()
+    assert token_key() is key
+    assert token_verification_keys() is token_verification_keys()
+
+    # A new key when the secret changes
+    monkeypatch.setitem(flask.current_app.config, "SECRET_KEY", "YY" * 16)
+    assert token_key() is not key
+    assert token_key() is token_key()
+
+
+def test_token_with_previous_secret_key(client, monkeypatch):
+    old_secret = flask.current_app.config.get("SECRET_KEY")
+    token = encrypted_jwt_token(username="researchuser", sensitive_content="sensitive_content")
+    signed_token = jwt_token(username="researchuser")
+
+    # Rotate the secret key
+    monkeypatch.setitem(flask.current_app.config, "SECRET_KEY", "YY" * 16)
+    monkeypatch.setitem(flask.current_app.config, "PREVIOUS_SECRET_KEYS", [old_secret])
+    assert decrypt_and_verify_token_signature(token).get("sub") == "researchuser"
+    assert verify_token_signature(signed_token).get("sub") == "researchuser"
+    assert (
+        extract_encrypted_token_sensitive_content(
+            encrypted_jwt_token(username="researchuser", sensitive_content="new_content"),
+            "researchuser",
+        )
+        == "new_content"
+    )
+
+    # Tokens from the previous key are invalid once it is removed
+    monkeypatch.setitem(flask.current_app.config, "PREVIOUS_SECRET_KEYS", [])
+    with pytest.raises(AuthenticationError) as error:
+        verify_token(token)
+    assert "Invalid token" in str(error.value)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("DDS_BENCHMARK_TOKENS"),
+    reason="Benchmark, set DDS_BENCHMARK_TOKENS to the number of requests, e.g. 10000",
+)
+def test_token_key_benchmark(client):
+    """Compare deriving the keys for every token operation with the cached keys.
+
+    An authenticated request signs, encrypts, decrypts and verifies at least once.
+    """
+    num_requests = int(os.environ["DDS_BENCHMARK_TOKENS"])
+    secret = flask.current_app.config.get("SECRET_KEY")
+
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        for _ in range(4):
+            jwk.JWK.from_password(secret)
+    derived = (time.perf_counter() - start) / num_requests
+
+    start = time.perf_counter()
+    for _ in range(num_requests):
+        for _ in range(2):
+            token_key()
+            token_verification_keys()
+    cached = (time.perf_counter() - start) / num_requests
+
+    print(f"Keys per request, derived: {derived * 1e6:.1f} us, cached: {cached * 1e6:.1f} us")
+    assert cached < derived
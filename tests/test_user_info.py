@@ -1,9 +1,15 @@
 # Installed
+import datetime
 import http
 import unittest
 
+import pytest
+
 # Own
 import tests
+from dds_web import db
+from dds_web.database import models
+import dds_web.utils
 from tests.test_user_delete import user_from_email
 
 
@@ -98,3 +104,55 @@ def test_show_usage_unit_user(client):
     case.assertCountEqual(
         [x.public_id for x in unit_user.projects], response.json["project_usage"].keys()
     )
+
+
+def test_show_usage_saved_and_live_usage(client):
+    """The usage is the saved monthly usage plus the usage since then, and is cached."""
+    token = tests.UserAuth(tests.USER_CREDENTIALS["unituser"]).token(client)
+    now = dds_web.utils.current_time()
+    project = models.Project.query.filter_by(public_id="public_project_id").one()
+
+    # 10 GB hours per version, not yet invoiced
+    for version in models.Version.query:
+        version.size_stored = 10**9
+        version.time_uploaded = now - datetime.timedelta(hours=10)
+        version.time_deleted = None
+        version.time_invoiced = None
+    num_versions = len(project.file_versions)
+    # 5 GB hours saved in a previous usage calculation
+    project.monthly_usage.append(models.Usage(usage=5 * 10**9, time_collected=now))
+    db.session.commit()
+
+    def get_usage(headers=None):
+        response = client.get(tests.DDSEndpoint.USAGE, headers={**token, **(headers or {})})
+        assert response.status_code == http.HTTPStatus.OK
+        return response.json
+
+    usage = get_usage()
+    gbhours = usage["project_usage"]["public_project_id"]["gbhours"]
+    assert gbhours == pytest.approx(5 + 10 * num_versions, abs=0.1)
+    assert usage["project_usage"]["public_project_id"]["cost"] == pytest.approx(
+        gbhours * 0.09 / (30 * 24), abs=0.01
+    )
+    assert usage["total_usage"]["gbhours"] == pytest.approx(
+        sum(project_usage["gbhours"] for project_usage in usage["project_usage"].values()),
+        abs=0.1,
+    )
+
+    # New version: the cached response is used unless asked not to
+    project.file_versions.append(
+        models.Version(size_stored=10**10, time_uploaded=now - datetime.timedelta(hours=10))
+    )
+    db.session.commit()
+    assert get_usage() == usage
+    new_usage = get_usage(headers={"Cache-Control": "no-cache"})
+    assert new_usage["project_usage"]["public_project_id"]["gbhours"] == pytest.approx(
+        gbhours + 100, abs=0.1
+    )
+
+    # New usage rows are used at once
+    project.monthly_usage.append(models.Usage(usage=10**12, time_collected=now))
+    db.session.commit()
+    assert get_usage()["project_usage"]["public_project_id"]["gbhours"] == pytest.approx(
+        gbhours + 1100, abs=0.1
+    )
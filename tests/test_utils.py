@@ -4,7 +4,7 @@ import pytest
 from unittest.mock import patch, MagicMock
 from unittest.mock import PropertyMock
 
-from dds_web import db
+from dds_web import db, mail
 from dds_web.database import models
 from dds_web.errors import (
     AccessDeniedError,
@@ -17,7 +17,10 @@ import flask_login
 import datetime
 from pyfakefs.fake_filesystem import FakeFilesystem
 import os
+import random
+import time
 import flask_mail
+import smtplib
 from flask.testing import FlaskClient
 import requests_mock
 import werkzeug
@@ -136,6 +139,39 @@ def test_verify_project_access_ok(client: flask.testing.FlaskClient) -> None:
     utils.verify_project_access(project=project)
 
 
+def test_has_project_access_per_role(client: flask.testing.FlaskClient) -> None:
+    """The access depends on the role, and is checked once per request."""
+    public_project = models.Project.query.filter_by(public_id="public_project_id").one()
+    restricted_project = models.Project.query.filter_by(public_id="restricted_project_id").one()
+
+    # Research users need a row in ProjectUsers
+    flask.g.flask_httpauth_user = models.User.query.get("researchuser")
+    with patch.object(
+        models.ResearchUser,
+        "has_project_access",
+        autospec=True,
+        side_effect=models.ResearchUser.has_project_access,
+    ) as mock_check:
+        assert utils.has_project_access(project=public_project)
+        assert utils.has_project_access(project=public_project)
+        assert not utils.has_project_access(project=restricted_project)
+    assert mock_check.call_count == 2
+
+    # Unit users have access to the projects of their unit
+    unituser = models.UnitUser.query.filter_by(unit_id=public_project.unit_id).first()
+    other_unit_project = models.Project.query.filter(
+        models.Project.unit_id != public_project.unit_id
+    ).first()
+    flask.g.flask_httpauth_user = unituser
+    assert utils.has_project_access(project=public_project)
+    assert not utils.has_project_access(project=other_unit_project)
+
+    # Super admins have access to all projects
+    flask.g.flask_httpauth_user = models.SuperAdmin.query.first()
+    for project in models.Project.query.all():
+        assert utils.has_project_access(project=project)
+
+
 def test_verify_project_user_key_denied(client: flask.testing.FlaskClient) -> None:
     """A user must have an entry in projectUserKeys to access a project."""
     # User
@@ -918,6 +954,220 @@ def test_page_query(client):
     assert iteration == (len(projects) + previous_projects)
 
 
+def record_statements():
+    """Record the SQL statements executed until the listener is removed."""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *_):
+        statements.append(statement)
+
+    sqlalchemy.event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    return statements, lambda: sqlalchemy.event.remove(
+        db.engine, "before_cursor_execute", before_cursor_execute
+    )
+
+
+def test_page_query_keyset(client):
+    """The pages are selected by primary key without OFFSET and rows are not skipped."""
+    project_ids = [project.id for project in models.Project.query.order_by(models.Project.id)]
+
+    statements, stop_recording = record_statements()
+    try:
+        seen = []
+        for project in utils.page_query(
+            models.Project.query.filter_by(done=False).with_for_update(), page_size=2
+        ):
+            seen.append(project.id)
+            # Changing the filtered column and committing during the iteration is fine
+            project.done = True
+            db.session.commit()
+    finally:
+        stop_recording()
+
+    assert seen == project_ids
+    pages = [
+        statement
+        for statement in statements
+        if "FROM projects" in statement and "LIMIT" in statement.upper()
+    ]
+    assert len(pages) == len(project_ids) // 2 + 1
+    assert all("OFFSET" not in page.upper() for page in pages)
+    assert all("FOR UPDATE" in page.upper() for page in pages)
+
+
+def test_page_query_join(client):
+    """Joined queries are paged by the key of the first entity and yield tuples."""
+    rows = list(
+        utils.page_query(
+            db.session.query(models.File, models.Project).join(
+                models.Project, models.File.project_id == models.Project.id
+            ),
+            page_size=3,
+        )
+    )
+    assert len(rows) > 3
+    assert [file.id for file, _ in rows] == sorted(file.id for file in models.File.query)
+    assert all(file.project_id == project.id for file, project in rows)
+
+    # Other unique keys
+    usernames = [user.username for user in utils.page_query(models.User.query, page_size=4)]
+    assert usernames == sorted(user.username for user in models.User.query)
+    public_ids = [
+        project.public_id
+        for project in utils.page_query(models.Project.query, key=models.Project.public_id)
+    ]
+    assert public_ids == sorted(public_ids) and len(public_ids) == models.Project.query.count()
+
+
+def test_page_query_composite_primary_key(client):
+    """Entities with a composite primary key need an explicit unique key."""
+    with pytest.raises(ValueError) as err:
+        next(utils.page_query(models.ProjectStatuses.query))
+    assert "composite primary key" in str(err.value)
+
+
+@pytest.mark.skipif(
+    not os.environ.get("DDS_BENCHMARK_VERSIONS"),
+    reason="Benchmark, set DDS_BENCHMARK_VERSIONS to the number of versions, e.g. 5000000",
+)
+def test_page_query_benchmark(client):
+    """Iterate over a large number of versions and report the time per page.
+
+    With keyset pagination the last pages take as long as the first ones.
+    """
+    num_versions = int(os.environ["DDS_BENCHMARK_VERSIONS"])
+    project = models.Project.query.first()
+    now = utils.current_time()
+    chunk_size = 10000
+    for start in range(0, num_versions, chunk_size):
+        db.session.execute(
+            models.Version.__table__.insert(),
+            [
+                {
+                    "project_id": project.id,
+                    "active_file": None,
+                    "size_stored": 1000,
+                    "time_uploaded": now,
+                }
+                for _ in range(min(chunk_size, num_versions - start))
+            ],
+        )
+    db.session.commit()
+
+    page_times = []
+    num_rows = 0
+    pages = utils.page_query(models.Version.query)
+    start = time.perf_counter()
+    for num_rows, _ in enumerate(pages, start=1):
+        if num_rows % 1000 == 0:
+            page_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+    assert num_rows >= num_versions
+
+    first = sum(page_times[:10]) / 10
+    last = sum(page_times[-10:]) / 10
+    assert (
+        last < first * 5
+    ), f"{num_rows} versions, first pages: {first:.4f} s/page, last pages: {last:.4f} s/page"
+
+
+# queue_email and send_outbox_emails
+
+
+def queue_test_email(recipient="researchuser@mailtrap.io"):
+    """Add an email to the outbox and commit."""
+    msg = flask_mail.Message("Test email", recipients=[recipient])
+    msg.body = "Test body"
+    msg.html = "<p>Test body</p>"
+    utils.queue_email(msg)
+    db.session.commit()
+
+
+def test_queue_email_not_saved_on_rollback(client):
+    """The email is only added to the outbox if the session is committed."""
+    msg = flask_mail.Message("Test email", recipients=["researchuser@mailtrap.io"])
+    utils.queue_email(msg)
+    db.session.rollback()
+    assert models.OutboxEmail.query.count() == 0
+
+
+def test_send_outbox_emails(client):
+    """The emails in the outbox are sent in batches and their content is removed."""
+    for _ in range(3):
+        queue_test_email()
+
+    with mail.record_messages() as outbox:
+        sent, failed = utils.send_outbox_emails(batch_size=2)
+    assert (sent, failed) == (3, 0)
+    assert len(outbox) == 3
+    assert outbox[0].subject == "Test email"
+    assert outbox[0].recipients == ["researchuser@mailtrap.io"]
+    assert outbox[0].html == "<p>Test body</p>"
+    assert outbox[0].attachments[0].filename == "scilifelab_logo.png"
+
+    for email in models.OutboxEmail.query.all():
+        assert email.date_sent
+        assert email.attempts == 1
+        assert email.body is None and email.html is None
+
+    # Nothing more to send
+    with mail.record_messages() as outbox:
+        assert utils.send_outbox_emails() == (0, 0)
+    assert not outbox
+
+
+def test_send_outbox_emails_retry_with_backoff(client):
+    """Emails are retried later when the mail server is unavailable, until max attempts."""
+    queue_test_email()
+
+    with patch.object(
+        flask_mail.Connection, "send", side_effect=smtplib.SMTPServerDisconnected("down")
+    ):
+        assert utils.send_outbox_emails(max_attempts=2, retry_delay=60) == (0, 0)
+        email = models.OutboxEmail.query.one()
+        assert email.attempts == 1
+        assert email.date_sent is None
+        assert email.body and email.html
+        assert "down" in email.last_error
+        assert email.next_attempt > utils.current_time() + datetime.timedelta(seconds=50)
+
+        # Not retried before the backoff has passed
+        assert utils.send_outbox_emails(max_attempts=2, retry_delay=60) == (0, 0)
+        assert models.OutboxEmail.query.one().attempts == 1
+
+        # Last attempt
+        email.next_attempt = utils.current_time()
+        db.session.commit()
+        assert utils.send_outbox_emails(max_attempts=2, retry_delay=60) == (0, 1)
+        email = models.OutboxEmail.query.one()
+        assert email.attempts == 2
+        # The content is not kept after giving up
+        assert email.body is None and email.html is None
+
+    # Not sent again after max attempts
+    email = models.OutboxEmail.query.one()
+    email.next_attempt = utils.current_time()
+    db.session.commit()
+    assert utils.send_outbox_emails(max_attempts=2) == (0, 0)
+
+
+def test_send_outbox_emails_recipient_refused(client):
+    """Emails refused by the mail server are not retried."""
+    queue_test_email(recipient="refused@example.com")
+    queue_test_email()
+
+    def refuse(message, *_, **__):
+        if "refused@example.com" in message.recipients:
+            raise smtplib.SMTPRecipientsRefused({"refused@example.com": (550, b"No such user")})
+
+    with patch.object(flask_mail.Connection, "send", side_effect=refuse):
+        assert utils.send_outbox_emails() == (1, 1)
+
+    refused = models.OutboxEmail.query.filter(models.OutboxEmail.date_sent.is_(None)).one()
+    assert refused.last_error
+    assert refused.body is None and refused.html is None
+
+
 # create_one_time_password_email
 
 
@@ -1003,6 +1253,51 @@ def test_bucket_is_valid_ok():
     assert message == ""
 
 
+# global_settings
+
+
+def test_global_settings_cached(client: flask.testing.FlaskClient):
+    """The maintenance mode and the MOTDs are read again only after a version bump."""
+    settings = utils.global_settings()
+    assert not settings["maintenance_active"]
+    assert utils.global_settings() is settings
+
+    # Changed outside of the ORM: still cached
+    db.session.execute(sqlalchemy.text("UPDATE maintenance SET active = 1"))
+    db.session.commit()
+    assert utils.global_settings() is settings
+    utils.bump_global_settings_version()
+    assert utils.global_settings()["maintenance_active"]
+
+    # Changed through the ORM: read again
+    settings = utils.global_settings()
+    db.session.add(models.MOTD(message="A new MOTD"))
+    db.session.commit()
+    assert utils.global_settings() is not settings
+    assert utils.get_active_motds()[0]["message"] == "A new MOTD"
+
+    # Read again when expired
+    settings = utils.global_settings()
+    state = flask.current_app.extensions["global_settings"]
+    state["cache"].expire(time=state["cache"].timer() + 3600)
+    assert utils.global_settings() is not settings
+
+
+# units_usage
+
+
+def test_units_usage(client: flask.testing.FlaskClient):
+    """The usage of all units should be the sum of the stored file sizes in their projects."""
+    usage = utils.units_usage()
+    for unit in models.Unit.query:
+        expected = sum(f.size_stored for p in unit.projects for f in p.files)
+        assert usage.get(unit.id, 0) == expected == unit.size
+
+    # Only the chosen units
+    unit = models.Unit.query.first()
+    assert utils.units_usage(unit_ids=[unit.id]).keys() <= {unit.id}
+
+
 # calculate usage
 
 
@@ -1087,6 +1382,76 @@ def test_calculate_version_period_usage_new_version(client: flask.testing.FlaskC
     assert existing_version.time_invoiced
 
 
+@pytest.mark.parametrize("seed", range(5))
+def test_calculate_period_usage_matches_version_calculation(client, seed):
+    """The usage calculated in the database should match calculate_version_period_usage."""
+    rng = random.Random(seed)
+    now = utils.current_time().replace(microsecond=0)
+
+    def random_time(after, max_seconds):
+        return after + datetime.timedelta(seconds=rng.randint(0, max_seconds))
+
+    # Add versions in all invoicing states - stored timestamps have whole seconds
+    projects = models.Project.query.all()
+    for project in projects:
+        for _ in range(rng.randint(0, 20)):
+            time_uploaded = now - datetime.timedelta(seconds=rng.randint(0, 365 * 24 * 3600))
+            time_deleted = None
+            time_invoiced = None
+            if rng.random() < 0.5:
+                time_deleted = min(random_time(time_uploaded, 200 * 24 * 3600), now)
+            if rng.random() < 0.5:
+                time_invoiced = min(random_time(time_uploaded, 100 * 24 * 3600), now)
+                if time_deleted and rng.random() < 0.5:
+                    time_invoiced = time_deleted
+                elif time_deleted:
+                    time_invoiced = min(time_invoiced, time_deleted)
+            project.file_versions.append(
+                models.Version(
+                    size_stored=rng.randint(0, 5 * 10**12),
+                    time_uploaded=time_uploaded,
+                    time_deleted=time_deleted,
+                    time_invoiced=time_invoiced,
+                )
+            )
+    db.session.commit()
+
+    # Calculate per version, without saving
+    expected_usage = {}
+    expected_invoiced = {}
+    with patch("dds_web.utils.current_time", return_value=now):
+        for project in projects:
+            for version in project.file_versions:
+                if version.time_deleted == version.time_invoiced and [
+                    version.time_deleted,
+                    version.time_invoiced,
+                ] != [None, None]:
+                    expected_invoiced[version.id] = version.time_invoiced
+                    continue
+                expected_usage[project.id] = expected_usage.get(
+                    project.id, 0
+                ) + utils.calculate_version_period_usage(version=version)
+                expected_invoiced[version.id] = version.time_invoiced
+    db.session.rollback()
+
+    usage = utils.calculate_period_usage(project_ids=[p.id for p in projects], now=now)
+    db.session.commit()
+
+    assert usage.keys() == expected_usage.keys()
+    for project_id, bhours in expected_usage.items():
+        assert usage[project_id] == pytest.approx(bhours, rel=1e-9)
+    for version in models.Version.query:
+        if version.id in expected_invoiced:
+            assert version.time_invoiced == expected_invoiced[version.id]
+
+    # Everything has been invoiced until now
+    assert utils.calculate_period_usage(project_ids=[p.id for p in projects], now=now) == {
+        project.id: 0.0
+        for project in projects
+        if any(version.time_deleted is None for version in project.file_versions)
+    }
+
+
 # format_timestamp
 
 
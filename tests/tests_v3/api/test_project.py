@@ -12,7 +12,6 @@ import unittest.mock
 
 # Installed
 import boto3
-import flask_mail
 import werkzeug
 import sqlalchemy
 
@@ -754,7 +753,7 @@ def test_projectstatus_set_project_to_available_no_mail(module_client, boto3_ses
 
     public_project_id = response.json.get("project_id")
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         with unittest.mock.patch.object(
             dds_web.api.user.AddUser, "compose_and_send_email_to_user"
         ) as mock_mail_func:
@@ -1782,6 +1781,9 @@ def test_email_project_release(module_client, boto3_session):
     # num of researchers that will receive email
     num_users = models.ProjectUsers.query.filter_by(project_id=project.id).count()
 
+    # Send the emails already in the outbox
+    dds_web.utils.send_outbox_emails()
+
     # Release project and check email
     with mail.record_messages() as outbox:
         response = module_client.post(
@@ -1790,6 +1792,9 @@ def test_email_project_release(module_client, boto3_session):
             query_string={"project": public_project_id},
             json={"new_status": "Available", "deadline": 10, "send_email": True},
         )
+        # The emails are added to the outbox and sent by the dispatcher
+        assert len(outbox) == 0
+        dds_web.utils.send_outbox_emails()
         assert len(outbox) == num_users  # nº of Emails informing researchers
         assert "Project made available by" in outbox[-1].subject
 
@@ -7,7 +7,6 @@ from _pytest.logging import LogCaptureFixture
 
 # Installed
 import flask
-import flask_mail
 import itsdangerous
 import pytest
 
@@ -54,7 +53,7 @@ def create_delete_request(email_str):
 
 def test_del_self_nouser(client):
     """Request self deletion without user"""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.delete(
             tests.DDSEndpoint.USER_DELETE_SELF,
             headers=tests.DEFAULT_HEADER,
@@ -67,7 +66,7 @@ def test_del_self_nouser(client):
 
 def test_del_self(client):
     """Request self deletion."""
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.delete(
             tests.DDSEndpoint.USER_DELETE_SELF,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["delete_me_researcher"]).token(client),
@@ -84,7 +83,7 @@ def test_del_self(client):
 
     assert del_req is not None
 
-    with unittest.mock.patch.object(flask_mail.Mail, "send") as mock_mail_send:
+    with unittest.mock.patch.object(dds_web.utils, "queue_email") as mock_mail_send:
         response = client.delete(
             tests.DDSEndpoint.USER_DELETE_SELF,
             headers=tests.UserAuth(tests.USER_CREDENTIALS["delete_me_researcher"]).token(client),